@@ -4,12 +4,17 @@ import re
 import pymysql
 from sqlalchemy import create_engine
 import warnings
-import mplfinance.original_flavor as mpf
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from matplotlib.patches import Rectangle
 import numpy as np
 import efinance as ef
+from stock_store import load_price_panel
+from chart_render import ohlc_arrays, draw_candlesticks, draw_volume, draw_boxes
+from indicators import rolling_mean, cross_above, cross_below, shift
+from indicator_store import load_indicators
+from volume_spike import SPIKE_MULTIPLE
+from holder_engine import stock_holder_reports
+from chart_export import export_charts
 
 warnings.filterwarnings('ignore')
 
@@ -28,42 +33,81 @@ plt.rcParams['axes.unicode_minus'] = False
 
 
 def get_holder_data(stock_name, data_dir="下载数据"):
-    """获取股东人数数据"""
-    # 读取股东人数统计文件
-    filepath = os.path.join(data_dir, '股东人数统计.xlsx')
-    if not os.path.exists(filepath):
-        print(f"未找到股东人数统计文件: {filepath}")
-        return None
-        
-    holder_data = pd.read_excel(filepath)
-    
-    # 筛选指定股票名称的数据
-    stock_holder_data = holder_data[holder_data['股票名称'] == stock_name]
-    
-    if stock_holder_data.empty:
+    """获取股东人数数据，以公告后可用日期为索引"""
+    holder_df = stock_holder_reports(stock_name=stock_name, data_dir=data_dir)
+    if holder_df is None:
         print(f"未找到股票名称为{stock_name}的股东人数数据")
-        return None
-        
-    # 选择需要的列并重命名
-    # 从宽格式转换为长格式，日期作为一列，股东人数作为一列
-    holder_df = stock_holder_data.melt(
-        id_vars=['股票代码', '股票名称'], 
-        var_name='Date', 
-        value_name='HolderCount'
-    )
-    
-    # 转换日期格式并设置为索引
-    holder_df['Date'] = pd.to_datetime(holder_df['Date'])
-    holder_df = holder_df.set_index('Date')
-    
-    # 按日期排序
-    holder_df = holder_df.sort_index()
-    
     return holder_df
 
 
-def find_average_line_cross_stocks(stock_name=None, stock_code=None):
-    """查找连续7天或以上上涨且成交量连续递增的股票"""
+def scan_average_line_cross(windows=(60, 90, 120), lookback=5, panel=None):
+    """在全市场扫描均线金叉、死叉及多头排列形成的股票
+
+    所有股票的均线通过全市场前缀和一次计算，只检查截至最新交易日的最近 lookback 个交易日。
+    返回命中列表，每个事件一条：股票、事件类型、快慢均线及发生日期（按日期倒序）。
+    """
+    try:
+        if panel is None:
+            panel = load_price_panel(fields=('close_price',))
+        if panel.n_rows == 0:
+            print("数据库中没有数据")
+            return []
+        
+        close = panel.values('close_price')
+        offsets = panel.offsets
+        mas = {window: rolling_mean(close, window, offsets) for window in windows}
+        
+        # 只在最近 lookback 个交易日内查找事件
+        calendar = panel.calendar()
+        start_day = calendar[max(len(calendar) - lookback, 0)]
+        in_window = panel.day >= start_day
+        
+        events = []
+        for pos, fast in enumerate(windows):
+            for slow in windows[pos + 1:]:
+                events.append(('金叉', fast, slow, cross_above(mas[fast], mas[slow], offsets)))
+                events.append(('死叉', fast, slow, cross_below(mas[fast], mas[slow], offsets)))
+        
+        # 多头排列：短期均线依次在长期均线之上，且当日刚刚形成
+        # 前一日全部均线都已有值才算形成，避免最长均线刚满窗口的第一天被当作新形成的多头排列
+        with np.errstate(invalid='ignore'):
+            bullish = np.ones(panel.n_rows, dtype=bool)
+            for fast, slow in zip(windows[:-1], windows[1:]):
+                bullish &= mas[fast] > mas[slow]
+        defined = np.ones(panel.n_rows, dtype=bool)
+        for window in windows:
+            defined &= np.isfinite(mas[window])
+        bullish_start = bullish & (shift(bullish, offsets, fill=0) == 0) & (shift(defined, offsets, fill=0) == 1)
+        events.append(('多头排列', windows[0], windows[-1], bullish_start))
+        
+        stock_ids = panel.stock_ids()
+        results = []
+        for event, fast, slow, flags in events:
+            for row in np.nonzero(flags & in_window)[0]:
+                stock_idx = stock_ids[row]
+                results.append({
+                    'stock_name': panel.names[stock_idx],
+                    'stock_code': panel.codes[stock_idx],
+                    'event': event,
+                    'fast_window': fast,
+                    'slow_window': slow,
+                    'cross_date': pd.Timestamp(panel.day[row].astype('datetime64[D]')).date(),
+                    'close_price': float(close[row])
+                })
+        
+        results.sort(key=lambda x: (x['cross_date'], x['stock_code']), reverse=True)
+        print(f"最近 {lookback} 个交易日共发现 {len(results)} 个均线事件")
+        return results
+    except Exception as e:
+        print(f"扫描均线交叉时出错: {e}")
+        return []
+
+
+def find_average_line_cross_stocks(stock_name=None, stock_code=None, show=True):
+    """绘制单只股票的K线、60/90/120日均线、成交量和股东人数图
+
+    show=False 时不弹出窗口，返回Figure（可作为 chart_export.export_charts 的绘图函数），出错时返回None。
+    """
     try:
         # 创建数据库连接
         engine = create_engine(f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}?charset={DB_CONFIG['charset']}")
@@ -127,13 +171,21 @@ def find_average_line_cross_stocks(stock_name=None, stock_code=None):
             'volume': 'Volume'
         }, inplace=True)
         
-        # 计算移动平均线
-        df['MA60'] = df['Close'].rolling(window=60).mean()
-        df['MA90'] = df['Close'].rolling(window=90).mean()
-        df['MA120'] = df['Close'].rolling(window=120).mean()
-        
-        # 计算成交量的20日移动平均线
-        df['Volume_MA20'] = df['Volume'].rolling(window=20).mean()
+        # 优先读取导入时增量维护的均线，指标表与K线不一致时再按全部历史重新计算
+        indicator_df = load_indicators(stock_code, columns=['ma60', 'ma90', 'ma120', 'vol_ma20'], engine=engine)
+        if indicator_df.index.equals(df.index):
+            df['MA60'] = indicator_df['ma60']
+            df['MA90'] = indicator_df['ma90']
+            df['MA120'] = indicator_df['ma120']
+            df['Volume_MA20'] = indicator_df['vol_ma20']
+        else:
+            # 计算移动平均线
+            df['MA60'] = df['Close'].rolling(window=60).mean()
+            df['MA90'] = df['Close'].rolling(window=90).mean()
+            df['MA120'] = df['Close'].rolling(window=120).mean()
+            
+            # 计算成交量的20日移动平均线
+            df['Volume_MA20'] = df['Volume'].rolling(window=20).mean()
         
         # 删除包含NaN的行（由于计算移动平均线导致的前几行缺失值）
         df.dropna(inplace=True)
@@ -142,27 +194,12 @@ def find_average_line_cross_stocks(stock_name=None, stock_code=None):
         fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(16, 10), gridspec_kw={"height_ratios": [3, 1, 1]})
         
         # 准备OHLC数据，需要将日期转换为数字格式
-        ohlc_data = []
-        date_nums = []
-        
-        for i in range(len(df)):
-            date_num = mdates.date2num(df.index[i])
-            date_nums.append(date_num)
-            open_price = df['Open'].iloc[i]
-            high_price = df['High'].iloc[i]
-            low_price = df['Low'].iloc[i]
-            close_price = df['Close'].iloc[i]
-            ohlc_data.append([date_num, open_price, high_price, low_price, close_price])
+        date_nums, open_prices, high_prices, low_prices, close_prices = ohlc_arrays(df)
         
-        # 上层：蜡烛图
-        mpf.candlestick_ohlc(
-            ax1, 
-            ohlc_data,  # 格式：[时间戳, O, H, L, C]
-            width=0.6,  # 蜡烛宽度
-            colorup="red",  # 上涨（收盘价>开盘价）颜色
-            colordown="green",  # 下跌颜色
-            alpha=0.8  # 透明度
-        )
+        # 上层：蜡烛图，实体和影线各为一个图元集合
+        draw_candlesticks(ax1, date_nums, open_prices, high_prices, low_prices, close_prices,
+                          width=0.6,  # 蜡烛宽度
+                          alpha=0.8)  # 透明度
         
         # 绘制移动平均线
         ax1.plot(date_nums, df['MA60'], color='blue', linewidth=1.5, label='60日均线')
@@ -178,9 +215,7 @@ def find_average_line_cross_stocks(stock_name=None, stock_code=None):
         ax1.xaxis.set_major_locator(mdates.DayLocator(bymonthday=[1, 10, 20]))  # 只显示每月1号、10号、20号
         
         # 中层：成交量
-        ax2.bar(date_nums, df["Volume"], 
-                width=0.6, 
-                color=df.apply(lambda x: "red" if x.Close > x.Open else "green", axis=1))
+        draw_volume(ax2, date_nums, df["Volume"].values, open_prices, close_prices, width=0.6)
         ax2.set_ylabel("Volume", fontsize=12)
         ax2.grid(True, alpha=0.3)
         
@@ -188,26 +223,12 @@ def find_average_line_cross_stocks(stock_name=None, stock_code=None):
         ax2.plot(date_nums, df['Volume_MA20'], color='blue', linewidth=1.5, label='20日均量')
         ax2.legend()
         
-        # 标注成交量大于20日均线3倍以上的日期
-        high_volume_indices = df[df['Volume'] > 3 * df['Volume_MA20']].index
+        # 标注成交量大于20日均线3倍以上的日期（倍数与全市场放量扫描一致）
+        spike = (df['Volume'] > SPIKE_MULTIPLE * df['Volume_MA20']).values
         
-        for date in high_volume_indices:
-            idx = df.index.get_loc(date)
-            if isinstance(idx, int) and idx < len(date_nums):
-                volume = df['Volume'].iloc[idx]
-                # 绘制虚线框标注
-                date_num = date_nums[idx]
-                # 绘制矩形框 (left, bottom, width, height)
-                rect = Rectangle(
-                    (float(date_num) - 0.3, 0),  # 略微调整位置使框居中
-                    0.6,  # 宽度与柱状图一致
-                    float(volume),  # 高度为成交量值
-                    linewidth=1,
-                    linestyle='--',
-                    edgecolor='blue',
-                    facecolor='none'
-                )
-                ax2.add_patch(rect)
+        # 绘制虚线框标注，宽度与柱状图一致，高度为成交量值
+        draw_boxes(ax2, date_nums[spike], np.zeros(spike.sum()), df['Volume'].values[spike], width=0.6,
+                   linewidths=1, linestyles='--', edgecolors='blue')
         
         # 格式化x轴日期显示，与上图保持一致
         ax2.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
@@ -216,11 +237,11 @@ def find_average_line_cross_stocks(stock_name=None, stock_code=None):
         # 下层：股东人数变化
         holder_data = get_holder_data(stock_name)
         if holder_data is not None and not holder_data.empty:
-            # 将股东人数数据与股价数据的日期对齐
-            aligned_data = holder_data.reindex(df.index, method='nearest')
+            # 将股东人数按公告后可用日期向后填充到交易日，公告前只显示上一期的值
+            aligned_data = holder_data.reindex(df.index, method='ffill')
             
             # 将日期转换为数字格式以匹配其他子图
-            holder_date_nums = [mdates.date2num(date) for date in aligned_data.index]
+            holder_date_nums = mdates.date2num(aligned_data.index.values)
             
             # 绘制股东人数变化曲线
             ax3.plot(holder_date_nums, aligned_data['HolderCount'], color='blue', linewidth=1.5)
@@ -271,13 +292,29 @@ def find_average_line_cross_stocks(stock_name=None, stock_code=None):
         plt.setp(ax3.xaxis.get_majorticklabels(), rotation=45)
         
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
         
     except Exception as e:
         print(f"绘制 {stock_name} 蜡烛图时出错: {e}")
 
 if __name__ == "__main__":
-    # 可以只提供股票名称
-    find_average_line_cross_stocks(stock_name='中宠股份')
-    # 或者只提供股票代码
-    # find_average_line_cross_stocks(stock_code='000001')
\ No newline at end of file
+    # 批量导出图片的目录，多进程无界面绘制，生成带缩略图的 index.html
+    EXPORT_DIR = os.path.join("下载数据", "均线交叉图")
+
+    # 全市场扫描最近5个交易日的均线金叉/死叉/多头排列，只为命中金叉和多头排列的股票绘图
+    cross_events = scan_average_line_cross(windows=(60, 90, 120), lookback=5)
+    hits = {}
+    for event in cross_events:
+        if event['event'] in ('金叉', '多头排列'):
+            print(f"{event['stock_name']}({event['stock_code']}) {event['cross_date']} "
+                  f"MA{event['fast_window']}/MA{event['slow_window']} {event['event']}")
+            hits.setdefault(event['stock_code'], event['stock_name'])
+
+    if hits:
+        print(f"\n共 {len(hits)} 只股票出现金叉或多头排列，开始批量导出蜡烛图...")
+        jobs = [('{}({})'.format(name, code), {'stock_name': name, 'stock_code': code}) for code, name in hits.items()]
+        export_charts(find_average_line_cross_stocks, jobs, output_dir=EXPORT_DIR, title='均线金叉及多头排列股票')
+    else:
+        print("最近5个交易日没有股票出现均线金叉或多头排列")
@@ -0,0 +1,280 @@
+import numpy as np
+import pandas as pd
+import time
+import warnings
+from stock_store import load_price_panel
+from indicators import cross_above, cross_below
+from pivots import pivot_rows
+from metrics import sharpe_ratio, max_drawdown
+from tradability import BUY_BLOCKED, SELL_BLOCKED, tradability_flags, allowed
+from screener import IndicatorCache, compile_conditions
+
+warnings.filterwarnings('ignore')
+
+# 交易成本：佣金双边收取（最低5元），印花税仅卖出收取（2023年8月起为万分之五）
+COMMISSION_RATE = 0.00025
+MIN_COMMISSION = 5.0
+STAMP_DUTY = 0.0005
+# 单笔交易金额，用于把最低佣金折算为费率
+TRADE_VALUE = 100000.0
+
+# 没有设置持有期时的最长持有K线数
+MAX_HOLD = 250
+
+
+def blocking_flags(panel):
+    """买入、卖出受阻的K线：停牌；开盘即涨停（买不进）；一字跌停（卖不出）
+
+    由可交易性标志按位判断，返回 (buy_blocked, sell_blocked)，均为与面板行对齐的布尔数组。
+    """
+    flags = tradability_flags(panel)
+    return ~allowed(flags, BUY_BLOCKED), ~allowed(flags, SELL_BLOCKED)
+
+
+def screen_signals(panel, conditions):
+    """把screener的条件声明在整个面板上求值，返回每根K线收盘时是否发出信号"""
+    cache = IndicatorCache(panel)
+    signal = np.ones(panel.n_rows, dtype=bool)
+    for _, func, params in compile_conditions(conditions):
+        signal &= func(cache, **params)
+    return signal
+
+
+def streak_signals(panel, min_days=7, check_volume=False, cache=None):
+    """bottom_7_red_bar 的信号：连涨天数达到 min_days 的当天（只在首次达到时发出）
+
+    cache 可传入共享的 IndicatorCache，多组参数复用同一份连涨天数。
+    """
+    cache = cache if cache is not None else IndicatorCache(panel)
+    streak = cache.up_streak()
+    signal = streak == min_days
+    if check_volume:
+        signal &= cache.volume_run() >= streak
+    return signal
+
+
+def ma_cross_signals(panel, fast=60, slow=90, cache=None):
+    """average_line_cross 的信号：快线上穿慢线为买入信号，下穿为卖出信号，返回 (entry, exit)"""
+    cache = cache if cache is not None else IndicatorCache(panel)
+    fast_ma = cache.ma(fast)
+    slow_ma = cache.ma(slow)
+    return cross_above(fast_ma, slow_ma, panel.offsets), cross_below(fast_ma, slow_ma, panel.offsets)
+
+
+def spike_signals(panel, multiple=3.0, window=20, cache=None):
+    """放量信号：成交量达到 window 日均量的 multiple 倍（与 volume_spike 的成交量口径一致）"""
+    cache = cache if cache is not None else IndicatorCache(panel)
+    with np.errstate(invalid='ignore'):
+        return cache.volume_ratio(window) >= multiple
+
+
+def pivot_low_signals(panel, order=30):
+    """阶段低点确认信号：低点之后走完 order 根K线的当天发出（order 对应 candle_graph 的 PEAK_VALLEY_WINDOW）"""
+    _, low_rows = pivot_rows(panel.values('close_price'), panel.offsets, (order,))[order]
+    confirm_rows = low_rows + order
+    last_rows = panel.offsets[1:][panel.stock_ids()[low_rows]] - 1
+    signal = np.zeros(panel.n_rows, dtype=bool)
+    signal[confirm_rows[confirm_rows <= last_rows]] = True
+    return signal
+
+
+def _as_rows(panel, signals):
+    """信号可以是与面板行对齐的一维数组，也可以是 股票×交易日 的二维矩阵"""
+    signals = np.asarray(signals)
+    if signals.ndim == 2:
+        signals = signals[panel.stock_ids(), panel.date_index()]
+    return signals.astype(bool)
+
+
+def run_backtest(panel, entry_signals, exit_signals=None, holding_days=5, stop_loss=None, take_profit=None,
+                 allow_overlap=False, slippage=0.0, commission=COMMISSION_RATE, min_commission=MIN_COMMISSION,
+                 stamp_duty=STAMP_DUTY, trade_value=TRADE_VALUE, max_hold=MAX_HOLD, verbose=True):
+    """向量化的逐信号回测，返回 (交易明细DataFrame, 日度净值DataFrame)
+
+    - 收盘出现信号，次一交易日开盘买入；次日停牌或开盘涨停则放弃该信号。
+    - 卖出：持有 holding_days 根K线后开盘卖出；盘中触及止损/止盈价成交（跳空则按开盘价）；
+      exit_signals 在收盘出现则次日开盘卖出。T+1：买入当天不能卖出。
+    - 停牌或一字跌停时卖不出，顺延到下一根可交易的K线开盘卖出。
+    - allow_overlap=False 时同一只股票持仓期间的新信号被忽略。
+    全部信号按持有天数逐日推进，每一步只对仍在持仓的信号做数组运算。
+    """
+    begin = time.perf_counter()
+    entry_signals = _as_rows(panel, entry_signals)
+    exit_signals = _as_rows(panel, exit_signals) if exit_signals is not None else np.zeros(panel.n_rows, dtype=bool)
+    open_price = panel.values('open_price')
+    high = panel.values('high_price')
+    low = panel.values('low_price')
+    close = panel.values('close_price')
+    buy_blocked, sell_blocked = blocking_flags(panel)
+    stock_ids = panel.stock_ids()
+    date_index = panel.date_index()
+    last_rows = (panel.offsets[1:] - 1)[stock_ids]
+
+    # 次一交易日开盘买入：下一行须属于同一只股票且正好是下一个交易日
+    signal_rows = np.nonzero(entry_signals)[0]
+    signal_rows = signal_rows[signal_rows < last_rows[signal_rows]]
+    entry_rows = signal_rows + 1
+    keep = (date_index[entry_rows] == date_index[signal_rows] + 1) & ~buy_blocked[entry_rows]
+    signal_rows, entry_rows = signal_rows[keep], entry_rows[keep]
+    entry_prices = open_price[entry_rows] * (1 + slippage)
+
+    n = len(entry_rows)
+    exit_rows = np.full(n, -1, dtype=np.int64)
+    exit_prices = np.full(n, np.nan)
+    exit_reasons = np.full(n, '', dtype=object)
+    pending = np.zeros(n, dtype=bool)
+    stop_prices = entry_prices * (1 - stop_loss) if stop_loss is not None else np.full(n, -np.inf)
+    target_prices = entry_prices * (1 + take_profit) if take_profit is not None else np.full(n, np.inf)
+    pending_reason = np.full(n, '', dtype=object)
+    # 买入当天收盘出现卖出信号，次日开盘卖出
+    pending[exit_signals[entry_rows]] = True
+    pending_reason[pending] = 'signal'
+    limit = holding_days if holding_days is not None else max_hold
+    trade_last_rows = last_rows[entry_rows]
+
+    active = np.arange(n)
+    k = 0
+    while len(active):
+        k += 1
+        rows = entry_rows[active] + k
+        # 数据结束（退市或截至最新交易日）仍未卖出，按最后收盘价计
+        ended = rows > trade_last_rows[active]
+        if ended.any():
+            done = active[ended]
+            exit_rows[done] = trade_last_rows[done]
+            exit_prices[done] = close[trade_last_rows[done]]
+            exit_reasons[done] = 'end'
+            active, rows = active[~ended], rows[~ended]
+
+        if k >= limit:
+            pending_reason[active[~pending[active]]] = 'holding' if holding_days is not None else 'max_hold'
+            pending[active] = True
+        blocked = sell_blocked[rows]
+        sell_open = pending[active] & ~blocked
+        # 盘中止损/止盈：开盘已越过则按开盘价成交
+        hit_stop = ~sell_open & ~blocked & (low[rows] <= stop_prices[active])
+        hit_target = ~sell_open & ~blocked & ~hit_stop & (high[rows] >= target_prices[active])
+
+        for mask, price, reason in (
+                (sell_open, open_price[rows], None),
+                (hit_stop, np.minimum(open_price[rows], stop_prices[active]), 'stop'),
+                (hit_target, np.maximum(open_price[rows], target_prices[active]), 'target')):
+            done = active[mask]
+            exit_rows[done] = rows[mask]
+            exit_prices[done] = price[mask] * (1 - slippage)
+            exit_reasons[done] = pending_reason[done] if reason is None else reason
+
+        finished = sell_open | hit_stop | hit_target
+        active, rows = active[~finished], rows[~finished]
+        # 当日收盘出现卖出信号，次日开盘卖出
+        new_pending = exit_signals[rows] & ~pending[active]
+        pending_reason[active[new_pending]] = 'signal'
+        pending[active[new_pending]] = True
+
+    trades = pd.DataFrame({
+        'stock_code': panel.codes[stock_ids[entry_rows]],
+        'stock_name': panel.names[stock_ids[entry_rows]],
+        'signal_date': panel.day[signal_rows].astype('datetime64[D]'),
+        'entry_date': panel.day[entry_rows].astype('datetime64[D]'),
+        'entry_price': entry_prices,
+        'exit_date': panel.day[exit_rows].astype('datetime64[D]'),
+        'exit_price': exit_prices,
+        'exit_reason': exit_reasons,
+        'bars_held': exit_rows - entry_rows,
+        'entry_row': entry_rows,
+        'exit_row': exit_rows
+    })
+
+    if not allow_overlap and n:
+        # 同一只股票上一笔卖出之前的信号不开新仓（不同股票的行号区间互不重叠，可顺序扫描）
+        keep = np.zeros(n, dtype=bool)
+        last_exit = -1
+        for i, (entry_row, exit_row) in enumerate(zip(entry_rows, exit_rows)):
+            if entry_row > last_exit:
+                keep[i] = True
+                last_exit = exit_row
+        trades = trades[keep].reset_index(drop=True)
+
+    # 交易成本：最低佣金按单笔金额折算为费率
+    commission_rate = max(commission, min_commission / trade_value) if trade_value else commission
+    buy_cost = commission_rate
+    sell_cost = commission_rate + stamp_duty
+    trades['gross_return'] = (trades['exit_price'] / trades['entry_price'] - 1) * 100
+    trades['net_return'] = (trades['exit_price'] * (1 - sell_cost) / (trades['entry_price'] * (1 + buy_cost)) - 1) * 100
+
+    equity = equity_curve(panel, trades, buy_cost, sell_cost)
+    if verbose:
+        print(f"回测完成：{len(signal_rows)} 个有效信号，{len(trades)} 笔交易，耗时 {time.perf_counter() - begin:.2f} 秒")
+    return trades, equity
+
+
+def equity_curve(panel, trades, buy_cost=0.0, sell_cost=0.0):
+    """全部持仓等权的日度收益和净值
+
+    每笔交易逐日按收盘价盯市：买入日为 开盘买入价->收盘，持有期间为 收盘->收盘，卖出日为 前收盘->卖出价。
+    每天的组合收益为当日全部持仓收益的平均值，成本计入买入日和卖出日。
+    """
+    calendar = panel.calendar()
+    if len(trades) == 0:
+        return pd.DataFrame({'trade_date': calendar.astype('datetime64[D]'), 'positions': 0,
+                             'daily_return': 0.0, 'equity': 1.0})
+    close = panel.values('close_price')
+    entry_rows = trades['entry_row'].values
+    exit_rows = trades['exit_row'].values
+    lengths = exit_rows - entry_rows + 1
+    trade_ids = np.repeat(np.arange(len(trades)), lengths)
+    rows = np.repeat(entry_rows, lengths) + (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+    start_price = close[np.maximum(rows - 1, 0)].copy()
+    end_price = close[rows].copy()
+    first = rows == entry_rows[trade_ids]
+    last = rows == exit_rows[trade_ids]
+    start_price[first] = trades['entry_price'].values[trade_ids[first]]
+    # 以收盘价结束的（数据结束）卖出价即收盘价，两者一致
+    end_price[last] = trades['exit_price'].values[trade_ids[last]]
+    daily = end_price / start_price - 1
+    daily[first] -= buy_cost
+    daily[last] -= sell_cost
+
+    day_index = panel.date_index()[rows]
+    counts = np.bincount(day_index, minlength=len(calendar))
+    sums = np.bincount(day_index, weights=daily, minlength=len(calendar))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+    return pd.DataFrame({
+        'trade_date': calendar.astype('datetime64[D]'),
+        'positions': counts,
+        'daily_return': mean,
+        'equity': np.cumprod(1 + mean)
+    })
+
+
+def summarize(trades, equity):
+    """交易胜率、平均收益和净值最大回撤等汇总指标"""
+    if len(trades) == 0:
+        return {}
+    curve = equity['equity'].values
+    daily_return = equity['daily_return'].values
+    return {
+        '交易笔数': len(trades),
+        '胜率(%)': (trades['net_return'] > 0).mean() * 100,
+        '平均收益(%)': trades['net_return'].mean(),
+        '平均持有K线数': trades['bars_held'].mean(),
+        '净值': curve[-1],
+        '夏普比率': sharpe_ratio(daily_return),
+        '最大回撤(%)': max_drawdown(daily_return) * 100,
+        '卖出原因': trades['exit_reason'].value_counts().to_dict()
+    }
+
+
+if __name__ == '__main__':
+    panel = load_price_panel()
+
+    print("=== 7连阳信号，持有5天，止损8% ===")
+    trades, equity = run_backtest(panel, streak_signals(panel, min_days=7), holding_days=5, stop_loss=0.08)
+    print(summarize(trades, equity))
+
+    print("=== 60/90日均线金叉买入、死叉卖出 ===")
+    entry, exit_ = ma_cross_signals(panel, 60, 90)
+    trades, equity = run_backtest(panel, entry, exit_, holding_days=None, stop_loss=0.1)
+    print(summarize(trades, equity))
@@ -4,9 +4,14 @@ import re
 import pymysql
 from sqlalchemy import create_engine
 import warnings
-import mplfinance.original_flavor as mpf
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from stock_store import load_price_panel
+from chart_render import ohlc_arrays, draw_candlesticks, draw_volume
+from streak_engine import rising_streaks
+from screen_history import run_screen_cached, screen_params, screen_diff
+from chart_export import export_charts
+from chart_cache import ChartCache, chart_key
 
 warnings.filterwarnings('ignore')
 
@@ -24,161 +29,134 @@ plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False
 
 
-def find_consecutive_rising_stocks(check_volume=True):
-    """查找连续7天或以上上涨且成交量连续递增的股票"""
+def find_consecutive_rising_stocks(check_volume=True, min_days=7):
+    """查找连续min_days天（默认7天）或以上上涨且成交量连续递增的股票"""
     try:
-        # 创建数据库连接
-        engine = create_engine(f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}?charset={DB_CONFIG['charset']}")
+        # 以紧凑类型加载全市场涨跌幅和成交量
+        panel = load_price_panel(fields=('change_percent', 'volume'))
         
-        # 查询所有股票的交易数据（包含成交量）
-        query = """
-        SELECT stock_name, stock_code, trade_date, change_percent, volume
-        FROM stock_data 
-        ORDER BY stock_code, trade_date
-        """
-        df = pd.read_sql(query, engine)
-        
-        if df.empty:
+        if panel.n_rows == 0:
             print("数据库中没有数据")
             return []
         
-        # 按股票代码分组处理
+        # 一次性计算全市场每只股票的最长连涨区间及其中成交量递增情况
+        streaks = rising_streaks(panel, min_days=min_days, check_volume=False)
+        
         results = []
-        for stock_code, group in df.groupby('stock_code'):
-            # 按日期排序
-            group = group.sort_values('trade_date').reset_index(drop=True)
-            
-            # 查找连续上涨的天数
-            consecutive_days = 0
-            max_consecutive_days = 0
-            start_date = None
-            max_start_date = None
+        for row in streaks.itertuples(index=False):
+            start_date = pd.Timestamp(row.start_date).date()
+            # 成交量递增至少需要2天的数据才能比较（min_days 小于2时可能出现）
+            if check_volume and row.consecutive_days <= 1:
+                print(f"股票 {row.stock_name}({row.stock_code}) 连续上涨 {row.consecutive_days} 天，但上涨区间数据不足，已排除")
+                continue
+            if check_volume and not row.volume_increasing:
+                print(f"股票 {row.stock_name}({row.stock_code}) 连续上涨 {row.consecutive_days} 天，但成交量未连续递增，已排除")
+                continue
             
-            for i in range(len(group)):
-                if group.loc[i, 'change_percent'] > 0:  # 上涨
-                    if consecutive_days == 0:  # 新的上涨周期开始
-                        start_date = group.loc[i, 'trade_date']
-                    consecutive_days += 1
-                    
-                    # 更新最大连续上涨天数和起始日期
-                    if consecutive_days > max_consecutive_days:
-                        max_consecutive_days = consecutive_days
-                        max_start_date = start_date
-                else:  # 下跌或持平，重置计数
-                    consecutive_days = 0
-                    start_date = None
-            
-            # 如果连续上涨天数大于等于7天
-            if max_consecutive_days >= 7:
-                # 如果不需要检查成交量，则直接添加到结果中
-                if not check_volume:
-                    stock_name = group.loc[0, 'stock_name']
-                    results.append({
-                        'stock_name': stock_name,
-                        'stock_code': stock_code,
-                        'consecutive_days': max_consecutive_days,
-                        'start_date': max_start_date
-                    })
-                    print(f"股票 {stock_name}({stock_code}) 连续上涨 {max_consecutive_days} 天，起始日期: {max_start_date}")
-                else:
-                    # 验证成交量是否也连续递增
-                    start_idx = None
-                    for i, date in enumerate(group['trade_date']):
-                        if date == max_start_date:
-                            start_idx = i
-                            break
-                    
-                    if start_idx is not None:
-                        end_idx = min(start_idx + max_consecutive_days, len(group))
-                        # 检查该区间内成交量是否连续递增
-                        volume_increasing = True
-                        volume_series = group['volume'].iloc[start_idx:end_idx]
-                        
-                        # 检查成交量是否连续递增（每个值都比前一个值大）
-                        for j in range(1, len(volume_series)):
-                            if volume_series.iloc[j] <= volume_series.iloc[j-1]:
-                                volume_increasing = False
-                                break
-                        
-                        # 只有当成交量也连续递增时才记录结果
-                        if volume_increasing and len(volume_series) > 1:  # 确保至少有2天的数据可以比较
-                            stock_name = group.loc[0, 'stock_name']
-                            results.append({
-                                'stock_name': stock_name,
-                                'stock_code': stock_code,
-                                'consecutive_days': max_consecutive_days,
-                                'start_date': max_start_date
-                            })
-                            print(f"股票 {stock_name}({stock_code}) 连续上涨 {max_consecutive_days} 天且成交量连续递增，起始日期: {max_start_date}")
-                        elif len(volume_series) <= 1:
-                            stock_name = group.loc[0, 'stock_name']
-                            print(f"股票 {stock_name}({stock_code}) 连续上涨 {max_consecutive_days} 天，但上涨区间数据不足，已排除")
-                        else:
-                            stock_name = group.loc[0, 'stock_name']
-                            print(f"股票 {stock_name}({stock_code}) 连续上涨 {max_consecutive_days} 天，但成交量未连续递增，已排除")
+            results.append({
+                'stock_name': row.stock_name,
+                'stock_code': row.stock_code,
+                'consecutive_days': int(row.consecutive_days),
+                'start_date': start_date
+            })
+            if check_volume:
+                print(f"股票 {row.stock_name}({row.stock_code}) 连续上涨 {row.consecutive_days} 天且成交量连续递增，起始日期: {start_date}")
+            else:
+                print(f"股票 {row.stock_name}({row.stock_code}) 连续上涨 {row.consecutive_days} 天，起始日期: {start_date}")
         
         return results
     except Exception as e:
         print(f"查找连续上涨股票时出错: {e}")
         return []
 
-def plot_candlestick_chart(stock_name, stock_code, start_date=None, consecutive_days=None):
-    """为指定股票绘制蜡烛图，并标注连续上涨区间"""
+def find_rising_stocks_on(as_of=None, check_volume=True, min_days=7):
+    """查找截至 as_of（默认最新交易日）连续上涨min_days天或以上的股票，结果按交易日保存
+
+    同一交易日、同样参数且数据未变时直接读取保存的结果；同时打印与上一次保存结果相比新进入和退出的股票。
+    """
     try:
-        # 创建数据库连接
-        engine = create_engine(f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}?charset={DB_CONFIG['charset']}")
+        conditions = [{'type': 'streak', 'min_days': min_days}]
+        if check_volume:
+            conditions.append({'type': 'volume_increasing'})
+        screen_name = '{}连阳{}'.format(min_days, '放量' if check_volume else '')
+        hits, as_of = run_screen_cached(screen_name, conditions, as_of=as_of)
+        
+        results = []
+        for row in hits.itertuples(index=False):
+            start_date = pd.Timestamp(row.streak_start_date).date()
+            results.append({
+                'stock_name': row.stock_name,
+                'stock_code': row.stock_code,
+                'consecutive_days': int(row.up_streak),
+                'start_date': start_date
+            })
+            print(f"股票 {row.stock_name}({row.stock_code}) 截至 {as_of} 已连续上涨 {int(row.up_streak)} 天，起始日期: {start_date}")
         
-        # 查询指定股票的所有历史数据
-        query = """
-        SELECT trade_date, open_price, high_price, low_price, close_price, volume
-        FROM stock_data 
-        WHERE stock_code = %s
-        ORDER BY trade_date
-        """
-        df = pd.read_sql(query, engine, params=(stock_code,))
+        diff = screen_diff(screen_name, screen_params(screen_name, conditions), as_of=as_of)
+        if diff is not None and diff['previous'] is not None:
+            print(f"较 {diff['previous']} 新进入: {', '.join(diff['entries']['stock_name']) or '无'}")
+            print(f"较 {diff['previous']} 已退出: {', '.join(diff['exits']['stock_name']) or '无'}")
+        return results
+    except Exception as e:
+        print(f"查找 {as_of} 连续上涨股票时出错: {e}")
+        return []
+
+def load_stock_bars(stock_code):
+    """读取指定股票的全部日K线，以日期为索引，列名为 Open/High/Low/Close/Volume"""
+    # 创建数据库连接
+    engine = create_engine(f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}?charset={DB_CONFIG['charset']}")
+    
+    # 查询指定股票的所有历史数据
+    query = """
+    SELECT trade_date, open_price, high_price, low_price, close_price, volume
+    FROM stock_data 
+    WHERE stock_code = %s
+    ORDER BY trade_date
+    """
+    df = pd.read_sql(query, engine, params=(stock_code,))
+    
+    # 设置日期为索引
+    df['trade_date'] = pd.to_datetime(df['trade_date'])
+    df.set_index('trade_date', inplace=True)
+    
+    # 重命名列以匹配绘图要求
+    df.rename(columns={
+        'open_price': 'Open',
+        'high_price': 'High',
+        'low_price': 'Low',
+        'close_price': 'Close',
+        'volume': 'Volume'
+    }, inplace=True)
+    return df
+
+
+def candlestick_chart_key(stock_name, stock_code, start_date=None, consecutive_days=None):
+    """plot_candlestick_chart 的缓存键：K线数据和连涨标注参数不变时键不变"""
+    return chart_key('plot_candlestick_chart', load_stock_bars(stock_code), stock_name, start_date, consecutive_days)
+
+
+def plot_candlestick_chart(stock_name, stock_code, start_date=None, consecutive_days=None, show=True):
+    """为指定股票绘制蜡烛图，并标注连续上涨区间，返回Figure（出错时返回None）
+
+    show=False 时不弹出窗口，由调用方保存或关闭图形（如 chart_export 批量导出）。
+    """
+    try:
+        df = load_stock_bars(stock_code)
         
         if df.empty:
             print(f"未找到股票 {stock_name}({stock_code}) 的数据")
-            return
-        
-        # 设置日期为索引
-        df['trade_date'] = pd.to_datetime(df['trade_date'])
-        df.set_index('trade_date', inplace=True)
-        
-        # 重命名列以匹配绘图要求
-        df.rename(columns={
-            'open_price': 'Open',
-            'high_price': 'High',
-            'low_price': 'Low',
-            'close_price': 'Close',
-            'volume': 'Volume'
-        }, inplace=True)
+            return None
         
         # 增加图形尺寸以适应更宽的蜡烛图
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(16, 10), gridspec_kw={"height_ratios": [3, 1]})
         
         # 准备OHLC数据，需要将日期转换为数字格式
-        ohlc_data = []
-        date_nums = []
+        date_nums, open_prices, high_prices, low_prices, close_prices = ohlc_arrays(df)
         
-        for i in range(len(df)):
-            date_num = mdates.date2num(df.index[i])
-            date_nums.append(date_num)
-            open_price = df['Open'].iloc[i]
-            high_price = df['High'].iloc[i]
-            low_price = df['Low'].iloc[i]
-            close_price = df['Close'].iloc[i]
-            ohlc_data.append([date_num, open_price, high_price, low_price, close_price])
-        
-        # 上层：蜡烛图
-        mpf.candlestick_ohlc(
-            ax1, 
-            ohlc_data,  # 格式：[时间戳, O, H, L, C]
-            width=0.6,  # 蜡烛宽度
-            colorup="red",  # 上涨（收盘价>开盘价）颜色
-            colordown="green",  # 下跌颜色
-            alpha=0.8  # 透明度
-        )
+        # 上层：蜡烛图，实体和影线各为一个图元集合
+        draw_candlesticks(ax1, date_nums, open_prices, high_prices, low_prices, close_prices,
+                          width=0.6,  # 蜡烛宽度
+                          alpha=0.8)  # 透明度
         
         # 如果提供了连续上涨信息，则绘制虚线框标注
         if start_date is not None and consecutive_days is not None:
@@ -235,9 +213,7 @@ def plot_candlestick_chart(stock_name, stock_code, start_date=None, consecutive_
         ax1.xaxis.set_major_locator(mdates.DayLocator(bymonthday=[1, 10, 20]))  # 只显示每月1号、10号、20号
         
         # 下层：成交量
-        ax2.bar(date_nums, df["Volume"], 
-                width=0.6, 
-                color=df.apply(lambda x: "red" if x.Close > x.Open else "green", axis=1))
+        draw_volume(ax2, date_nums, df["Volume"].values, open_prices, close_prices, width=0.6)
         ax2.set_ylabel("Volume", fontsize=12)
         ax2.grid(True, alpha=0.3)
         
@@ -249,10 +225,13 @@ def plot_candlestick_chart(stock_name, stock_code, start_date=None, consecutive_
         plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
         
         plt.tight_layout()
-        plt.show()
+        if show:
+            plt.show()
+        return fig
         
     except Exception as e:
         print(f"绘制 {stock_name} 蜡烛图时出错: {e}")
+        return None
 
 def query_examples():
     """查询示例"""
@@ -309,15 +288,41 @@ if __name__ == "__main__":
     # False: 仅使用连续上涨天数筛选
     ENABLE_VOLUME_CHECK = False
     
+    # 设置是否只查找截至今天（或 AS_OF 指定的交易日）仍在连涨的股票
+    # True: 只返回截至该交易日仍在延续的连涨，结果按交易日保存，重复查询直接读取
+    # False: 在全部历史中查找出现过的连涨（默认）
+    TODAY_ONLY = False
+    AS_OF = None  # 例如 '2025-01-07'，None 表示最新交易日
+    
+    # 设置是否批量导出图片而不逐个弹出窗口
+    # True: 多进程无界面绘制，保存为PNG/SVG并生成带缩略图的 index.html
+    # False: 逐只弹出蜡烛图窗口
+    EXPORT_CHARTS = True
+    EXPORT_DIR = os.path.join("下载数据", "连涨蜡烛图")
+    
     # 查找连续7天或以上上涨的股票
     if ENABLE_VOLUME_CHECK:
         print("查找连续7天或以上上涨且成交量连续递增的股票...")
     else:
         print("查找连续7天或以上上涨的股票...")
         
-    rising_stocks = find_consecutive_rising_stocks(check_volume=ENABLE_VOLUME_CHECK)
+    if TODAY_ONLY:
+        rising_stocks = find_rising_stocks_on(as_of=AS_OF, check_volume=ENABLE_VOLUME_CHECK)
+    else:
+        rising_stocks = find_consecutive_rising_stocks(check_volume=ENABLE_VOLUME_CHECK)
     
-    if rising_stocks:
+    if rising_stocks and EXPORT_CHARTS:
+        print(f"\n找到 {len(rising_stocks)} 只符合条件的股票，开始批量导出蜡烛图...")
+        jobs = [('{}({})'.format(stock['stock_name'], stock['stock_code']), {
+            'stock_name': stock['stock_name'],
+            'stock_code': stock['stock_code'],
+            'start_date': stock['start_date'],
+            'consecutive_days': stock['consecutive_days']
+        }) for stock in rising_stocks]
+        # K线和连涨区间都没有变化的股票直接取缓存中的图片
+        export_charts(plot_candlestick_chart, jobs, output_dir=EXPORT_DIR, formats=('png', 'svg'),
+                      title='连续上涨股票蜡烛图', cache=ChartCache(), cache_key=candlestick_chart_key)
+    elif rising_stocks:
         print(f"\n找到 {len(rising_stocks)} 只符合条件的股票，开始绘制蜡烛图...")
         # 为每只符合条件的股票绘制蜡烛图
         for stock in rising_stocks:
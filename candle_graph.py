@@ -1,15 +1,43 @@
-import mplfinance.original_flavor as mpf
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from scipy.signal import argrelextrema
 import numpy as np
 import os
 from datetime import datetime
+from pivots import local_extrema
+from holder_engine import stock_holder_reports
+from event_study import load_earnings_events
+from chart_render import (ohlc_arrays, draw_candlesticks, draw_volume, resample_ohlcv, choose_level, bar_width, bar_buckets,
+                          LOD_LEVELS, LEVEL_NAMES, MAX_BARS)
+from chart_cache import chart_key
+
+# 阶段性高点低点检测窗口，值越大检测到的极值点越少（批量入库的窗口见 pivots.PIVOT_ORDERS）
+PEAK_VALLEY_WINDOW = 30
+
+# 长期图上价格标签和财报注释的数量上限，超过时每段相邻K线只保留最高（最低）点和最近一期财报
+MAX_LABELS = 40
+
+# 横轴刻度数上限，两年以内的图按月标注
+MAX_MONTH_TICKS = 24
+
+def bar_pivots(indices, prices, buckets, highest=True, step=1):
+    """把日线上检测到的高点（highest=True）或低点映射到聚合后的K线
+
+    每 step 根相邻K线中有多个点时只保留最高（最低）的一个，返回 [(K线序号, 价格), ...]，价格仍为当日的实际价格。
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    if len(indices) == 0:
+        return []
+    bars = np.asarray(buckets)[indices]
+    values = np.asarray(prices)[indices]
+    points = pd.Series(values).groupby(bars // step)
+    picked = (points.idxmax() if highest else points.idxmin()).values
+    return list(zip(bars[picked], values[picked]))
+
 
 class Map_Drawing():
 
-    def __init__(self, stock_name = '比亚迪',stock_code = '002594',begin_date = '20240101',data_dir="下载数据"):
+    def __init__(self, stock_name = '比亚迪',stock_code = '002594',begin_date = '20240101',data_dir="下载数据",peak_valley_window=PEAK_VALLEY_WINDOW,show=True,cache=None,draw=True,level=None,max_bars=MAX_BARS):
 
         # 设置中文字体支持
         plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
@@ -19,12 +47,30 @@ class Map_Drawing():
         self.stock_code = stock_code
         self.begin_date = begin_date
         self.data_dir = data_dir
+        self.peak_valley_window = peak_valley_window
+        # level 为 None 时按可见区间自动选择日线/周线/月线/季线，使K线数不超过 max_bars；也可指定 'D'/'W'/'M'/'Q'
+        if level is not None and level not in LOD_LEVELS:
+            raise ValueError("level 只能为 {} 之一".format(LOD_LEVELS))
+        self.level = level
+        self.max_bars = max_bars
+        # show=False 时不弹出窗口，绘制好的图形保存在 self.fig 中，由调用方保存或关闭
+        self.show = show
+        self.fig = None
+        # cache 为 chart_cache.ChartCache，输入数据、标注和参数都没有变化时不重新绘制，图片路径保存在 self.image_path 中
+        self.cache = cache
+        self.image_path = None
+        self._price = None
         self.end_date = datetime.now().strftime('%Y%m%d')
 
-        self.graph_draw()
+        if draw:
+            self.draw()
 
     def get_price(self):
         
+        # 同一次绘图中多处用到股价数据，只读取一次Excel
+        if self._price is not None:
+            return self._price
+
         # 1. 从xlsx文件中提取比亚迪股票数据
         filepath = os.path.join(self.data_dir, '{}{}至{}股价.xlsx'.format(self.stock_name,self.begin_date,self.end_date))
         df = pd.read_excel(filepath)
@@ -43,177 +89,141 @@ class Map_Drawing():
         data['Date'] = pd.to_datetime(data['Date'])
         data.set_index('Date', inplace=True)
 
+        self._price = data
         return data
 
     def get_financial(self):
 
-
-        # 读取财务数据
-        filepath = os.path.join(self.data_dir, './company_performance_pivot.xlsx')
-        financial_data = pd.read_excel(filepath)
-
-        # 筛选比亚迪的财务数据（股票代码002594）
-        byd_financial_data = financial_data[financial_data['股票简称'] == self.stock_name]
-        if byd_financial_data.empty:
+        # 读取财务数据（与全市场事件研究共用同一份公告明细）
+        events = load_earnings_events(self.data_dir)
+        stock_events = events[events['stock_name'] == self.stock_name] if not events.empty else events
+        if stock_events.empty:
             raise ValueError("未找到股票简称为{}的财务数据".format(self.stock_name))
-        byd_financial = byd_financial_data.iloc[0]
 
-        # 提取净利润数据 - 自动查找所有可用日期
+        # 提取净利润数据 - 所有公告日期和净利润都存在的报告期
         profit_annotations = []
-
-        # 获取所有以"净利润_"开头的列名，并提取日期部分
-        profit_columns = [col for col in byd_financial.index if col.startswith('净利润_')]
-        for col in profit_columns:
-            # 从列名中提取日期（例如从"净利润_2023-12-31"中提取"2023-12-31"）
-            date_str = col.split('_', 1)[1]
-            announcement_col = f'公告日期_{date_str}'
-            
-            # 检查数据是否存在且非空
-            if (announcement_col in byd_financial and 
-                col in byd_financial and 
-                not pd.isna(byd_financial.get(announcement_col)) and 
-                not pd.isna(byd_financial.get(col))):
-                
-                profit_annotations.append({
-                    'date': pd.to_datetime(byd_financial[announcement_col]),
-                    'profit': byd_financial[col]/100000000,  # 转换为亿元
-                    'label': f'净利润{byd_financial[col]/100000000:.2f}亿'
-                })
+        for event in stock_events.dropna(subset=['announce_date', 'net_profit']).itertuples(index=False):
+            profit_annotations.append({
+                'date': event.announce_date,
+                'profit': event.net_profit/100000000,  # 转换为亿元
+                'label': f'净利润{event.net_profit/100000000:.2f}亿'
+            })
 
         return profit_annotations
 
     def get_holder_data(self):
-        """获取股东人数数据"""
-        # 读取股东人数统计文件
-        filepath = os.path.join(self.data_dir, './股东人数统计.xlsx')
-        holder_data = pd.read_excel(filepath)
-        
-        # 筛选指定股票名称的数据
-        stock_holder_data = holder_data[holder_data['股票名称'] == self.stock_name]
-        
-        if stock_holder_data.empty:
+        """获取股东人数数据，以公告后可用日期为索引"""
+        holder_df = stock_holder_reports(stock_name=self.stock_name, data_dir=self.data_dir)
+        if holder_df is None:
             print(f"未找到股票名称为{self.stock_name}的股东人数数据")
-            return None
-            
-        # 选择需要的列并重命名
-        # 从宽格式转换为长格式，日期作为一列，股东人数作为一列
-        holder_df = stock_holder_data.melt(
-            id_vars=['股票代码', '股票名称'], 
-            var_name='Date', 
-            value_name='HolderCount'
-        )
-        
-        # 转换日期格式并设置为索引
-        holder_df['Date'] = pd.to_datetime(holder_df['Date'])
-        holder_df = holder_df.set_index('Date')
-        
-        # 按日期排序
-        holder_df = holder_df.sort_index()
-        
         return holder_df
 
     def graph_mark(self):
 
         data = self.get_price()
 
-        # ===== 阶段性高点低点检测参数 =====
-        # 可手动调整的参数，用于控制极值检测的敏感度
-        PEAK_VALLEY_WINDOW = 30  # 窗口大小，用于确定局部极值，值越大检测到的极值点越少
-        # ================================
+        # 阶段性高点低点检测窗口，可通过构造参数 peak_valley_window 调整
+        PEAK_VALLEY_WINDOW = self.peak_valley_window
 
-        # 增加图形尺寸以适应更宽的蜡烛图
-        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(16, 10), gridspec_kw={"height_ratios": [3, 1, 1]})
+        # 按可见区间选择K线周期，长期图聚合为周线/月线，K线和标注的数量不随历史长度增长
+        level = self.bar_level()
+        bars, buckets = resample_ohlcv(data[['Open', 'High', 'Low', 'Close', 'Volume']], level)
+        self.bars = bars
 
-        # 准备OHLC数据，需要将日期转换为数字格式，同时调整数据点间距以适应更宽的蜡烛图
-        ohlc_data = []
-        spacing_factor = 3  # 增加数据点间距以避免重叠
-        date_nums = []
-        for i in range(len(data)):
-            date_num = mdates.date2num(data.index[i]) + i * (spacing_factor - 1)  # 调整日期位置以增加间距
-            date_nums.append(date_num)
-            open_price = data['Open'].iloc[i]
-            high_price = data['High'].iloc[i]
-            low_price = data['Low'].iloc[i]
-            close_price = data['Close'].iloc[i]
-            ohlc_data.append([date_num, open_price, high_price, low_price, close_price])
-
-        # 上层：蜡烛图
-        mpf.candlestick_ohlc(
-            ax1, 
-            ohlc_data,  # 格式：[时间戳, O, H, L, C]
-            width=2.6,  # 蜡烛宽度
-            colorup="red",  # 上涨（收盘价>开盘价）颜色
-            colordown="green",  # 下跌颜色
-            alpha=0.8  # 透明度
-        )
-        ax1.set_title("{}{}至今蜡烛图".format(self.stock_name,self.begin_date), fontsize=14)
+        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(16, 10), gridspec_kw={"height_ratios": [3, 1, 1]})
+        self.fig = fig
+
+        # 准备OHLC数据，横轴为真实日期，实体宽度按K线间距确定
+        date_nums, open_prices, high_prices, low_prices, close_prices = ohlc_arrays(bars)
+        self.width = bar_width(date_nums)
+        # 标签数量有上限：每 step 根K线最多一个高点、一个低点标签和一个财报注释
+        step = max(1, int(np.ceil(len(bars) / MAX_LABELS)))
+
+        # 上层：蜡烛图，实体和影线各为一个图元集合
+        draw_candlesticks(ax1, date_nums, open_prices, high_prices, low_prices, close_prices,
+                          width=self.width,  # 蜡烛宽度
+                          alpha=0.8)  # 透明度
+        ax1.set_title("{}{}至今蜡烛图（{}）".format(self.stock_name,self.begin_date,LEVEL_NAMES[level]), fontsize=14)
         ax1.grid(True, alpha=0.3)
 
         # 格式化x轴日期显示
-        ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        ax1.xaxis.set_major_locator(mdates.MonthLocator())
+        self.format_date_axis(ax1)
 
         # 查找并标记阶段性高点和低点
-        # 使用scipy寻找局部极值点
+        # 与全市场批量检测（pivots模块）使用同一套极值规则，在日线上检测（窗口单位为交易日），再映射到聚合后的K线
         print(f"当前使用的窗口大小: {PEAK_VALLEY_WINDOW}")
-        local_max_indices = argrelextrema(data['Close'].values, np.greater, order=PEAK_VALLEY_WINDOW)[0]
-        local_min_indices = argrelextrema(data['Close'].values, np.less, order=PEAK_VALLEY_WINDOW)[0]
+        local_max_indices, local_min_indices = local_extrema(data['Close'].values, PEAK_VALLEY_WINDOW)
 
         # 打印高点和低点信息到控制台
         print("阶段性高点:")
-        high_points = []
         for idx in local_max_indices:
-            date = data.index[idx]
-            price = data['High'].iloc[idx]
-            high_points.append((date, price))
-            print(f"日期: {pd.to_datetime(date).strftime('%Y-%m-%d')}, 价格: {price:.2f}")
-            ax1.plot(date_nums[idx], price, 'ro', markersize=8)  # 在图上标记红色圆点
-            ax1.annotate(f'{price:.2f}', 
-                        xy=(date_nums[idx], price),
-                        xytext=(0, 10),
-                        textcoords='offset points',
-                        ha='center',
-                        fontsize=8,
-                        bbox=dict(boxstyle='round,pad=0.2', facecolor='red', alpha=0.7))
+            print(f"日期: {pd.to_datetime(data.index[idx]).strftime('%Y-%m-%d')}, 价格: {data['High'].iloc[idx]:.2f}")
+        high_points = bar_pivots(local_max_indices, data['High'].values, buckets, highest=True, step=step)
+        self.mark_pivots(ax1, date_nums, high_points, 'red', 10)
 
         print("\n阶段性低点:")
-        low_points = []
         for idx in local_min_indices:
-            date = data.index[idx]
-            price = data['Low'].iloc[idx]
-            low_points.append((date, price))
-            print(f"日期: {pd.to_datetime(date).strftime('%Y-%m-%d')}, 价格: {price:.2f}")
-            ax1.plot(date_nums[idx], price, 'go', markersize=8)  # 在图上标记绿色圆点
-            ax1.annotate(f'{price:.2f}', 
-                        xy=(date_nums[idx], price),
-                        xytext=(0, -15),
-                        textcoords='offset points',
-                        ha='center',
-                        fontsize=8,
-                bbox=dict(boxstyle='round,pad=0.2', facecolor='green', alpha=0.7))
+            print(f"日期: {pd.to_datetime(data.index[idx]).strftime('%Y-%m-%d')}, 价格: {data['Low'].iloc[idx]:.2f}")
+        low_points = bar_pivots(local_min_indices, data['Low'].values, buckets, highest=False, step=step)
+        self.mark_pivots(ax1, date_nums, low_points, 'green', -15)
 
         profit_annotations = self.get_financial()
 
-        # 在K线图上添加注释
-        for annotation in profit_annotations:
+        # 同一根K线上的多份财报（如月线上同月发布的年报和一季报）合并为一个注释，每 step 根K线只保留最近的一根
+        bar_labels = {}
+        for annotation in sorted(profit_annotations, key=lambda annotation: annotation['date']):
             target_date = annotation['date']
             # 查找下一个最近的交易日
             actual_date = self.find_next_trading_date(target_date, data)
             # 获取实际日期在数据中的索引
             if actual_date in data.index:
                 idx = data.index.get_loc(actual_date)
-                close_price = data['Close'].loc[actual_date]
-                ax1.annotate(annotation['label'],
-                            xy=(date_nums[idx], close_price),
-                            xytext=(0, 30),  # 统一偏移量
-                            textcoords='offset points',
-                            arrowprops=dict(arrowstyle='->', color='black', lw=0.8),
-                            fontsize=9,
-                            ha='center',
-                            bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.8))
+                bar = buckets[idx]
+                last_bar, labels, _ = bar_labels.get(bar // step, (bar, [], None))
+                labels = labels + [annotation['label']] if last_bar == bar else [annotation['label']]
+                bar_labels[bar // step] = (bar, labels, data['Close'].iloc[idx])
+
+        # 在K线图上添加注释
+        for bar, labels, close_price in bar_labels.values():
+            ax1.annotate('\n'.join(labels),
+                        xy=(date_nums[bar], close_price),
+                        xytext=(0, 30),  # 统一偏移量
+                        textcoords='offset points',
+                        arrowprops=dict(arrowstyle='->', color='black', lw=0.8),
+                        fontsize=9,
+                        ha='center',
+                        bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.8))
 
         return ax1,ax2,ax3,date_nums
 
+    def bar_level(self):
+        """本图使用的K线周期：构造时指定的 level，否则按可见区间自动选择"""
+        return self.level or choose_level(self.get_price().index, self.max_bars)
+
+    def format_date_axis(self, ax):
+        """两年以内按月标注刻度，更长的区间自动选择刻度间隔，避免刻度标签过密"""
+        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+        if len(self.bars) and bar_buckets(self.bars.index, 'M')[-1] < MAX_MONTH_TICKS:
+            ax.xaxis.set_major_locator(mdates.MonthLocator())
+        else:
+            ax.xaxis.set_major_locator(mdates.AutoDateLocator(maxticks=MAX_MONTH_TICKS))
+
+    def mark_pivots(self, ax, date_nums, points, color, offset):
+        """标记高点或低点：全部圆点为一个图元，每个点一个价格标签"""
+        if not points:
+            return
+        bars = [bar for bar, _ in points]
+        prices = [price for _, price in points]
+        ax.plot(date_nums[bars], prices, 'o', color=color, markersize=8, linestyle='none')
+        for bar, price in points:
+            ax.annotate(f'{price:.2f}',
+                        xy=(date_nums[bar], price),
+                        xytext=(0, offset),
+                        textcoords='offset points',
+                        ha='center',
+                        fontsize=8,
+                        bbox=dict(boxstyle='round,pad=0.2', facecolor=color, alpha=0.7))
+
     # 添加一个函数来查找下一个最近的交易日
     def find_next_trading_date(self,target_date, data):
         """查找下一个最近的交易日"""
@@ -229,30 +239,27 @@ class Map_Drawing():
 
     def graph_draw(self):
         ax1,ax2,ax3,date_nums = self.graph_mark()
-        data = self.get_price()
         
         # 获取股东人数数据
         holder_data = self.get_holder_data()
 
         # 下层：成交量
         # 调整成交量图的宽度以匹配K线图的宽度，并使用相同的x轴位置
-        ax2.bar(date_nums, data["Volume"], 
-                width=2.6, 
-                color=data.apply(lambda x: "red" if x.Close > x.Open else "green", axis=1))
+        bars = self.bars
+        draw_volume(ax2, date_nums, bars["Volume"].values, bars["Open"].values, bars["Close"].values, width=self.width)
         ax2.set_ylabel("Volume", fontsize=12)
         ax2.grid(True, alpha=0.3)
 
         # 格式化x轴日期显示，与上图保持一致
-        ax2.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        ax2.xaxis.set_major_locator(mdates.MonthLocator())
+        self.format_date_axis(ax2)
         
         # 最下层：股东人数变化
         if holder_data is not None and not holder_data.empty:
-            # 将股东人数数据与股价数据的日期对齐
-            aligned_data = holder_data.reindex(data.index, method='nearest')
+            # 将股东人数按公告后可用日期向后填充到每根K线的最后一个交易日，公告前只显示上一期的值
+            aligned_data = holder_data.reindex(bars.index, method='ffill')
             
             # 将日期转换为数字格式以匹配其他子图
-            holder_date_nums = [mdates.date2num(date) for date in aligned_data.index]
+            holder_date_nums = mdates.date2num(aligned_data.index.values)
             
             # 绘制股东人数变化曲线
             ax3.plot(holder_date_nums, aligned_data['HolderCount'], color='blue', linewidth=1.5)
@@ -262,8 +269,7 @@ class Map_Drawing():
             ax3.set_title("股东人数变化", fontsize=12)
             
             # 格式化x轴日期显示
-            ax3.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-            ax3.xaxis.set_major_locator(mdates.MonthLocator())
+            self.format_date_axis(ax3)
         else:
             ax3.set_visible(False)  # 如果没有股东数据，则隐藏该子图
 
@@ -273,7 +279,54 @@ class Map_Drawing():
             plt.setp(ax3.xaxis.get_majorticklabels(), rotation=45)
 
         plt.tight_layout()
+
+    def chart_key(self):
+        """图表内容的缓存键：K线数据、财报标注、股东人数以及窗口等绘图参数（高低点由K线和窗口决定）"""
+        data = self.get_price()[['Open', 'High', 'Low', 'Close', 'Volume']]
+        return chart_key('Map_Drawing', self.stock_name, self.begin_date, self.peak_valley_window, self.bar_level(),
+                         data, self.get_financial(), self.get_holder_data())
+
+    def draw(self):
+        """绘制图形；设置了缓存且键命中时跳过绘制，直接使用缓存的图片"""
+        key = None
+        if self.cache is not None:
+            key = self.chart_key()
+            cached = self.cache.lookup(key)
+            if cached is not None:
+                self.image_path = cached[0]
+                print(f"{self.stock_name} 的数据和标注没有变化，使用缓存图片 {self.image_path}")
+                if self.show:
+                    self.show_image()
+                return
+
+        self.graph_draw()
+        if key is not None:
+            self.image_path = self.cache.save_figure(self.fig, key)
+        if self.show:
+            plt.show()
+
+    def show_image(self):
+        """显示缓存的图片"""
+        fig, ax = plt.subplots(figsize=(16, 10))
+        ax.imshow(plt.imread(self.image_path))
+        ax.axis('off')
+        plt.tight_layout()
         plt.show()
 
+
+def draw_stock_chart(stock_name, stock_code, begin_date='20240101', data_dir="下载数据",
+                     peak_valley_window=PEAK_VALLEY_WINDOW, show=True, level=None):
+    """绘制单只股票的K线标注图并返回Figure，可作为 chart_export.export_charts 的绘图函数"""
+    return Map_Drawing(stock_name=stock_name, stock_code=stock_code, begin_date=begin_date, data_dir=data_dir,
+                       peak_valley_window=peak_valley_window, show=show, level=level).fig
+
+
+def stock_chart_key(stock_name, stock_code, begin_date='20240101', data_dir="下载数据",
+                    peak_valley_window=PEAK_VALLEY_WINDOW, level=None):
+    """draw_stock_chart 的缓存键，只读取数据不绘图，可作为 chart_export.export_charts 的 cache_key"""
+    return Map_Drawing(stock_name=stock_name, stock_code=stock_code, begin_date=begin_date, data_dir=data_dir,
+                       peak_valley_window=peak_valley_window, show=False, draw=False, level=level).chart_key()
+
+
 if __name__ == '__main__':
     Map_Drawing()
\ No newline at end of file
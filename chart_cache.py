@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import hashlib
+import warnings
+import numpy as np
+import pandas as pd
+
+warnings.filterwarnings('ignore')
+
+# 默认缓存目录及容量上限，超过上限时按最近使用时间淘汰最旧的图片
+CACHE_DIR = os.path.join("下载数据", "图表缓存")
+MAX_CACHE_BYTES = 500 * 1024 ** 2
+
+# 绘图代码的版本号，图表样式改变时加1，使旧缓存全部失效
+CHART_VERSION = 2
+
+
+def _update_digest(digest, part):
+    """把一个组成部分写入哈希：DataFrame/Series 按内容逐行哈希，数组按字节，其余按JSON序列化"""
+    if isinstance(part, (pd.DataFrame, pd.Series)):
+        digest.update(type(part).__name__.encode('utf-8'))
+        if isinstance(part, pd.DataFrame):
+            digest.update(json.dumps([str(col) for col in part.columns], ensure_ascii=False).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(part, index=True).values.tobytes())
+    elif isinstance(part, np.ndarray):
+        digest.update(str(part.dtype).encode('utf-8'))
+        digest.update(np.ascontiguousarray(part).tobytes() if part.dtype != object else
+                      json.dumps(part.tolist(), ensure_ascii=False, default=str).encode('utf-8'))
+    else:
+        digest.update(json.dumps(part, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'))
+
+
+def chart_key(*parts):
+    """图表内容的缓存键：输入数据切片、标注（财报、股东人数、高低点）和绘图参数的SHA1前20位
+
+    任一部分变化（如新增一根K线、新公告、窗口参数调整）键就不同；内容完全相同时键也相同，与调用时间无关。
+    """
+    digest = hashlib.sha1()
+    _update_digest(digest, CHART_VERSION)
+    for part in parts:
+        _update_digest(digest, part)
+    return digest.hexdigest()[:20]
+
+
+class ChartCache():
+    """以内容哈希为键的图表图片缓存
+
+    每个键对应目录中的 <key><suffix> 文件（如 .png、.svg、.thumb.png）。命中时更新文件时间，
+    写入后按总大小淘汰最久未使用的文件。写入先落到临时文件再改名，多个进程共用同一目录也不会读到半张图。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        if max_bytes <= 0:
+            raise ValueError("max_bytes 必须为正数")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key, suffix='.png'):
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def lookup(self, key, suffixes=('.png',)):
+        """全部后缀的文件都在缓存中时返回路径列表（并标记为最近使用），否则返回None"""
+        paths = [self.path(key, suffix) for suffix in suffixes]
+        if not all(os.path.exists(path) for path in paths):
+            self.misses += 1
+            return None
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        self.hits += 1
+        return paths
+
+    def _commit(self, tmp_path, path):
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def save_figure(self, fig, key, suffix='.png', dpi=100):
+        """把图形保存到缓存，返回缓存文件路径"""
+        path = self.path(key, suffix)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        fig.savefig(tmp_path, format=suffix.rsplit('.', 1)[-1], dpi=dpi, bbox_inches='tight')
+        return self._commit(tmp_path, path)
+
+    def store(self, key, suffix, source):
+        """把已生成的图片文件复制进缓存，返回缓存文件路径"""
+        path = self.path(key, suffix)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        shutil.copyfile(source, tmp_path)
+        return self._commit(tmp_path, path)
+
+    def size(self):
+        """缓存目录中图片的总字节数"""
+        return sum(entry.stat().st_size for entry in os.scandir(self.cache_dir)
+                   if entry.is_file() and not entry.name.endswith('.tmp'))
+
+    def evict(self):
+        """总大小超过 max_bytes 时按修改时间从旧到新删除文件，返回删除的字节数"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except OSError:
+                # 其他进程已删除或正在使用
+                pass
+        return freed
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                os.remove(entry.path)
+
+
+if __name__ == '__main__':
+    cache = ChartCache()
+    print(f"图表缓存目录 {cache.cache_dir}：{cache.size() / 1024 ** 2:.1f} MB / {cache.max_bytes / 1024 ** 2:.0f} MB")
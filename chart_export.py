@@ -0,0 +1,191 @@
+import os
+import re
+import shutil
+import time
+import html
+import warnings
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+import pandas as pd
+from chart_cache import chart_key
+
+warnings.filterwarnings('ignore')
+
+# 批量导出默认输出目录
+EXPORT_DIR = os.path.join("下载数据", "批量蜡烛图")
+
+# 导出分辨率和缩略图宽度（像素）
+EXPORT_DPI = 100
+THUMB_DPI = 30
+THUMB_WIDTH = 360
+
+
+def _safe_name(name):
+    """移除文件名中不允许的字符"""
+    return re.sub(r'[\\/:*?"<>|]', '', str(name))
+
+
+def _init_worker():
+    # 子进程不弹窗口，统一使用无界面的Agg后端
+    matplotlib.use('Agg')
+
+
+def render_chart(render, name, kwargs, output_dir, formats=('png',), dpi=EXPORT_DPI, thumb_dpi=THUMB_DPI,
+                 cache=None, cache_key=None):
+    """在当前进程中绘制并保存一张图，返回结果记录
+
+    render 为返回 matplotlib Figure 的模块级函数（须可被子进程导入），以 show=False 和 kwargs 调用。
+    保存完正式图和缩略图后立即关闭本次绘制新建的图形，释放内存，调用方原有的图形不受影响。
+    传入 cache（ChartCache）和 cache_key（以 kwargs 调用、返回输入数据和标注内容键的函数）时，
+    键命中则直接从缓存复制图片，不再绘制；未命中时绘制后把图片存入缓存。
+    """
+    import matplotlib.pyplot as plt
+    begin = time.perf_counter()
+    existing = set(plt.get_fignums())
+    stem = _safe_name(name)
+    record = {'name': name, 'files': [], 'thumbnail': None, 'seconds': 0.0, 'error': None, 'cached': False}
+    paths = [os.path.join(output_dir, '{}.{}'.format(stem, fmt)) for fmt in formats]
+    thumbnail = os.path.join(output_dir, 'thumbs', '{}.png'.format(stem))
+    suffixes = ['.{}'.format(fmt) for fmt in formats] + ['.thumb.png']
+    try:
+        key = None
+        if cache is not None and cache_key is not None:
+            key = chart_key(cache_key(**kwargs), list(formats), dpi, thumb_dpi)
+            cached = cache.lookup(key, suffixes)
+            if cached is not None:
+                for source, path in zip(cached, paths + [thumbnail]):
+                    shutil.copyfile(source, path)
+                record.update(files=paths, thumbnail=thumbnail, cached=True,
+                              seconds=time.perf_counter() - begin)
+                return record
+        fig = render(show=False, **kwargs)
+        if fig is None:
+            record['error'] = '没有生成图形'
+        else:
+            for path in paths:
+                fig.savefig(path, dpi=dpi, bbox_inches='tight')
+                record['files'].append(path)
+            fig.savefig(thumbnail, dpi=thumb_dpi, bbox_inches='tight')
+            record['thumbnail'] = thumbnail
+            if key is not None:
+                for suffix, path in zip(suffixes, paths + [thumbnail]):
+                    cache.store(key, suffix, path)
+    except Exception as e:
+        record['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        for number in set(plt.get_fignums()) - existing:
+            plt.close(number)
+    record['seconds'] = time.perf_counter() - begin
+    return record
+
+
+def _render_in_worker(args):
+    return render_chart(*args)
+
+
+def write_index(records, output_dir, title='批量蜡烛图'):
+    """生成带缩略图的HTML索引页，点击缩略图打开原图，返回索引页路径"""
+    cards = []
+    for record in records:
+        name = html.escape(str(record['name']))
+        if record['error'] or not record['files']:
+            cards.append('<div class="card failed"><div class="name">{}</div><div>{}</div></div>'.format(
+                name, html.escape(str(record['error']))))
+            continue
+        link = quote(os.path.relpath(record['files'][0], output_dir).replace(os.sep, '/'))
+        thumb = quote(os.path.relpath(record['thumbnail'], output_dir).replace(os.sep, '/'))
+        others = ' '.join('<a href="{}">{}</a>'.format(
+            quote(os.path.relpath(path, output_dir).replace(os.sep, '/')), html.escape(os.path.splitext(path)[1][1:]))
+            for path in record['files'])
+        cards.append('<div class="card"><a href="{}"><img src="{}" width="{}"></a>'
+                     '<div class="name">{}</div><div class="meta">{:.2f} 秒 {}</div></div>'.format(
+                         link, thumb, THUMB_WIDTH, name, record['seconds'], others))
+    page = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 20px; }}
+.grid {{ display: flex; flex-wrap: wrap; gap: 12px; }}
+.card {{ border: 1px solid #ddd; padding: 6px; width: {width}px; }}
+.card img {{ display: block; max-width: 100%; }}
+.name {{ font-weight: bold; margin-top: 4px; }}
+.meta {{ color: #666; font-size: 12px; }}
+.failed {{ color: #c00; }}
+</style>
+</head>
+<body>
+<h2>{title}</h2>
+<p>共 {total} 张，失败 {failed} 张，生成于 {now}</p>
+<div class="grid">
+{cards}
+</div>
+</body>
+</html>
+""".format(title=html.escape(title), width=THUMB_WIDTH, total=len(records),
+           failed=sum(1 for record in records if record['error']),
+           now=pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S'), cards='\n'.join(cards))
+    path = os.path.join(output_dir, 'index.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(page)
+    return path
+
+
+def export_charts(render, jobs, output_dir=EXPORT_DIR, formats=('png',), workers=None, dpi=EXPORT_DPI,
+                  title='批量蜡烛图', cache=None, cache_key=None):
+    """无界面批量导出图表：进程池并行绘制，保存为PNG/SVG并生成带缩略图的HTML索引页
+
+    jobs 为 [(名称, 参数字典), ...]，名称用作文件名和索引页标题，参数字典原样传给 render。
+    workers=1 时在当前进程中依次绘制：不切换当前进程的后端，只在导出期间关闭交互模式，导出后仍可正常 plt.show()。
+    传入 cache 和 cache_key 时只绘制内容有变化的图，其余直接取缓存（见 render_chart）。
+    返回 (每张图的结果DataFrame, 索引页路径)。
+    """
+    formats = tuple(fmt.lower() for fmt in formats)
+    unknown = [fmt for fmt in formats if fmt not in ('png', 'svg')]
+    if unknown:
+        raise ValueError("只支持导出 png 和 svg 格式: {}".format(unknown))
+    os.makedirs(os.path.join(output_dir, 'thumbs'), exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, len(jobs)))
+    tasks = [(render, name, kwargs, output_dir, formats, dpi, THUMB_DPI, cache, cache_key) for name, kwargs in jobs]
+
+    begin = time.perf_counter()
+    if workers == 1:
+        # 切换后端会关闭调用方已打开的图形，并使之后的 plt.show() 不再弹出窗口，因此只关闭交互模式避免弹窗，
+        # 保存图片时 savefig 本身使用Agg渲染
+        import matplotlib.pyplot as plt
+        with plt.ioff():
+            records = [render_chart(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            records = list(executor.map(_render_in_worker, tasks))
+    wall_seconds = time.perf_counter() - begin
+
+    index_path = write_index(records, output_dir, title)
+    results = pd.DataFrame([{
+        '名称': record['name'],
+        '文件': ', '.join(record['files']),
+        '耗时(秒)': record['seconds'],
+        '缓存命中': record['cached'],
+        '错误': record['error']
+    } for record in records])
+    render_seconds = results['耗时(秒)'].sum() if len(results) else 0.0
+    print(f"导出完成：{len(records)} 张图，缓存命中 {sum(record['cached'] for record in records)} 张，"
+          f"失败 {int(results['错误'].notna().sum()) if len(results) else 0} 张，"
+          f"{workers} 个进程，墙钟 {wall_seconds:.1f} 秒（单张累计 {render_seconds:.1f} 秒），索引页 {index_path}")
+    return results, index_path
+
+
+if __name__ == '__main__':
+    from bottom_7_red_bar import find_consecutive_rising_stocks, plot_candlestick_chart
+    rising_stocks = find_consecutive_rising_stocks(check_volume=False)
+    jobs = [('{}({})'.format(stock['stock_name'], stock['stock_code']), {
+        'stock_name': stock['stock_name'],
+        'stock_code': stock['stock_code'],
+        'start_date': stock['start_date'],
+        'consecutive_days': stock['consecutive_days']
+    }) for stock in rising_stocks]
+    results, index_path = export_charts(plot_candlestick_chart, jobs, formats=('png', 'svg'))
+    print(results.to_string(index=False))
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+import os
+import re
+import time
+import warnings
+from stock_store import load_price_panel
+
+warnings.filterwarnings('ignore')
+
+# 事件窗口（相对事件日的交易日区间，含两端），事件日为公告日之后的第一个交易日
+EVENT_WINDOWS = ((-5, -1), (0, 0), (0, 1), (0, 5), (0, 20), (0, 60))
+
+# 净利润同比增长（%）分组边界
+YOY_BUCKETS = (-np.inf, -50, -20, 0, 20, 50, 100, np.inf)
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _to_days(dates):
+    return (pd.to_datetime(dates).values.astype('datetime64[D]') - _EPOCH).astype(np.int64)
+
+
+def load_earnings_events(data_dir="下载数据"):
+    """把 company_performance_pivot.xlsx 的 公告日期_*/净利润_*/净利润同比增长_* 宽表列转为事件明细
+
+    每只股票每个报告期一行：stock_code, stock_name, report_date, announce_date, net_profit, profit_yoy，
+    另加 yoy_change（同比增速较上一报告期的变化，可视为业绩超预期程度的粗略代理）。
+    """
+    filepath = os.path.join(data_dir, 'company_performance_pivot.xlsx')
+    if not os.path.exists(filepath):
+        print(f"未找到财务数据文件: {filepath}")
+        return pd.DataFrame()
+    financial_data = pd.read_excel(filepath)
+    financial_data['股票代码'] = financial_data['股票代码'].astype(str).str.zfill(6)
+
+    fields = {'公告日期': 'announce_date', '净利润': 'net_profit', '净利润同比增长': 'profit_yoy'}
+    pattern = re.compile(r'^(公告日期|净利润|净利润同比增长)_(\d{4}-\d{2}-\d{2})$')
+    columns = {}
+    for col in financial_data.columns:
+        match = pattern.match(str(col))
+        if match:
+            columns[col] = (fields[match.group(1)], match.group(2))
+    if not columns:
+        print("财务数据中没有 公告日期_/净利润_ 列")
+        return pd.DataFrame()
+
+    # 一次 stack 把 (指标, 报告期) 两级列展开为长表
+    id_columns = ['股票代码'] + (['股票简称'] if '股票简称' in financial_data.columns else [])
+    wide = financial_data.set_index(id_columns)[list(columns)]
+    wide.columns = pd.MultiIndex.from_tuples([columns[col] for col in wide.columns], names=['field', 'report_date'])
+    events = wide.stack('report_date').reset_index()
+    events = events.rename(columns={'股票代码': 'stock_code', '股票简称': 'stock_name'})
+    events.columns.name = None
+    if 'stock_name' not in events.columns:
+        events['stock_name'] = ''
+    for field in fields.values():
+        if field not in events.columns:
+            events[field] = np.nan
+
+    events['report_date'] = pd.to_datetime(events['report_date'])
+    events['announce_date'] = pd.to_datetime(events['announce_date'], errors='coerce')
+    events['net_profit'] = pd.to_numeric(events['net_profit'], errors='coerce')
+    events['profit_yoy'] = pd.to_numeric(events['profit_yoy'], errors='coerce')
+    events = events.dropna(subset=['announce_date']).sort_values(['stock_code', 'report_date'])
+    events['yoy_change'] = events['profit_yoy'] - events.groupby('stock_code')['profit_yoy'].shift(1)
+    return events[['stock_code', 'stock_name', 'report_date', 'announce_date', 'net_profit', 'profit_yoy',
+                   'yoy_change']].reset_index(drop=True)
+
+
+def daily_returns(panel):
+    """每根K线的日收益率（小数），优先使用涨跌幅字段（已处理除权），否则由收盘价计算"""
+    if 'change_percent' in panel:
+        return panel.values('change_percent') / 100
+    close = panel.values('close_price')
+    ret = np.full(panel.n_rows, np.nan)
+    ret[1:] = close[1:] / close[:-1] - 1
+    ret[panel.offsets[:-1][panel.lengths() > 0]] = np.nan
+    return ret
+
+
+def abnormal_returns(panel):
+    """相对等权市场的超额收益：个股日收益减去当日全部交易股票的平均收益，返回 (超额收益, 市场收益序列)"""
+    ret = daily_returns(panel)
+    date_index = panel.date_index()
+    valid = np.isfinite(ret)
+    n_days = len(panel.calendar())
+    counts = np.bincount(date_index[valid], minlength=n_days)
+    sums = np.bincount(date_index[valid], weights=ret[valid], minlength=n_days)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        market = sums / counts
+    return ret - market[date_index], market
+
+
+def event_car(panel, events, windows=EVENT_WINDOWS, ar=None):
+    """批量计算每个事件在各窗口的累计超额收益（CAR，%）
+
+    公告日之后的第一个交易日为事件日（公告多在盘后发布，当日收盘价尚未反映）。
+    窗口按该股票自身的交易日计数（停牌日跳过），超出数据范围的窗口为NaN。
+    """
+    if ar is None:
+        ar, _ = abnormal_returns(panel)
+    rows = panel.event_rows(events['stock_code'].values, _to_days(events['announce_date']) + 1)
+    found = rows >= 0
+    events = events[found].reset_index(drop=True)
+    rows = rows[found]
+    stock_ids = panel.stock_ids()[rows]
+    first_rows = panel.offsets[stock_ids]
+    last_rows = panel.offsets[stock_ids + 1] - 1
+
+    # 全市场一条前缀和，同一只股票内任意区间之和为两个前缀和之差
+    cumulative = np.concatenate([[0.0], np.cumsum(np.nan_to_num(ar))])
+    events['event_date'] = panel.day[rows].astype('datetime64[D]')
+    for start, end in windows:
+        begin, stop = rows + start, rows + end
+        in_range = (begin >= first_rows) & (stop <= last_rows)
+        car = np.full(len(rows), np.nan)
+        car[in_range] = cumulative[stop[in_range] + 1] - cumulative[begin[in_range]]
+        events['car_{}_{}'.format(start, end)] = car * 100
+    return events
+
+
+def car_path(panel, events, days=range(-5, 21), ar=None):
+    """事件前后逐日的累计超额收益路径（%），返回 事件数×天数 矩阵，以事件日前一天为0点"""
+    if ar is None:
+        ar, _ = abnormal_returns(panel)
+    days = np.asarray(list(days))
+    rows = panel.event_rows(events['stock_code'].values, _to_days(events['announce_date']) + 1)
+    stock_ids = panel.stock_ids()[np.maximum(rows, 0)]
+    first_rows = panel.offsets[stock_ids]
+    last_rows = panel.offsets[stock_ids + 1] - 1
+    cumulative = np.concatenate([[0.0], np.cumsum(np.nan_to_num(ar))])
+
+    # positions[i, j] 为第 i 个事件在相对第 j 天的行号
+    positions = rows[:, None] + days[None, :]
+    valid = (rows[:, None] >= 0) & (positions >= first_rows[:, None]) & (positions <= last_rows[:, None])
+    base = cumulative[np.clip(rows, 0, None)]
+    path = np.full(positions.shape, np.nan)
+    # 第 d 天收盘相对事件日前一天收盘的累计超额收益
+    path[valid] = (cumulative[positions[valid] + 1] - np.broadcast_to(base[:, None], positions.shape)[valid]) * 100
+    return pd.DataFrame(path, columns=days)
+
+
+def bucket_summary(events, by='profit_yoy', edges=YOY_BUCKETS, windows=EVENT_WINDOWS):
+    """按业绩分组统计各窗口 CAR 的均值、中位数、t值和正收益比例"""
+    events = events.dropna(subset=[by]).copy()
+    if events.empty:
+        return pd.DataFrame()
+    events['bucket'] = pd.cut(events[by], bins=list(edges))
+    rows = []
+    for bucket, group in events.groupby('bucket', observed=True):
+        row = {'分组': str(bucket), '事件数': len(group), by + '均值': group[by].mean()}
+        for start, end in windows:
+            car = group['car_{}_{}'.format(start, end)].dropna()
+            label = '[{},{}]'.format(start, end)
+            row['CAR{}均值'.format(label)] = car.mean()
+            row['CAR{}中位数'.format(label)] = car.median()
+            row['CAR{}t值'.format(label)] = car.mean() / car.std() * np.sqrt(len(car)) if len(car) > 1 and car.std() > 0 else np.nan
+            row['CAR{}为正比例'.format(label)] = (car > 0).mean() if len(car) else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_event_study(panel=None, data_dir="下载数据", windows=EVENT_WINDOWS, by='profit_yoy', edges=YOY_BUCKETS):
+    """全市场业绩公告事件研究：全部股票、全部报告期一次批量计算，返回 (事件明细, 分组统计)"""
+    timings = {}
+    begin = time.perf_counter()
+    if panel is None:
+        panel = load_price_panel(fields=('close_price', 'change_percent'))
+    timings['加载K线'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    events = load_earnings_events(data_dir)
+    timings['读取财务数据'] = time.perf_counter() - begin
+    if panel.n_rows == 0 or events.empty:
+        print("缺少K线或财务数据")
+        return pd.DataFrame(), pd.DataFrame()
+
+    begin = time.perf_counter()
+    ar, _ = abnormal_returns(panel)
+    events = event_car(panel, events, windows, ar)
+    summary = bucket_summary(events, by, edges, windows)
+    timings['计算超额收益'] = time.perf_counter() - begin
+
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f} 秒")
+    print(f"共 {len(events)} 个公告事件")
+    return events, summary
+
+
+if __name__ == '__main__':
+    events, summary = run_event_study()
+    print(summary.to_string(index=False))
@@ -0,0 +1,281 @@
+import numpy as np
+import pandas as pd
+import os
+import time
+import warnings
+from stock_store import load_price_panel
+from streak_engine import run_lengths
+
+warnings.filterwarnings('ignore')
+
+# 报告期（月-日） -> 法定披露截止日（月-日, 相对报告期所在年份的年数偏移）
+# 一季报4月30日、半年报8月31日、三季报10月31日、年报次年4月30日前披露
+REPORT_DEADLINES = {
+    '03-31': ('04-30', 0),
+    '06-30': ('08-31', 0),
+    '09-30': ('10-31', 0),
+    '12-31': ('04-30', 1)
+}
+REPORT_PERIODS = tuple(REPORT_DEADLINES)
+
+# 远期收益的统计周期（交易日）
+FORWARD_HORIZONS = (5, 20, 60)
+
+_EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+def _to_days(dates):
+    return (pd.to_datetime(dates).values.astype('datetime64[D]') - _EPOCH).astype(np.int64)
+
+
+def statutory_deadline(report_dates):
+    """报告期对应的法定披露截止日"""
+    report_dates = pd.to_datetime(pd.Series(report_dates)).reset_index(drop=True)
+    month_day = report_dates.dt.strftime('%m-%d')
+    deadline_day = month_day.map({period: deadline[0] for period, deadline in REPORT_DEADLINES.items()})
+    year = report_dates.dt.year + month_day.map({period: deadline[1] for period, deadline in REPORT_DEADLINES.items()})
+    return pd.to_datetime(year.astype(str) + '-' + deadline_day)
+
+
+def load_holder_reports(data_dir="下载数据"):
+    """读取各报告期的股东人数，返回长格式明细（每只股票每个报告期一行）
+
+    优先使用 holder_number 保存的 股东人数公告.xlsx（含公告日期）；没有公告日期的报告期
+    （或只有旧版宽表 股东人数统计.xlsx 时）保守地以法定披露截止日作为公告日。
+    available_date 为公告日的次日，即该数据最早可用于交易的日期。
+    """
+    announce_path = os.path.join(data_dir, '股东人数公告.xlsx')
+    wide_path = os.path.join(data_dir, '股东人数统计.xlsx')
+    if os.path.exists(announce_path):
+        reports = pd.read_excel(announce_path)
+        reports = reports.rename(columns={'股票代码': 'stock_code', '股票名称': 'stock_name', '报告期': 'report_date',
+                                          '股东人数': 'holder_count', '公告日期': 'announce_date'})
+    elif os.path.exists(wide_path):
+        holder_data = pd.read_excel(wide_path)
+        report_columns = [col for col in holder_data.columns[2:] if str(col)[5:10] in REPORT_PERIODS]
+        reports = holder_data.melt(id_vars=['股票代码', '股票名称'], value_vars=report_columns,
+                                   var_name='report_date', value_name='holder_count')
+        reports = reports.rename(columns={'股票代码': 'stock_code', '股票名称': 'stock_name'})
+        reports['announce_date'] = pd.NaT
+    else:
+        print(f"未找到股东人数文件: {announce_path} 或 {wide_path}")
+        return pd.DataFrame(columns=['stock_code', 'stock_name', 'report_date', 'holder_count', 'announce_date',
+                                     'estimated', 'available_date', 'holder_count_prev', 'holder_change'])
+
+    reports = reports.dropna(subset=['holder_count']).copy()
+    reports['stock_code'] = reports['stock_code'].astype(str).str.zfill(6)
+    reports['report_date'] = pd.to_datetime(reports['report_date'])
+    reports = reports[reports['report_date'].dt.strftime('%m-%d').isin(REPORT_PERIODS)].reset_index(drop=True)
+    reports['announce_date'] = pd.to_datetime(reports['announce_date'], errors='coerce')
+
+    deadlines = statutory_deadline(reports['report_date'])
+    reports['estimated'] = reports['announce_date'].isna()
+    reports['announce_date'] = reports['announce_date'].fillna(deadlines)
+    # 公告日期不可能早于报告期末，异常值按报告期末处理
+    reports['announce_date'] = reports[['announce_date', 'report_date']].max(axis=1)
+    reports['available_date'] = reports['announce_date'] + pd.Timedelta(days=1)
+
+    reports = reports.sort_values(['stock_code', 'report_date']).drop_duplicates(['stock_code', 'report_date'], keep='last')
+    reports['holder_count_prev'] = reports.groupby('stock_code')['holder_count'].shift(1)
+    reports['holder_change'] = reports['holder_count'] / reports['holder_count_prev'] - 1
+    return reports.reset_index(drop=True)
+
+
+def _visible_reports(reports):
+    """按可用日期排序，得到每只股票“当时能看到的最新一期”的序列
+
+    同一天可用的多个报告期只保留最新的一期（如年报和一季报同在4月30日截止）；
+    晚于更新一期才公告的旧报告期（如年报延迟披露）不会把数值倒退回旧值。
+    """
+    visible = reports.sort_values(['stock_code', 'available_date', 'report_date'])
+    latest_report = visible.groupby('stock_code')['report_date'].cummax()
+    visible = visible[visible['report_date'] >= latest_report]
+    return visible.drop_duplicates(['stock_code', 'available_date'], keep='last')
+
+
+def attach_holder_counts(panel, reports=None, data_dir="下载数据"):
+    """把股东人数按公告后可用日期 as-of 对齐到面板每一行
+
+    增加 holder_count、holder_count_prev、holder_change、holder_report_day（报告期末，int天数）四列，
+    公告之前的交易日只能看到更早一期的数据，不会用到未来值。
+    """
+    if reports is None:
+        reports = load_holder_reports(data_dir)
+    if len(reports) == 0:
+        for column in ('holder_count', 'holder_count_prev', 'holder_change', 'holder_report_day'):
+            panel.columns[column] = np.full(panel.n_rows, np.nan)
+        return panel
+
+    visible = _visible_reports(reports)
+    codes = visible['stock_code'].values
+    days = _to_days(visible['available_date'])
+    panel.columns['holder_count'] = panel.asof(codes, days, visible['holder_count'].values)
+    panel.columns['holder_count_prev'] = panel.asof(codes, days, visible['holder_count_prev'].values)
+    panel.columns['holder_change'] = panel.asof(codes, days, visible['holder_change'].values)
+    panel.columns['holder_report_day'] = panel.asof(codes, days, _to_days(visible['report_date']).astype(np.float64))
+    return panel
+
+
+def stock_holder_reports(stock_name=None, stock_code=None, data_dir="下载数据"):
+    """单只股票的股东人数，以可用日期为索引（HolderCount 列），供K线图按交易日 ffill 对齐"""
+    reports = load_holder_reports(data_dir)
+    if stock_code is not None:
+        reports = reports[reports['stock_code'] == str(stock_code).zfill(6)]
+    elif stock_name is not None:
+        reports = reports[reports['stock_name'] == stock_name]
+    if reports.empty:
+        return None
+    visible = _visible_reports(reports)
+    return pd.DataFrame({
+        'HolderCount': visible['holder_count'].values,
+        'ReportDate': visible['report_date'].values
+    }, index=pd.DatetimeIndex(visible['available_date'].values, name='Date'))
+
+
+def holder_forward_returns(panel, reports, horizons=FORWARD_HORIZONS):
+    """每次股东人数公告后的远期收益
+
+    以可用日当天或之后的第一根K线为事件日，收益为事件日开盘价到事件日起第 h 个交易日收盘
+    （公告可用后第一个能成交的价格买入），超出该股票数据范围的为NaN。
+    事件日是该股票在面板中第一根K线的（可用日早于面板起点或上市日）不计入。
+    """
+    open_price = panel.values('open_price')
+    close = panel.values('close_price')
+    rows = panel.event_rows(reports['stock_code'].values, _to_days(reports['available_date']))
+    stock_ids = panel.stock_ids()
+    events = reports.copy()
+    valid = rows > 0
+    valid[valid] = stock_ids[rows[valid] - 1] == stock_ids[rows[valid]]
+    events = events[valid].reset_index(drop=True)
+    rows = rows[valid]
+    base = open_price[rows]
+    base[~(base > 0)] = np.nan
+    last_rows = panel.offsets[stock_ids[rows] + 1] - 1
+    events['event_date'] = panel.day[rows].astype('datetime64[D]')
+    for horizon in horizons:
+        target = rows + horizon - 1
+        in_range = target <= last_rows
+        ret = np.full(len(rows), np.nan)
+        ret[in_range] = close[target[in_range]] / base[in_range] - 1
+        events['ret_{}d'.format(horizon)] = ret * 100
+    return events
+
+
+def holder_return_summary(events, horizons=FORWARD_HORIZONS, n_buckets=5):
+    """按股东人数变化分组统计远期收益
+
+    同一报告期内按 holder_change 横截面排序分为 n_buckets 组（第1组股东人数降幅最大，筹码最集中），
+    返回 (分组统计, 每个周期的平均秩相关系数IC)。
+    """
+    events = events.dropna(subset=['holder_change']).copy()
+    if events.empty:
+        return pd.DataFrame(), pd.DataFrame()
+    pct = events.groupby('report_date')['holder_change'].rank(pct=True, method='first')
+    events['bucket'] = np.ceil(pct * n_buckets).clip(1, n_buckets).astype(int)
+
+    ret_columns = ['ret_{}d'.format(h) for h in horizons]
+    grouped = events.groupby('bucket')
+    summary = grouped[ret_columns].mean()
+    summary.insert(0, 'holder_change', grouped['holder_change'].mean() * 100)
+    summary.insert(0, 'events', grouped.size())
+    for column in ret_columns:
+        summary['win_rate_' + column[4:]] = grouped[column].apply(lambda x: (x.dropna() > 0).mean() * 100)
+
+    ic_rows = []
+    for column in ret_columns:
+        ics = events.groupby('report_date').apply(
+            lambda g: g['holder_change'].rank().corr(g[column].rank()) if g[column].notna().sum() > 2 else np.nan)
+        ic_rows.append({'周期': column, 'IC均值': ics.mean(), 'IC为负比例': (ics.dropna() < 0).mean()})
+    return summary.reset_index(), pd.DataFrame(ic_rows)
+
+
+def chip_concentration_rank(panel, reports, as_of=None, top=None):
+    """按截至 as_of（默认面板最新交易日）已公告的股东人数，对全市场做筹码集中度排名
+
+    排序依据：股东人数连续下降的期数（多者靠前），其次为最近一期降幅（大者靠前）。
+    同时给出最近两期累计变化和公告以来的股价涨跌，便于观察股东人数与股价的关系。
+    """
+    calendar = panel.calendar()
+    as_of_day = calendar[-1] if as_of is None else _to_days([as_of])[0]
+    known = reports[_to_days(reports['available_date']) <= as_of_day].sort_values(['stock_code', 'report_date'])
+    if known.empty:
+        return pd.DataFrame()
+
+    # 在按股票拼接的报告序列上计算连续下降期数
+    codes = known['stock_code'].values
+    starts = np.concatenate([[True], codes[1:] != codes[:-1]])
+    offsets = np.append(np.nonzero(starts)[0], len(known))
+    with np.errstate(invalid='ignore'):
+        falling = (known['holder_change'].values < 0)
+    known = known.assign(
+        decline_streak=run_lengths(falling, offsets),
+        change_2=known['holder_count'] / known.groupby('stock_code')['holder_count'].shift(2) - 1
+    )
+    latest = known.drop_duplicates('stock_code', keep='last').reset_index(drop=True)
+
+    # 公告后股价变化：可用日前一交易日收盘 -> as_of 当日（或之前最近一日）收盘
+    close = panel.values('close_price')
+    stock_ids = panel.stock_ids()
+    start_rows = panel.event_rows(latest['stock_code'].values, _to_days(latest['available_date']))
+    end_rows = panel.event_rows(latest['stock_code'].values, np.full(len(latest), as_of_day), before=True)
+    valid = (start_rows > 0) & (end_rows >= start_rows)
+    valid[valid] = stock_ids[start_rows[valid] - 1] == stock_ids[start_rows[valid]]
+    price_change = np.full(len(latest), np.nan)
+    close_price = np.full(len(latest), np.nan)
+    price_change[valid] = (close[end_rows[valid]] / close[start_rows[valid] - 1] - 1) * 100
+    close_price[valid] = close[end_rows[valid]]
+
+    result = pd.DataFrame({
+        'stock_code': latest['stock_code'],
+        'stock_name': latest['stock_name'],
+        'report_date': latest['report_date'].dt.date,
+        'announce_date': latest['announce_date'].dt.date,
+        'estimated': latest['estimated'],
+        'holder_count': latest['holder_count'],
+        'holder_change': latest['holder_change'] * 100,
+        'change_2': latest['change_2'] * 100,
+        'decline_streak': latest['decline_streak'],
+        'close_price': close_price,
+        'price_change_since': price_change
+    })
+    result = result.sort_values(['decline_streak', 'holder_change', 'stock_code'],
+                                ascending=[False, True, True], na_position='last').reset_index(drop=True)
+    result.insert(0, 'rank', np.arange(1, len(result) + 1))
+    return result.head(top) if top else result
+
+
+def run_holder_analysis(panel=None, data_dir="下载数据", horizons=FORWARD_HORIZONS):
+    """全市场股东人数—股价关系分析：远期收益分组统计、IC 及当前筹码集中度排名"""
+    timings = {}
+    begin = time.perf_counter()
+    if panel is None:
+        panel = load_price_panel(fields=('open_price', 'close_price'))
+    timings['加载K线'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    reports = load_holder_reports(data_dir)
+    timings['读取股东人数'] = time.perf_counter() - begin
+    if panel.n_rows == 0 or reports.empty:
+        print("缺少K线或股东人数数据")
+        return None
+
+    begin = time.perf_counter()
+    events = holder_forward_returns(panel, reports, horizons)
+    summary, ic = holder_return_summary(events, horizons)
+    timings['远期收益统计'] = time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    ranking = chip_concentration_rank(panel, reports)
+    timings['筹码集中度排名'] = time.perf_counter() - begin
+
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds:.2f} 秒")
+    return {'events': events, 'summary': summary, 'ic': ic, 'ranking': ranking}
+
+
+if __name__ == '__main__':
+    result = run_holder_analysis()
+    if result is not None:
+        print(result['summary'].to_string(index=False))
+        print(result['ic'].to_string(index=False))
+        print(result['ranking'].head(50).to_string(index=False))
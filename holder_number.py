@@ -11,7 +11,8 @@ class HolderNumber():
         os.makedirs(self.data_dir, exist_ok=True)
         
         filepath = os.path.join(self.data_dir, '股东人数统计.xlsx')
-        if not os.path.exists(filepath):
+        announce_path = os.path.join(self.data_dir, '股东人数公告.xlsx')
+        if not os.path.exists(filepath) or not os.path.exists(announce_path):
             self.get_holder_number()
         else:
             print("股东人数统计.xlsx 文件已存在，跳过生成")
@@ -24,6 +25,9 @@ class HolderNumber():
         # 创建一个列表用于存储所有数据
         all_data = []
 
+        # 各报告期的公告日期，用于按公告日对齐股东人数，避免用到尚未公布的数据
+        announcements = []
+
         # 生成从2024-01-01至今的所有日期
         start_date = datetime(2024, 1, 1)
         end_date = datetime.now()
@@ -54,6 +58,11 @@ class HolderNumber():
                     if res is not None and not res.empty:
                         # 只保留需要的列
                         res_filtered = res[['股票代码', '股票名称', '股东人数']].copy()
+
+                        announce = res_filtered.copy()
+                        announce['报告期'] = date_str
+                        announce['公告日期'] = res['公告日期'] if '公告日期' in res.columns else None
+                        announcements.append(announce)
                         
                         # 存储报告期数据
                         report_data[yyyy + mmdd] = res_filtered
@@ -128,6 +137,12 @@ class HolderNumber():
             pivot_df.to_excel(output_filename)
             print(f"数据已保存到 {output_filename}")
             
+            # 保存各报告期的公告日期（长格式）
+            if announcements:
+                announce_filename = os.path.join(self.data_dir, '股东人数公告.xlsx')
+                pd.concat(announcements, ignore_index=True).to_excel(announce_filename, index=False)
+                print(f"公告日期已保存到 {announce_filename}")
+            
             # 显示部分结果
             print("\n部分结果预览:")
             print(pivot_df.head(10))
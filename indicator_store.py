@@ -0,0 +1,385 @@
+import numpy as np
+import pandas as pd
+import warnings
+from stock_store import get_connection, get_engine, load_price_panel
+from indicators import rolling_mean, ema
+
+warnings.filterwarnings('ignore')
+
+# 维护的指标周期
+MA_WINDOWS = (5, 10, 20, 60, 90, 120)
+EMA_SPANS = (12, 26)
+VOLUME_MA_WINDOWS = (5, 20)
+
+# 环形缓冲区长度，需覆盖最长的周期
+CLOSE_RING_SIZE = max(MA_WINDOWS)
+VOLUME_RING_SIZE = max(VOLUME_MA_WINDOWS)
+
+INDICATOR_COLUMNS = ['ma{}'.format(w) for w in MA_WINDOWS] + \
+                    ['ema{}'.format(s) for s in EMA_SPANS] + \
+                    ['vol_ma{}'.format(w) for w in VOLUME_MA_WINDOWS]
+
+
+class IndicatorState():
+    """单只股票的增量指标状态
+
+    收盘价和成交量各用一个环形缓冲区保存最近的值，并为每个周期维护滚动和，
+    新增一根K线时用“加入新值、减去移出窗口的旧值”更新，每根K线O(1)。
+    """
+    __slots__ = ('bar_count', 'close_ring', 'volume_ring', 'close_sums', 'volume_sums', 'emas')
+
+    def __init__(self):
+        self.bar_count = 0
+        self.close_ring = np.zeros(CLOSE_RING_SIZE)
+        self.volume_ring = np.zeros(VOLUME_RING_SIZE)
+        self.close_sums = dict.fromkeys(MA_WINDOWS, 0.0)
+        self.volume_sums = dict.fromkeys(VOLUME_MA_WINDOWS, 0.0)
+        self.emas = dict.fromkeys(EMA_SPANS, np.nan)
+
+    def update(self, close_price, volume):
+        """加入一根新K线，返回当日各指标值（数据不足周期的为NaN）"""
+        close_price = float(close_price)
+        volume = float(volume)
+        n = self.bar_count
+
+        for window in MA_WINDOWS:
+            self.close_sums[window] += close_price
+            if n >= window:
+                # 环形缓冲区中 window 根之前的值正好移出窗口
+                self.close_sums[window] -= self.close_ring[(n - window) % CLOSE_RING_SIZE]
+        for window in VOLUME_MA_WINDOWS:
+            self.volume_sums[window] += volume
+            if n >= window:
+                self.volume_sums[window] -= self.volume_ring[(n - window) % VOLUME_RING_SIZE]
+
+        self.close_ring[n % CLOSE_RING_SIZE] = close_price
+        self.volume_ring[n % VOLUME_RING_SIZE] = volume
+        for span in EMA_SPANS:
+            alpha = 2.0 / (span + 1)
+            self.emas[span] = close_price if n == 0 else alpha * close_price + (1 - alpha) * self.emas[span]
+        self.bar_count = n + 1
+        return self.values()
+
+    def values(self):
+        """当前各指标值"""
+        n = self.bar_count
+        result = {}
+        for window in MA_WINDOWS:
+            result['ma{}'.format(window)] = self.close_sums[window] / window if n >= window else np.nan
+        for span in EMA_SPANS:
+            result['ema{}'.format(span)] = self.emas[span]
+        for window in VOLUME_MA_WINDOWS:
+            result['vol_ma{}'.format(window)] = self.volume_sums[window] / window if n >= window else np.nan
+        return result
+
+    def to_row(self):
+        """序列化为状态表的一行"""
+        row = {
+            'bar_count': self.bar_count,
+            'close_ring': self.close_ring.tobytes(),
+            'volume_ring': self.volume_ring.tobytes()
+        }
+        for span in EMA_SPANS:
+            row['ema{}'.format(span)] = None if np.isnan(self.emas[span]) else float(self.emas[span])
+        return row
+
+    @classmethod
+    def from_row(cls, row):
+        """从状态表的一行恢复，滚动和按环形缓冲区重新求和以消除浮点误差累积"""
+        state = cls()
+        state.bar_count = int(row['bar_count'])
+        state.close_ring = np.frombuffer(row['close_ring'], dtype=np.float64).copy()
+        state.volume_ring = np.frombuffer(row['volume_ring'], dtype=np.float64).copy()
+        for span in EMA_SPANS:
+            value = row['ema{}'.format(span)]
+            state.emas[span] = np.nan if value is None or pd.isna(value) else float(value)
+        n = state.bar_count
+        for window in MA_WINDOWS:
+            positions = np.arange(max(n - window, 0), n) % CLOSE_RING_SIZE
+            state.close_sums[window] = float(state.close_ring[positions].sum())
+        for window in VOLUME_MA_WINDOWS:
+            positions = np.arange(max(n - window, 0), n) % VOLUME_RING_SIZE
+            state.volume_sums[window] = float(state.volume_ring[positions].sum())
+        return state
+
+
+class IndicatorArrays():
+    """多只股票的增量指标状态（数组版），更新规则与 IndicatorState 相同
+
+    每只股票占一个槽位，环形缓冲区为 槽位×长度 的二维数组，滚动和与EMA为按槽位的一维数组，
+    每个交易日对当日有K线的全部股票一次向量化更新，供逐日推进的事件驱动回测使用。
+    """
+    __slots__ = ('bar_count', 'close_ring', 'volume_ring', 'close_sums', 'volume_sums', 'emas')
+
+    def __init__(self, capacity=0):
+        self.bar_count = np.zeros(capacity, dtype=np.int64)
+        self.close_ring = np.zeros((capacity, CLOSE_RING_SIZE))
+        self.volume_ring = np.zeros((capacity, VOLUME_RING_SIZE))
+        self.close_sums = {window: np.zeros(capacity) for window in MA_WINDOWS}
+        self.volume_sums = {window: np.zeros(capacity) for window in VOLUME_MA_WINDOWS}
+        self.emas = {span: np.full(capacity, np.nan) for span in EMA_SPANS}
+
+    @property
+    def capacity(self):
+        return len(self.bar_count)
+
+    def reserve(self, capacity):
+        """槽位不足时按倍数扩容，已有状态保持不变"""
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        extra = capacity - self.capacity
+        self.bar_count = np.concatenate([self.bar_count, np.zeros(extra, dtype=np.int64)])
+        self.close_ring = np.vstack([self.close_ring, np.zeros((extra, CLOSE_RING_SIZE))])
+        self.volume_ring = np.vstack([self.volume_ring, np.zeros((extra, VOLUME_RING_SIZE))])
+        for sums in (self.close_sums, self.volume_sums):
+            for window in sums:
+                sums[window] = np.concatenate([sums[window], np.zeros(extra)])
+        for span in EMA_SPANS:
+            self.emas[span] = np.concatenate([self.emas[span], np.full(extra, np.nan)])
+
+    def update(self, slots, close_price, volume):
+        """对 slots 中的股票各加入一根新K线（slots 不可重复），返回与 slots 对齐的各指标数组"""
+        slots = np.asarray(slots, dtype=np.int64)
+        close_price = np.asarray(close_price, dtype=np.float64)
+        volume = np.asarray(volume, dtype=np.float64)
+        n = self.bar_count[slots]
+
+        for window in MA_WINDOWS:
+            sums = self.close_sums[window]
+            sums[slots] += close_price
+            full = n >= window
+            # 环形缓冲区中 window 根之前的值正好移出窗口
+            sums[slots[full]] -= self.close_ring[slots[full], (n[full] - window) % CLOSE_RING_SIZE]
+        for window in VOLUME_MA_WINDOWS:
+            sums = self.volume_sums[window]
+            sums[slots] += volume
+            full = n >= window
+            sums[slots[full]] -= self.volume_ring[slots[full], (n[full] - window) % VOLUME_RING_SIZE]
+
+        self.close_ring[slots, n % CLOSE_RING_SIZE] = close_price
+        self.volume_ring[slots, n % VOLUME_RING_SIZE] = volume
+        for span in EMA_SPANS:
+            alpha = 2.0 / (span + 1)
+            previous = self.emas[span][slots]
+            self.emas[span][slots] = np.where(n == 0, close_price, alpha * close_price + (1 - alpha) * previous)
+        self.bar_count[slots] = n + 1
+        return self.values(slots)
+
+    def values(self, slots):
+        """slots 中各股票当前的指标值（数据不足周期的为NaN）"""
+        slots = np.asarray(slots, dtype=np.int64)
+        n = self.bar_count[slots]
+        result = {}
+        for window in MA_WINDOWS:
+            result['ma{}'.format(window)] = np.where(n >= window, self.close_sums[window][slots] / window, np.nan)
+        for span in EMA_SPANS:
+            result['ema{}'.format(span)] = self.emas[span][slots]
+        for window in VOLUME_MA_WINDOWS:
+            result['vol_ma{}'.format(window)] = np.where(n >= window, self.volume_sums[window][slots] / window, np.nan)
+        return result
+
+
+def create_indicator_tables():
+    """创建指标表（与stock_data按 股票代码+交易日 对应）和增量状态表"""
+    indicator_columns = ''.join('{} DOUBLE NULL,\n                '.format(col) for col in INDICATOR_COLUMNS)
+    create_indicator_sql = """
+            CREATE TABLE IF NOT EXISTS stock_indicator (
+                stock_code VARCHAR(20) NOT NULL COMMENT '股票代码',
+                trade_date DATE NOT NULL COMMENT '交易日期',
+                {}PRIMARY KEY (stock_code, trade_date),
+                INDEX idx_trade_date (trade_date)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='股票技术指标表'
+            """.format(indicator_columns)
+    ema_columns = ''.join('ema{} DOUBLE NULL,\n                '.format(span) for span in EMA_SPANS)
+    create_state_sql = """
+            CREATE TABLE IF NOT EXISTS stock_indicator_state (
+                stock_code VARCHAR(20) NOT NULL PRIMARY KEY COMMENT '股票代码',
+                last_trade_date DATE NOT NULL COMMENT '最后交易日期',
+                bar_count INT NOT NULL COMMENT '累计K线条数',
+                {}close_ring BLOB NOT NULL COMMENT '收盘价环形缓冲区(float64)',
+                volume_ring BLOB NOT NULL COMMENT '成交量环形缓冲区(float64)'
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='技术指标增量状态表'
+            """.format(ema_columns)
+
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_indicator_sql)
+            cursor.execute(create_state_sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _upsert(table, columns, rows, batch_size=10000):
+    """批量写入（主键冲突时覆盖）"""
+    if not rows:
+        return
+    sql = "INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns)),
+        ', '.join('{0} = VALUES({0})'.format(col) for col in columns))
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            for begin in range(0, len(rows), batch_size):
+                cursor.executemany(sql, rows[begin:begin + batch_size])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _none_if_nan(value):
+    return None if value is None or np.isnan(value) else float(value)
+
+
+def _state_row(stock_code, trade_date, state):
+    row = state.to_row()
+    return [stock_code, trade_date, row['bar_count']] + [row['ema{}'.format(s)] for s in EMA_SPANS] + \
+           [row['close_ring'], row['volume_ring']]
+
+
+STATE_COLUMNS = ['stock_code', 'last_trade_date', 'bar_count'] + ['ema{}'.format(s) for s in EMA_SPANS] + \
+                ['close_ring', 'volume_ring']
+
+
+def rebuild_indicators(batch_size=200000, stock_codes=None):
+    """从stock_data重建指标表和状态表（历史数据被修改后调用），stock_codes 指定时只重建这些股票"""
+    create_indicator_tables()
+    panel = load_price_panel(fields=('close_price', 'volume'), stock_codes=stock_codes)
+    if panel.n_rows == 0:
+        print("数据库中没有数据，无需重建指标表")
+        return 0
+
+    close = panel.values('close_price')
+    volume = panel.values('volume')
+    offsets = panel.offsets
+    values = {}
+    for window in MA_WINDOWS:
+        values['ma{}'.format(window)] = rolling_mean(close, window, offsets)
+    for span in EMA_SPANS:
+        values['ema{}'.format(span)] = ema(close, span, offsets)
+    for window in VOLUME_MA_WINDOWS:
+        values['vol_ma{}'.format(window)] = rolling_mean(volume, window, offsets)
+
+    # 分批写入，避免一次性生成全部行对象
+    stock_ids = panel.stock_ids()
+    for begin in range(0, panel.n_rows, batch_size):
+        end = min(begin + batch_size, panel.n_rows)
+        dates = panel.day[begin:end].astype('datetime64[D]').astype(str)
+        codes = panel.codes[stock_ids[begin:end]]
+        matrix = np.column_stack([values[col][begin:end] for col in INDICATOR_COLUMNS]).astype(object)
+        matrix[pd.isna(matrix)] = None
+        indicator_rows = [[code, date] + list(row) for code, date, row in zip(codes, dates, matrix)]
+        _upsert('stock_indicator', ['stock_code', 'trade_date'] + INDICATOR_COLUMNS, indicator_rows)
+
+    # 用每只股票最近的K线恢复环形缓冲区和滚动状态
+    state_rows = []
+    for i in range(panel.n_stocks):
+        start, end = int(panel.offsets[i]), int(panel.offsets[i + 1])
+        if end == start:
+            continue
+        state = IndicatorState()
+        state.bar_count = end - start
+        for pos in range(max(start, end - CLOSE_RING_SIZE), end):
+            state.close_ring[(pos - start) % CLOSE_RING_SIZE] = close[pos]
+        for pos in range(max(start, end - VOLUME_RING_SIZE), end):
+            state.volume_ring[(pos - start) % VOLUME_RING_SIZE] = volume[pos]
+        for span in EMA_SPANS:
+            state.emas[span] = values['ema{}'.format(span)][end - 1]
+        state_rows.append(_state_row(panel.codes[i], str(panel.day[end - 1].astype('datetime64[D]')), state))
+    _upsert('stock_indicator_state', STATE_COLUMNS, state_rows)
+
+    print(f"指标表{'重建' if stock_codes is None else '补齐'}完成，共 {panel.n_stocks} 只股票 {panel.n_rows} 条记录")
+    return panel.n_rows
+
+
+def update_indicators(df, engine=None):
+    """用新导入的日K线增量更新指标表，每只股票每根K线O(1)
+
+    df 至少包含 stock_code, trade_date, close_price, volume 列。已计入的交易日会被跳过；
+    状态表为空时从stock_data全量重建。环形缓冲区只能逐根K线推进：stock_data 中在状态之后还有本次没有传入的K线
+    （由其它导入脚本写入、中间漏导了某天，或股票还没有状态但已有历史）时，这些股票先从stock_data重建。
+    """
+    if df is None or len(df) == 0:
+        return 0
+    engine = engine if engine is not None else get_engine()
+    create_indicator_tables()
+
+    count = pd.read_sql("SELECT COUNT(*) AS total FROM stock_indicator_state", engine)['total'].iloc[0]
+    if count == 0:
+        return rebuild_indicators()
+
+    bars = df.copy()
+    bars['stock_code'] = bars['stock_code'].astype(str)
+    bars['trade_date'] = pd.to_datetime(bars['trade_date']).dt.date
+    bars = bars.sort_values(['stock_code', 'trade_date'])
+
+    codes = bars['stock_code'].unique().tolist()
+    state_df = pd.read_sql(
+        "SELECT * FROM stock_indicator_state WHERE stock_code IN ({})".format(', '.join(['%s'] * len(codes))),
+        engine, params=tuple(codes)
+    )
+    states = {}
+    last_dates = {}
+    for row in state_df.to_dict('records'):
+        states[row['stock_code']] = IndicatorState.from_row(row)
+        last_dates[row['stock_code']] = pd.to_datetime(row['last_trade_date']).date()
+
+    # stock_data 中状态之后的K线数多于本次传入的K线数，说明中间有缺口，这些股票改为重建
+    after_state = bars[[code not in last_dates or date > last_dates[code]
+                        for code, date in zip(bars['stock_code'], bars['trade_date'])]]
+    expected = after_state.groupby('stock_code')['trade_date'].nunique()
+    stored = pd.read_sql(
+        "SELECT d.stock_code, COUNT(*) AS total FROM stock_data d "
+        "LEFT JOIN stock_indicator_state s ON s.stock_code = d.stock_code "
+        "WHERE d.stock_code IN ({}) AND (s.last_trade_date IS NULL OR d.trade_date > s.last_trade_date) "
+        "GROUP BY d.stock_code".format(', '.join(['%s'] * len(codes))), engine, params=tuple(codes))
+    gaps = sorted(code for code, total in zip(stored['stock_code'].astype(str), stored['total'])
+                  if total > expected.get(code, 0))
+    rebuilt_rows = 0
+    if gaps:
+        print(f"{len(gaps)} 只股票的指标状态与stock_data之间有缺口，从stock_data重建: {gaps[:10]}")
+        rebuilt_rows = rebuild_indicators(stock_codes=gaps)
+    gap_codes = set(gaps)
+
+    indicator_rows = []
+    for row in bars.itertuples(index=False):
+        if row.stock_code in gap_codes:
+            continue
+        if row.stock_code in last_dates and row.trade_date <= last_dates[row.stock_code]:
+            continue
+        state = states.setdefault(row.stock_code, IndicatorState())
+        values = state.update(row.close_price, row.volume)
+        last_dates[row.stock_code] = row.trade_date
+        indicator_rows.append([row.stock_code, str(row.trade_date)] + [_none_if_nan(values[col]) for col in INDICATOR_COLUMNS])
+
+    updated_codes = {row[0] for row in indicator_rows}
+    _upsert('stock_indicator', ['stock_code', 'trade_date'] + INDICATOR_COLUMNS, indicator_rows)
+    _upsert('stock_indicator_state', STATE_COLUMNS,
+            [_state_row(code, str(last_dates[code]), states[code]) for code in sorted(updated_codes)])
+    print(f"已更新 {len(updated_codes)} 只股票的技术指标")
+    return len(indicator_rows) + rebuilt_rows
+
+
+def load_indicators(stock_code, columns=None, start_date=None, engine=None):
+    """读取单只股票预先计算好的指标，以交易日为索引；没有数据时返回空DataFrame"""
+    columns = INDICATOR_COLUMNS if columns is None else [col for col in columns if col in INDICATOR_COLUMNS]
+    engine = engine if engine is not None else get_engine()
+    query = "SELECT trade_date, {} FROM stock_indicator WHERE stock_code = %s".format(', '.join(columns))
+    params = [stock_code]
+    if start_date is not None:
+        query += " AND trade_date >= %s"
+        params.append(str(start_date))
+    query += " ORDER BY trade_date"
+    try:
+        df = pd.read_sql(query, engine, params=tuple(params))
+    except Exception as e:
+        print(f"读取 {stock_code} 的技术指标时出错: {e}")
+        return pd.DataFrame(columns=columns)
+    df['trade_date'] = pd.to_datetime(df['trade_date'])
+    return df.set_index('trade_date')
+
+
+if __name__ == '__main__':
+    rebuild_indicators()
@@ -0,0 +1,342 @@
+import numpy as np
+import pandas as pd
+import time
+from scipy.signal import lfilter
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+
+
+def row_positions(offsets):
+    """每一行在所属股票内的序号（从0开始）"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    return np.arange(offsets[-1], dtype=np.int64) - np.repeat(offsets[:-1], lengths)
+
+
+def shift(values, offsets, periods=1, fill=np.nan):
+    """同一只股票内向后平移 periods 行（取前 periods 日的值），不跨越股票边界"""
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), fill, dtype=np.float64)
+    if periods < len(values):
+        result[periods:] = values[:len(values) - periods]
+    result[row_positions(offsets) < periods] = fill
+    return result
+
+
+def rolling_sum(values, window, offsets):
+    """按股票计算最近 window 根K线的滚动和，不足 window 根时为NaN
+
+    使用全市场一次前缀和相减得到，不按股票循环。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    cumsum = np.concatenate([[0.0], np.cumsum(values)])
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        result[window - 1:] = cumsum[window:] - cumsum[:len(values) - window + 1]
+    result[row_positions(offsets) < window - 1] = np.nan
+    return result
+
+
+def rolling_mean(values, window, offsets):
+    """按股票计算 window 日简单移动平均"""
+    return rolling_sum(values, window, offsets) / window
+
+
+def cross_above(fast, slow, offsets):
+    """fast 当日上穿 slow：当日 fast > slow 且前一日 fast <= slow"""
+    fast = np.asarray(fast, dtype=np.float64)
+    slow = np.asarray(slow, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return (fast > slow) & (shift(fast, offsets) <= shift(slow, offsets))
+
+
+def cross_below(fast, slow, offsets):
+    """fast 当日下穿 slow：当日 fast < slow 且前一日 fast >= slow"""
+    fast = np.asarray(fast, dtype=np.float64)
+    slow = np.asarray(slow, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return (fast < slow) & (shift(fast, offsets) >= shift(slow, offsets))
+
+
+def to_matrix(values, offsets, fill=np.nan):
+    """将扁平数组按股票展开为左对齐的二维矩阵（第 j 列为该股票的第 j 根K线）"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    width = int(lengths.max()) if len(lengths) else 0
+    matrix = np.full((len(lengths), width), fill, dtype=np.float64)
+    matrix[np.repeat(np.arange(len(lengths)), lengths), row_positions(offsets)] = values
+    return matrix
+
+
+def from_matrix(matrix, offsets):
+    """to_matrix 的逆操作，把左对齐矩阵收回为扁平数组"""
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    return matrix[np.repeat(np.arange(len(lengths)), lengths), row_positions(offsets)]
+
+
+def ewm_scan(values, alpha, offsets, initial=None):
+    """按股票计算递推 y[t] = alpha * x[t] + (1 - alpha) * y[t-1]
+
+    initial 为None时以第一根K线为初值，与 pandas 的 ewm(alpha=alpha, adjust=False).mean() 一致；
+    否则以 initial 作为 y[-1]（如KDJ的初值50）。各股票左对齐后沿时间轴
+    用 scipy.signal.lfilter 一次完成递推，不按股票循环。
+    """
+    matrix = to_matrix(values, offsets, fill=0.0)
+    if matrix.size == 0:
+        return np.empty(0)
+    if initial is None:
+        # 初始状态使第一根K线的输出等于其自身
+        zi = (1 - alpha) * matrix[:, :1]
+    else:
+        zi = np.full((matrix.shape[0], 1), (1 - alpha) * initial)
+    result, _ = lfilter([alpha], [1.0, alpha - 1.0], matrix, axis=1, zi=zi)
+    return from_matrix(result, offsets)
+
+
+def ema(values, span, offsets):
+    """按股票计算 span 日指数移动平均"""
+    return ewm_scan(values, 2.0 / (span + 1), offsets)
+
+
+def sma_cn(values, n, m, offsets, initial=None):
+    """国内行情软件的 SMA(X, N, M)：Y = (M * X + (N - M) * Y') / N"""
+    return ewm_scan(values, m / n, offsets, initial)
+
+
+def masked_offsets(offsets, mask):
+    """剔除 mask 为False的行（停牌等）后各股票新的起始行号"""
+    kept = np.concatenate([[0], np.cumsum(mask, dtype=np.int64)])
+    return kept[np.asarray(offsets, dtype=np.int64)]
+
+
+def expand(values, mask):
+    """把只在 mask 行上计算的结果放回完整行数，其余行为NaN"""
+    result = np.full(len(mask), np.nan)
+    result[mask] = values
+    return result
+
+
+def tradable_mask(panel):
+    """有成交且价格有效的K线，停牌（成交量为0）或价格缺失的行为False"""
+    mask = panel['volume'] > 0
+    if 'close_price' in panel:
+        close = panel.values('close_price')
+        mask &= np.isfinite(close) & (close > 0)
+    return mask
+
+
+def rolling_max(values, window, offsets):
+    """按股票计算最近 window 根K线的最高值（不足 window 根时取已有K线）"""
+    matrix = to_matrix(values, offsets, fill=-np.inf)
+    if matrix.size == 0:
+        return np.empty(0)
+    # origin 使窗口为 [t - window + 1, t]，左侧以 -inf 补齐
+    result = maximum_filter1d(matrix, size=window, axis=1, origin=(window - 1) // 2, mode='constant', cval=-np.inf)
+    return from_matrix(result, offsets)
+
+
+def rolling_min(values, window, offsets):
+    """按股票计算最近 window 根K线的最低值（不足 window 根时取已有K线）"""
+    matrix = to_matrix(values, offsets, fill=np.inf)
+    if matrix.size == 0:
+        return np.empty(0)
+    result = minimum_filter1d(matrix, size=window, axis=1, origin=(window - 1) // 2, mode='constant', cval=np.inf)
+    return from_matrix(result, offsets)
+
+
+def rolling_std(values, window, offsets, ddof=1):
+    """按股票计算 window 日滚动标准差，不足 window 根时为NaN"""
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    # 先减去各股票的均值再做前缀和，减小平方和相减的数值误差
+    sums = np.add.reduceat(values, offsets[:-1][lengths > 0]) if len(values) else np.empty(0)
+    means = np.zeros(len(lengths))
+    means[lengths > 0] = sums / lengths[lengths > 0]
+    centered = values - np.repeat(means, lengths)
+    total = rolling_sum(centered, window, offsets)
+    total_sq = rolling_sum(centered ** 2, window, offsets)
+    variance = (total_sq - total ** 2 / window) / (window - ddof)
+    return np.sqrt(np.maximum(variance, 0))
+
+
+def macd(close, offsets, fast=12, slow=26, signal=9, mask=None):
+    """MACD，返回 (DIF, DEA, MACD柱)，柱值按国内习惯为 2 * (DIF - DEA)"""
+    if mask is not None:
+        return tuple(expand(r, mask) for r in macd(np.asarray(close)[mask], masked_offsets(offsets, mask), fast, slow, signal))
+    dif = ema(close, fast, offsets) - ema(close, slow, offsets)
+    dea = ema(dif, signal, offsets)
+    return dif, dea, 2 * (dif - dea)
+
+
+def rsi(close, offsets, period=14, mask=None):
+    """RSI（Wilder平滑，即 SMA(X, N, 1)），每只股票第一根K线为NaN"""
+    if mask is not None:
+        return expand(rsi(np.asarray(close)[mask], masked_offsets(offsets, mask), period), mask)
+    close = np.asarray(close, dtype=np.float64)
+    delta = close - shift(close, offsets)
+    # 每只股票第一根K线没有涨跌，剔除后再做平滑
+    has_delta = row_positions(offsets) > 0
+    sub_offsets = masked_offsets(offsets, has_delta)
+    gain = sma_cn(np.maximum(delta[has_delta], 0), period, 1, sub_offsets)
+    loss = sma_cn(np.maximum(-delta[has_delta], 0), period, 1, sub_offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = np.where(gain + loss > 0, 100 * gain / (gain + loss), 50.0)
+    return expand(value, has_delta)
+
+
+def kdj(high, low, close, offsets, n=9, m1=3, m2=3, mask=None):
+    """KDJ，返回 (K, D, J)，K、D 初值为50，最高最低价区间为0时 RSV 取50"""
+    if mask is not None:
+        return tuple(expand(r, mask) for r in kdj(np.asarray(high)[mask], np.asarray(low)[mask], np.asarray(close)[mask],
+                                                  masked_offsets(offsets, mask), n, m1, m2))
+    highest = rolling_max(high, n, offsets)
+    lowest = rolling_min(low, n, offsets)
+    price_range = highest - lowest
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsv = np.where(price_range > 0, (np.asarray(close, dtype=np.float64) - lowest) / price_range * 100, 50.0)
+    k = sma_cn(rsv, m1, 1, offsets, initial=50.0)
+    d = sma_cn(k, m2, 1, offsets, initial=50.0)
+    return k, d, 3 * k - 2 * d
+
+
+def boll(close, offsets, n=20, width=2, mask=None):
+    """布林线，返回 (上轨, 中轨, 下轨)"""
+    if mask is not None:
+        return tuple(expand(r, mask) for r in boll(np.asarray(close)[mask], masked_offsets(offsets, mask), n, width))
+    mid = rolling_mean(close, n, offsets)
+    std = rolling_std(close, n, offsets)
+    return mid + width * std, mid, mid - width * std
+
+
+def atr(high, low, close, offsets, n=14, mask=None):
+    """平均真实波幅 ATR = MA(TR, N)，每只股票第一根K线的TR为最高价减最低价"""
+    if mask is not None:
+        return expand(atr(np.asarray(high)[mask], np.asarray(low)[mask], np.asarray(close)[mask],
+                          masked_offsets(offsets, mask), n), mask)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    prev_close = shift(close, offsets)
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    return rolling_mean(true_range, n, offsets)
+
+
+def obv(close, volume, offsets, mask=None):
+    """能量潮 OBV，按股票从0开始累计"""
+    if mask is not None:
+        return expand(obv(np.asarray(close)[mask], np.asarray(volume)[mask], masked_offsets(offsets, mask)), mask)
+    close = np.asarray(close, dtype=np.float64)
+    direction = np.nan_to_num(np.sign(close - shift(close, offsets)))
+    signed_volume = direction * np.asarray(volume, dtype=np.float64)
+    # 分段累加：全局前缀和减去每只股票开始前的前缀和
+    cumsum = np.cumsum(signed_volume)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    base = np.concatenate([[0.0], cumsum])[offsets[:-1]]
+    return cumsum - np.repeat(base, np.diff(offsets))
+
+
+def turnover_ma(turnover_rate, offsets, windows=(5, 10, 20), mask=None):
+    """换手率均线，返回 {周期: 数组}"""
+    if mask is not None:
+        sub = turnover_ma(np.asarray(turnover_rate)[mask], masked_offsets(offsets, mask), windows)
+        return {window: expand(values, mask) for window, values in sub.items()}
+    return {window: rolling_mean(turnover_rate, window, offsets) for window in windows}
+
+
+def panel_indicators(panel, mask=None):
+    """在全市场面板上计算全部常用指标，返回 {指标名: 与面板行数相同的数组}"""
+    offsets = panel.offsets
+    high = panel.values('high_price')
+    low = panel.values('low_price')
+    close = panel.values('close_price')
+    volume = panel.values('volume')
+    result = {}
+    result['dif'], result['dea'], result['macd'] = macd(close, offsets, mask=mask)
+    result['rsi6'] = rsi(close, offsets, 6, mask=mask)
+    result['rsi14'] = rsi(close, offsets, 14, mask=mask)
+    result['k'], result['d'], result['j'] = kdj(high, low, close, offsets, mask=mask)
+    result['boll_upper'], result['boll_mid'], result['boll_lower'] = boll(close, offsets, mask=mask)
+    result['atr14'] = atr(high, low, close, offsets, mask=mask)
+    result['obv'] = obv(close, volume, offsets, mask=mask)
+    if 'turnover_rate' in panel:
+        for window, values in turnover_ma(panel.values('turnover_rate'), offsets, mask=mask).items():
+            result['turnover_ma{}'.format(window)] = values
+    return result
+
+
+def _pandas_reference(df):
+    """单只股票的pandas参考实现，用于校验 panel_indicators 的结果"""
+    close, high, low, volume = df['close_price'], df['high_price'], df['low_price'], df['volume']
+    result = {}
+    dif = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    dea = dif.ewm(span=9, adjust=False).mean()
+    result['dif'], result['dea'], result['macd'] = dif, dea, 2 * (dif - dea)
+    delta = close.diff()
+    for period in (6, 14):
+        gain = delta.clip(lower=0).ewm(alpha=1 / period, adjust=False).mean()
+        loss = (-delta).clip(lower=0).ewm(alpha=1 / period, adjust=False).mean()
+        value = (100 * gain / (gain + loss)).where(gain + loss > 0, 50.0)
+        result['rsi{}'.format(period)] = value.where(delta.notna())
+    highest = high.rolling(9, min_periods=1).max()
+    lowest = low.rolling(9, min_periods=1).min()
+    rsv = ((close - lowest) / (highest - lowest) * 100).where(highest > lowest, 50.0)
+    k = pd.concat([pd.Series([50.0]), rsv], ignore_index=True).ewm(alpha=1 / 3, adjust=False).mean().iloc[1:].values
+    d = pd.concat([pd.Series([50.0]), pd.Series(k)], ignore_index=True).ewm(alpha=1 / 3, adjust=False).mean().iloc[1:].values
+    result['k'], result['d'], result['j'] = k, d, 3 * k - 2 * d
+    mid = close.rolling(20).mean()
+    std = close.rolling(20).std()
+    result['boll_upper'], result['boll_mid'], result['boll_lower'] = mid + 2 * std, mid, mid - 2 * std
+    prev_close = close.shift()
+    true_range = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+    result['atr14'] = true_range.rolling(14).mean()
+    result['obv'] = (np.sign(delta).fillna(0) * volume).cumsum()
+    if 'turnover_rate' in df:
+        for window in (5, 10, 20):
+            result['turnover_ma{}'.format(window)] = df['turnover_rate'].rolling(window).mean()
+    return {name: np.asarray(values, dtype=np.float64) for name, values in result.items()}
+
+
+def benchmark_indicators(panel=None):
+    """对比 panel_indicators 与逐只股票pandas计算的耗时，并校验两者数值一致"""
+    if panel is None:
+        from stock_store import load_price_panel
+        panel = load_price_panel(fields=('open_price', 'high_price', 'low_price', 'close_price', 'volume',
+                                         'change_percent', 'turnover_rate'))
+    mask = tradable_mask(panel)
+
+    begin = time.perf_counter()
+    vectorized = panel_indicators(panel, mask=mask)
+    vectorized_time = time.perf_counter() - begin
+
+    fields = [field for field in ('high_price', 'low_price', 'close_price', 'volume', 'turnover_rate') if field in panel]
+    values = {field: panel.values(field) for field in fields}
+    begin = time.perf_counter()
+    reference = {name: np.full(panel.n_rows, np.nan) for name in vectorized}
+    for i in range(panel.n_stocks):
+        rows = np.arange(panel.offsets[i], panel.offsets[i + 1])[mask[panel.stock_slice(i)]]
+        if len(rows) == 0:
+            continue
+        df = pd.DataFrame({field: values[field][rows] for field in fields})
+        for name, result in _pandas_reference(df).items():
+            reference[name][rows] = result
+    reference_time = time.perf_counter() - begin
+
+    results = []
+    for name in vectorized:
+        a, b = vectorized[name], reference[name]
+        same_nan = bool((np.isnan(a) == np.isnan(b)).all())
+        both = ~np.isnan(a) & ~np.isnan(b)
+        scale = np.maximum(np.abs(b[both]), 1.0)
+        max_error = float((np.abs(a[both] - b[both]) / scale).max()) if both.any() else 0.0
+        results.append({'指标': name, 'NaN位置一致': same_nan, '最大相对误差': max_error})
+
+    result_df = pd.DataFrame(results)
+    print(f"{panel.n_stocks} 只股票 {panel.n_rows} 根K线")
+    print(f"向量化计算耗时 {vectorized_time:.2f} 秒，逐只pandas计算耗时 {reference_time:.2f} 秒，"
+          f"加速 {reference_time / max(vectorized_time, 1e-9):.1f} 倍")
+    print(result_df.to_string(index=False))
+    return result_df
+
+
+if __name__ == '__main__':
+    benchmark_indicators()
@@ -6,6 +6,7 @@ from daily_price import get_daily_price
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import candle_graph
+from chart_cache import ChartCache
 
 class AShareIndex:
     def __init__(self):
@@ -92,6 +93,9 @@ class AShareIndex:
         merged_data = self.compare_companies()
         top10_company = merged_data.sort_values('股票权重', ascending=False).head(10)
         
+        # 股价、财报和股东人数都没有变化的股票直接使用缓存的图片，不重新绘制
+        cache = ChartCache()
+        
         # 为权重前10的公司获取各自股价数据
         for index, row in top10_company.iterrows():
             stock_code = str(row['股票代码_x'])
@@ -99,8 +103,12 @@ class AShareIndex:
             
             # 调用daily_price模块中的get_daily_price函数获取股价数据
             get_daily_price(stock_code=stock_code, stock_name=stock_name, data_dir=self.data_dir)
-            # 调用candle_graph.Map_Drawing生成每只股票的蜡烛图
-            candle_graph.Map_Drawing(stock_name=stock_name, stock_code=stock_code, data_dir=self.data_dir)
+            # 调用candle_graph.Map_Drawing生成每只股票的蜡烛图，图片保存在缓存目录中
+            chart = candle_graph.Map_Drawing(stock_name=stock_name, stock_code=stock_code, data_dir=self.data_dir,
+                                             show=False, cache=cache)
+            print(f"{stock_name} 蜡烛图: {chart.image_path}")
+            plt.close('all')
+        print(f"蜡烛图缓存命中 {cache.hits} 张，重新绘制 {cache.misses} 张")
         
         # # 绘制10家公司的对比折线图
         # self.draw_candlestick_comparison(top10_company)
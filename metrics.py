@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+import time
+import warnings
+
+warnings.filterwarnings('ignore')
+
+# A股每年约243个交易日
+TRADING_DAYS = 243
+
+# 批量自助法每块样本的元素上限（策略数×抽样次数×天数），控制内存占用
+BOOTSTRAP_BLOCK_ELEMENTS = 50000000
+
+
+def _as_2d(returns):
+    """统一为 策略×交易日 的二维float64矩阵，一维输入视为单个策略"""
+    returns = np.asarray(returns, dtype=np.float64)
+    if returns.ndim == 1:
+        return returns[None, :], True
+    if returns.ndim != 2:
+        raise ValueError("收益率须为一维序列或 策略×交易日 的二维矩阵")
+    return returns, False
+
+
+def _result(values, single):
+    return float(values[0]) if single else values
+
+
+def _mean_std(values):
+    """逐行均值和样本标准差；没有NaN时走普通实现，比 nanmean/nanstd 快数倍"""
+    if np.isnan(values).any():
+        return np.nanmean(values, axis=1), np.nanstd(values, axis=1, ddof=1)
+    return values.mean(axis=1), values.std(axis=1, ddof=1)
+
+
+def align_returns(frames, column='daily_return', date_column='trade_date'):
+    """把多条日度净值表（如各参数的回测结果）按交易日对齐为 策略×交易日 矩阵，缺失日为NaN
+
+    frames 为 {名称: DataFrame} 或DataFrame列表，返回 (矩阵, 交易日数组, 名称列表)。
+    """
+    if not isinstance(frames, dict):
+        frames = dict(enumerate(frames))
+    dates = np.unique(np.concatenate([frame[date_column].values for frame in frames.values()])) if frames else \
+        np.empty(0, dtype='datetime64[D]')
+    matrix = np.full((len(frames), len(dates)), np.nan)
+    for k, frame in enumerate(frames.values()):
+        matrix[k, np.searchsorted(dates, frame[date_column].values)] = frame[column].values
+    return matrix, dates, list(frames)
+
+
+def wealth_curve(returns):
+    """逐行累乘得到净值曲线（起点为1，NaN视为当日空仓收益为0）"""
+    returns, single = _as_2d(returns)
+    curve = np.cumprod(1 + np.nan_to_num(returns), axis=1)
+    return curve[0] if single else curve
+
+
+def drawdown_curve(returns):
+    """逐行回撤曲线：净值相对历史最高点（含起点1）的回撤，用 maximum.accumulate 一次扫描"""
+    curve = np.atleast_2d(wealth_curve(returns))
+    peak = np.maximum.accumulate(np.maximum(curve, 1.0), axis=1)
+    drawdown = curve / peak - 1
+    return drawdown[0] if np.ndim(returns) == 1 else drawdown
+
+
+def max_drawdown(returns):
+    """最大回撤（负数，小数）"""
+    returns, single = _as_2d(returns)
+    if returns.shape[1] == 0:
+        return _result(np.zeros(len(returns)), single)
+    return _result(drawdown_curve(returns).min(axis=1), single)
+
+
+def max_drawdown_duration(returns):
+    """最长水下天数：净值低于历史最高点的最长连续交易日数"""
+    returns, single = _as_2d(returns)
+    if returns.shape[1] == 0:
+        return _result(np.zeros(len(returns), dtype=np.int64), single)
+    underwater = drawdown_curve(returns) < 0
+    positions = np.broadcast_to(np.arange(returns.shape[1]), returns.shape)
+    # 每个位置之前最近一次创新高（不在水下）的位置
+    last_high = np.maximum.accumulate(np.where(underwater, -1, positions), axis=1)
+    return _result((positions - last_high).max(axis=1), single)
+
+
+def annual_return(returns, periods=TRADING_DAYS):
+    """年化复合收益率（按有效交易日数折算）"""
+    returns, single = _as_2d(returns)
+    days = np.isfinite(returns).sum(axis=1)
+    total = np.prod(1 + np.nan_to_num(returns), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(days > 0, total ** (periods / np.maximum(days, 1)) - 1, np.nan)
+    return _result(result, single)
+
+
+def annual_volatility(returns, periods=TRADING_DAYS):
+    returns, single = _as_2d(returns)
+    return _result(_mean_std(returns)[1] * np.sqrt(periods), single)
+
+
+def sharpe_ratio(returns, risk_free=0.0, periods=TRADING_DAYS):
+    """年化夏普比率，risk_free 为年化无风险利率；波动为0时为NaN"""
+    returns, single = _as_2d(returns)
+    mean, std = _mean_std(returns)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(std > 0, (mean - risk_free / periods) / std * np.sqrt(periods), np.nan)
+    return _result(result, single)
+
+
+def sortino_ratio(returns, target=0.0, periods=TRADING_DAYS):
+    """年化索提诺比率：超额收益均值 / 下行偏差（只计低于 target 的部分）"""
+    returns, single = _as_2d(returns)
+    excess = returns - target
+    downside = np.sqrt(np.nanmean(np.minimum(excess, 0.0) ** 2, axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(downside > 0, np.nanmean(excess, axis=1) / downside * np.sqrt(periods), np.nan)
+    return _result(result, single)
+
+
+def calmar_ratio(returns, periods=TRADING_DAYS):
+    """卡玛比率：年化收益 / 最大回撤的绝对值；没有回撤时为NaN"""
+    returns, single = _as_2d(returns)
+    drawdown = -np.atleast_1d(max_drawdown(returns))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(drawdown > 0, np.atleast_1d(annual_return(returns, periods)) / drawdown, np.nan)
+    return _result(result, single)
+
+
+def win_rate(returns):
+    """盈利天数占有收益天数（非NaN且不为0）的比例"""
+    returns, single = _as_2d(returns)
+    active = np.isfinite(returns) & (returns != 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(active.any(axis=1), (returns > 0).sum(axis=1) / active.sum(axis=1), np.nan)
+    return _result(result, single)
+
+
+def average_turnover(turnover):
+    """日均换手率（成交金额/总资产的逐行均值）"""
+    turnover, single = _as_2d(turnover)
+    return _result(np.nanmean(turnover, axis=1), single)
+
+
+def performance_table(returns, turnover=None, index=None, risk_free=0.0, periods=TRADING_DAYS):
+    """对 策略×交易日 收益矩阵逐行计算全部指标，返回每个策略一行的DataFrame"""
+    returns, _ = _as_2d(returns)
+    table = pd.DataFrame({
+        '年化收益(%)': annual_return(returns, periods) * 100,
+        '年化波动(%)': annual_volatility(returns, periods) * 100,
+        '夏普比率': sharpe_ratio(returns, risk_free, periods),
+        '索提诺比率': sortino_ratio(returns, risk_free / periods, periods),
+        '最大回撤(%)': max_drawdown(returns) * 100,
+        '最长回撤天数': max_drawdown_duration(returns),
+        '卡玛比率': calmar_ratio(returns, periods),
+        '胜率(%)': win_rate(returns) * 100
+    }, index=index)
+    if turnover is not None:
+        table['日均换手率(%)'] = np.atleast_1d(average_turnover(turnover)) * 100
+    return table
+
+
+def bootstrap_indices(n_days, n_boot, block=1, seed=0):
+    """循环块自助法的抽样下标（n_boot×n_days），block>1 时保留收益的短期自相关"""
+    rng = np.random.default_rng(seed)
+    n_blocks = -(-n_days // block)
+    starts = rng.integers(0, n_days, (n_boot, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block)[None, None, :]).reshape(n_boot, -1)[:, :n_days]
+    return indices % n_days
+
+
+def bootstrap_ci(returns, statistic=sharpe_ratio, n_boot=1000, ci=0.95, block=1, seed=0):
+    """批量自助法置信区间：全部策略共用同一组抽样下标，每块抽样一次性计算
+
+    statistic 为接受 策略×交易日 矩阵并逐行返回数组的函数（本模块中的各指标函数均可）。
+    返回DataFrame，列为 估计值、下限、上限，每个策略一行。
+    """
+    returns, _ = _as_2d(returns)
+    n_strategies, n_days = returns.shape
+    indices = bootstrap_indices(n_days, n_boot, block, seed)
+    samples = np.empty((n_strategies, n_boot))
+    chunk = max(1, int(BOOTSTRAP_BLOCK_ELEMENTS // max(n_strategies * n_days, 1)))
+    for start in range(0, n_boot, chunk):
+        part = indices[start:start + chunk]
+        # (策略, 抽样, 天) 展平为 (策略×抽样, 天) 后逐行计算
+        resampled = returns[:, part].reshape(n_strategies * len(part), n_days)
+        samples[:, start:start + len(part)] = np.asarray(statistic(resampled)).reshape(n_strategies, len(part))
+    alpha = (1 - ci) / 2
+    return pd.DataFrame({
+        '估计值': np.atleast_1d(statistic(returns)),
+        '下限': np.nanquantile(samples, alpha, axis=1),
+        '上限': np.nanquantile(samples, 1 - alpha, axis=1)
+    })
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    returns = rng.normal(0.0004, 0.015, (2000, 2430))
+    begin = time.perf_counter()
+    table = performance_table(returns)
+    print(f"2000 条收益序列的全部指标: {time.perf_counter() - begin:.2f} 秒")
+    begin = time.perf_counter()
+    intervals = bootstrap_ci(returns[:200], n_boot=500, block=5)
+    print(f"200 条序列 × 500 次块自助法: {time.perf_counter() - begin:.2f} 秒")
+    print(table.describe().round(3).to_string())
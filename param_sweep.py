@@ -0,0 +1,287 @@
+import numpy as np
+import pandas as pd
+import itertools
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from stock_store import get_connection, get_engine, load_price_panel
+from shard_executor import SharedPanel, attach_panel
+from screener import IndicatorCache
+from screen_history import params_hash, _json_default
+from backtest import run_backtest, summarize, streak_signals, ma_cross_signals, spike_signals, pivot_low_signals
+
+warnings.filterwarnings('ignore')
+
+# 各策略的参数空间，对应 bottom_7_red_bar（连涨天数、成交量递增检查）、average_line_cross（均线周期、放量倍数）
+# 和 candle_graph（PEAK_VALLEY_WINDOW）中写死的常量，外加持有期和止损
+SWEEP_SPACES = {
+    'streak': {
+        'min_days': list(range(3, 13)),
+        'check_volume': [False, True],
+        'holding_days': [3, 5, 10, 20],
+        'stop_loss': [None, 0.05, 0.08]
+    },
+    'ma_cross': {
+        'fast': [5, 10, 20, 30, 60],
+        'slow': [60, 90, 120],
+        'stop_loss': [None, 0.08, 0.1]
+    },
+    'volume_spike': {
+        'multiple': [2.0, 2.5, 3.0, 4.0, 5.0],
+        'window': [10, 20, 60],
+        'holding_days': [3, 5, 10, 20],
+        'stop_loss': [None, 0.08]
+    },
+    'pivot_low': {
+        'order': [10, 20, 30, 60],
+        'holding_days': [5, 10, 20, 60],
+        'stop_loss': [None, 0.08]
+    }
+}
+
+# 回测参数，其余为信号参数；信号参数相同的点共享同一份信号
+BACKTEST_PARAMS = ('holding_days', 'stop_loss', 'take_profit')
+
+# 结果表中的指标列（summarize 的数值项）
+METRIC_COLUMNS = ['交易笔数', '胜率(%)', '平均收益(%)', '平均持有K线数', '净值', '夏普比率', '最大回撤(%)']
+
+# 每完成多少个参数点写一次缓存，中途中断时已完成的结果不会丢失
+SAVE_EVERY = 50
+
+# 子进程中映射好的面板、共享的指标缓存和最近一次生成的信号
+_WORKER_PANEL = None
+_WORKER_BLOCKS = []
+_WORKER_CACHE = None
+_WORKER_SIGNALS = (None, None)
+
+
+def param_grid(space):
+    """参数空间的全部组合，返回参数字典列表（按空间中各参数的顺序展开）"""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def random_params(space, n, seed=0):
+    """从参数空间中无放回随机抽取 n 个组合，n 不小于组合总数时返回全部组合"""
+    keys = list(space)
+    sizes = [len(space[key]) for key in keys]
+    total = int(np.prod(sizes))
+    if n >= total:
+        return param_grid(space)
+    rng = np.random.default_rng(seed)
+    points = []
+    for index in np.sort(rng.choice(total, n, replace=False)):
+        # 按混合进制把组合序号还原为各参数的取值下标
+        params = {}
+        for key, size in zip(reversed(keys), reversed(sizes)):
+            index, pos = divmod(int(index), size)
+            params[key] = space[key][pos]
+        points.append({key: params[key] for key in keys})
+    return points
+
+
+def valid_params(strategy, params):
+    """剔除无意义的组合（如快线周期不小于慢线）"""
+    if strategy == 'ma_cross':
+        return params['fast'] < params['slow']
+    return True
+
+
+def signal_key(strategy, params):
+    return (strategy,) + tuple((key, params[key]) for key in sorted(params) if key not in BACKTEST_PARAMS)
+
+
+def build_signals(panel, strategy, params, cache=None):
+    """按策略的信号参数生成 (entry, exit)，exit 为None表示只按持有期/止损卖出"""
+    if strategy == 'streak':
+        return streak_signals(panel, params['min_days'], params['check_volume'], cache), None
+    if strategy == 'ma_cross':
+        return ma_cross_signals(panel, params['fast'], params['slow'], cache)
+    if strategy == 'volume_spike':
+        return spike_signals(panel, params['multiple'], params['window'], cache), None
+    if strategy == 'pivot_low':
+        return pivot_low_signals(panel, params['order']), None
+    raise ValueError("未知的策略: {}".format(strategy))
+
+
+def backtest_params(panel, strategy, params, cache=None, signals=None):
+    """按一个参数点在整个面板上回测，返回 run_backtest 的 (交易明细, 日度净值)；signals 可传入已生成的 (entry, exit)"""
+    entry, exit_ = signals if signals is not None else build_signals(panel, strategy, params, cache)
+    kwargs = {key: params[key] for key in BACKTEST_PARAMS if key in params}
+    if strategy == 'ma_cross':
+        # 均线策略以死叉卖出，不设固定持有期
+        kwargs.setdefault('holding_days', None)
+    return run_backtest(panel, entry, exit_, verbose=False, **kwargs)
+
+
+def evaluate_params(panel, strategy, params, cache=None, signals=None):
+    """回测一个参数点，返回指标字典"""
+    trades, equity = backtest_params(panel, strategy, params, cache, signals)
+    summary = summarize(trades, equity)
+    return {col: summary.get(col, 0 if col == '交易笔数' else np.nan) for col in METRIC_COLUMNS}
+
+
+def _init_worker(spec):
+    global _WORKER_PANEL, _WORKER_BLOCKS, _WORKER_CACHE
+    _WORKER_PANEL, _WORKER_BLOCKS = attach_panel(spec)
+    _WORKER_CACHE = IndicatorCache(_WORKER_PANEL)
+
+
+def _evaluate_in_worker(strategy, params):
+    """子进程中回测一个参数点；任务按信号参数排序后分块下发，相邻的点复用上一次的信号"""
+    global _WORKER_SIGNALS
+    begin = time.perf_counter()
+    key = signal_key(strategy, params)
+    if _WORKER_SIGNALS[0] != key:
+        _WORKER_SIGNALS = (key, build_signals(_WORKER_PANEL, strategy, params, _WORKER_CACHE))
+    metrics = evaluate_params(_WORKER_PANEL, strategy, params, signals=_WORKER_SIGNALS[1])
+    return metrics, time.perf_counter() - begin
+
+
+def create_sweep_table():
+    """创建参数扫描结果缓存表，按 策略+参数哈希+数据版本 唯一"""
+    create_table_sql = """
+            CREATE TABLE IF NOT EXISTS stock_sweep_result (
+                strategy VARCHAR(32) NOT NULL COMMENT '策略名称',
+                params_hash CHAR(16) NOT NULL COMMENT '参数哈希',
+                data_version CHAR(16) NOT NULL COMMENT '面板数据指纹',
+                params TEXT NULL COMMENT '参数(JSON)',
+                metrics TEXT NULL COMMENT '回测指标(JSON)',
+                run_seconds DOUBLE NULL COMMENT '计算耗时(秒)',
+                PRIMARY KEY (strategy, data_version, params_hash)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='参数扫描结果缓存表'
+            """
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def load_cached_results(strategy, data_version):
+    """读取某策略在该数据版本下已缓存的结果，返回 {参数哈希: 指标字典}；数据库不可用时返回空字典"""
+    try:
+        create_sweep_table()
+        cached = pd.read_sql("SELECT params_hash, metrics FROM stock_sweep_result "
+                             "WHERE strategy = %s AND data_version = %s", get_engine(), params=(strategy, data_version))
+    except Exception as e:
+        print(f"读取扫描缓存失败: {e}")
+        return {}
+    return {row.params_hash: json.loads(row.metrics) for row in cached.itertuples()}
+
+
+def save_results(strategy, data_version, records):
+    """写入扫描结果缓存，records 为 [(参数, 指标, 耗时), ...]"""
+    if not records:
+        return
+    rows = [(strategy, params_hash(params), data_version, json.dumps(params, ensure_ascii=False, default=str),
+             json.dumps(metrics, ensure_ascii=False, default=_json_default), seconds)
+            for params, metrics, seconds in records]
+    try:
+        connection = get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT INTO stock_sweep_result (strategy, params_hash, data_version, params, metrics, run_seconds) "
+                    "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE params = VALUES(params), "
+                    "metrics = VALUES(metrics), run_seconds = VALUES(run_seconds)", rows)
+            connection.commit()
+        finally:
+            connection.close()
+    except Exception as e:
+        print(f"保存扫描结果失败: {e}")
+
+
+def run_sweep(strategy, points=None, n_random=None, panel=None, workers=None, force=False, seed=0, chunksize=4):
+    """对一个策略做参数扫描，返回每个参数点一行的结果表（参数列 + 指标列 + 耗时 + 是否来自缓存）
+
+    points 为参数字典列表，默认取 SWEEP_SPACES 的全部组合（n_random 给定时随机抽取）。
+    结果按 (参数, 面板数据指纹) 缓存在 stock_sweep_result 表中，force=True 时重新计算。
+    未命中的点在进程池中计算：面板只放入共享内存一次，各进程映射同一份数据并各自缓存中间指标；
+    任务按信号参数排序，只有回测参数不同的相邻点复用同一份信号。
+    """
+    begin = time.perf_counter()
+    if points is None:
+        space = SWEEP_SPACES[strategy]
+        points = random_params(space, n_random, seed) if n_random else param_grid(space)
+    points = [params for params in points if valid_params(strategy, params)]
+    if panel is None:
+        panel = load_price_panel()
+    data_version = panel.fingerprint()
+
+    cached = {} if force else load_cached_results(strategy, data_version)
+    results = {}
+    todo = []
+    for params in points:
+        key = params_hash(params)
+        if key in cached:
+            results[key] = (cached[key], np.nan, True)
+        elif key not in results:
+            results[key] = None
+            todo.append(params)
+    todo.sort(key=lambda params: str(signal_key(strategy, params)))
+    print(f"{strategy}: 共 {len(points)} 个参数点，缓存命中 {len(points) - len(todo)} 个，需计算 {len(todo)} 个")
+
+    workers = workers or os.cpu_count() or 1
+    pending = []
+    done = 0
+
+    def collect(params, metrics, seconds):
+        nonlocal done, pending
+        results[params_hash(params)] = (metrics, seconds, False)
+        pending.append((params, metrics, seconds))
+        done += 1
+        if len(pending) >= SAVE_EVERY or done == len(todo):
+            save_results(strategy, data_version, pending)
+            pending = []
+            elapsed = time.perf_counter() - begin
+            print(f"已完成 {done}/{len(todo)}，耗时 {elapsed:.1f} 秒，预计剩余 {elapsed / done * (len(todo) - done):.1f} 秒")
+
+    if todo and (workers == 1 or len(todo) == 1):
+        cache = IndicatorCache(panel)
+        last_key, signals = None, None
+        for params in todo:
+            point_begin = time.perf_counter()
+            key = signal_key(strategy, params)
+            if key != last_key:
+                last_key, signals = key, build_signals(panel, strategy, params, cache)
+            collect(params, evaluate_params(panel, strategy, params, signals=signals), time.perf_counter() - point_begin)
+    elif todo:
+        with SharedPanel(panel) as shared:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(shared.spec(),)) as executor:
+                outputs = executor.map(_evaluate_in_worker, [strategy] * len(todo), todo, chunksize=chunksize)
+                for params, (metrics, seconds) in zip(todo, outputs):
+                    collect(params, metrics, seconds)
+
+    rows = []
+    for params in points:
+        metrics, seconds, from_cache = results[params_hash(params)]
+        rows.append(dict(params, **metrics, run_seconds=seconds, cached=from_cache))
+    table = pd.DataFrame(rows)
+    wall = time.perf_counter() - begin
+    print(f"{strategy} 扫描完成：{len(points)} 个参数点，墙钟 {wall:.1f} 秒，"
+          f"平均每个新计算点 {wall / max(len(todo), 1):.2f} 秒（{workers} 个进程）")
+    return table
+
+
+def heatmap_table(results, rows, columns, metric='平均收益(%)', agg='max'):
+    """把扫描结果整理为热力图矩阵：行、列为两个参数，其余参数按 agg 聚合（默认取最优）"""
+    if metric not in results.columns:
+        raise ValueError("结果中没有指标列: {}".format(metric))
+    data = results.copy()
+    # None（如不止损）不能作为透视表的键
+    data[[rows, columns]] = data[[rows, columns]].astype(object).where(data[[rows, columns]].notna(), 'None')
+    return data.pivot_table(index=rows, columns=columns, values=metric, aggfunc=agg)
+
+
+if __name__ == '__main__':
+    panel = load_price_panel()
+    results = run_sweep('streak', panel=panel)
+    print(heatmap_table(results, 'min_days', 'holding_days').round(2).to_string())
+    results = run_sweep('ma_cross', panel=panel)
+    print(heatmap_table(results, 'fast', 'slow', metric='净值').round(3).to_string())
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+import warnings
+from stock_store import get_connection, get_engine, load_price_panel
+
+warnings.filterwarnings('ignore')
+
+# 批量计算并入库的阶段性高低点窗口（order），30 与 candle_graph 默认窗口一致
+PIVOT_ORDERS = (10, 20, 30, 60)
+
+PIVOT_COLUMNS = ['stock_code', 'stock_name', 'window_size', 'pivot_type', 'trade_date', 'price', 'close_price',
+                 'confirm_date']
+
+
+def _extrema_rows(values, starts, ends, orders, comparator):
+    """多个窗口一次完成的局部极值检测，返回 {order: 行号数组}
+
+    与 scipy.signal.argrelextrema(mode='clip') 相同：第 i 行需与左右各 order 根K线严格比较，
+    越过该股票首尾的位置取首尾K线（因此首尾两根永远不是极值）。
+    按 j = 1, 2, ... 逐步比较，只保留仍满足条件的候选行，候选集合很快缩小；
+    j 等于某个窗口时记录当时的候选，即该窗口下的极值点。
+    """
+    orders = sorted(set(int(order) for order in orders))
+    if orders and orders[0] < 1:
+        raise ValueError("窗口大小必须为正整数: {}".format(orders))
+    result = {}
+    candidates = np.arange(len(values))
+    for j in range(1, orders[-1] + 1 if orders else 1):
+        current = values[candidates]
+        with np.errstate(invalid='ignore'):
+            keep = comparator(current, values[np.minimum(candidates + j, ends[candidates])]) & \
+                   comparator(current, values[np.maximum(candidates - j, starts[candidates])])
+        candidates = candidates[keep]
+        if j in orders:
+            result[j] = candidates
+    return result
+
+
+def pivot_rows(values, offsets, orders=PIVOT_ORDERS):
+    """在按股票拼接的扁平数组上检测各窗口的阶段高点和低点
+
+    返回 {order: (高点行号, 低点行号)}。行号升序，可直接用于面板的各列。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.diff(offsets)
+    starts = np.repeat(offsets[:-1], lengths)
+    ends = np.repeat(offsets[1:] - 1, lengths)
+    highs = _extrema_rows(values, starts, ends, orders, np.greater)
+    lows = _extrema_rows(values, starts, ends, orders, np.less)
+    return {order: (highs[order], lows[order]) for order in highs}
+
+
+def local_extrema(values, order):
+    """单只股票的阶段高点、低点位置，结果与 argrelextrema(values, np.greater/np.less, order) 一致"""
+    values = np.asarray(values, dtype=np.float64)
+    return pivot_rows(values, np.array([0, len(values)]), (order,))[order]
+
+
+def find_pivots(panel, orders=PIVOT_ORDERS, field='close_price', confirmed_only=True, exact_from=None):
+    """在整个面板上批量检测阶段高低点，返回明细DataFrame
+
+    以 field（默认收盘价）判断极值，高点价格取最高价、低点取最低价（与K线图标注一致）。
+    confirmed_only=True 时只保留右侧已走完 order 根K线的点，confirm_date 即确认当天。
+    exact_from 为每只股票的行号下限数组：面板只截取了近期数据时，左侧窗口被截断的点不可靠，予以剔除。
+    """
+    values = panel.values(field)
+    stock_ids = panel.stock_ids()
+    last_rows = panel.offsets[1:] - 1
+    frames = []
+    for order, (high_rows, low_rows) in pivot_rows(values, panel.offsets, orders).items():
+        for pivot_type, rows, price_field in (('high', high_rows, 'high_price'), ('low', low_rows, 'low_price')):
+            ids = stock_ids[rows]
+            if confirmed_only:
+                keep = rows + order <= last_rows[ids]
+                rows, ids = rows[keep], ids[keep]
+            if exact_from is not None:
+                keep = rows - order >= exact_from[ids]
+                rows, ids = rows[keep], ids[keep]
+            confirm_rows = np.minimum(rows + order, last_rows[ids])
+            frames.append(pd.DataFrame({
+                'stock_code': panel.codes[ids],
+                'stock_name': panel.names[ids],
+                'window_size': order,
+                'pivot_type': pivot_type,
+                'trade_date': panel.day[rows].astype('datetime64[D]'),
+                'price': panel.values(price_field)[rows] if price_field in panel else values[rows],
+                'close_price': values[rows],
+                'confirm_date': panel.day[confirm_rows].astype('datetime64[D]'),
+                'confirmed': rows + order <= last_rows[ids]
+            }))
+    if not frames:
+        return pd.DataFrame(columns=PIVOT_COLUMNS + ['confirmed'])
+    return pd.concat(frames, ignore_index=True).sort_values(
+        ['stock_code', 'window_size', 'trade_date']).reset_index(drop=True)
+
+
+def create_pivot_table():
+    """创建阶段高低点表，按确认日期建索引以便筛选“刚确认”的点"""
+    create_table_sql = """
+            CREATE TABLE IF NOT EXISTS stock_pivot (
+                stock_code VARCHAR(20) NOT NULL COMMENT '股票代码',
+                stock_name VARCHAR(50) NULL COMMENT '股票名称',
+                window_size SMALLINT NOT NULL COMMENT '极值窗口(左右各order根K线)',
+                pivot_type VARCHAR(4) NOT NULL COMMENT 'high=阶段高点, low=阶段低点',
+                trade_date DATE NOT NULL COMMENT '极值点交易日期',
+                price DOUBLE NULL COMMENT '高点取最高价, 低点取最低价',
+                close_price DOUBLE NULL COMMENT '极值点收盘价',
+                confirm_date DATE NOT NULL COMMENT '确认日期(极值点之后第order根K线)',
+                PRIMARY KEY (stock_code, window_size, pivot_type, trade_date),
+                INDEX idx_confirm (confirm_date, window_size, pivot_type)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='阶段高低点表'
+            """
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _save_pivots(pivots, batch_size=10000):
+    """写入已确认的高低点（主键冲突时覆盖）"""
+    if len(pivots) == 0:
+        return
+    sql = "INSERT INTO stock_pivot ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+        ', '.join(PIVOT_COLUMNS), ', '.join(['%s'] * len(PIVOT_COLUMNS)),
+        ', '.join('{0} = VALUES({0})'.format(col) for col in PIVOT_COLUMNS[1:]))
+    frame = pivots[PIVOT_COLUMNS].copy()
+    frame['window_size'] = frame['window_size'].astype(int)
+    frame['trade_date'] = frame['trade_date'].astype(str)
+    frame['confirm_date'] = frame['confirm_date'].astype(str)
+    rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            for begin in range(0, len(rows), batch_size):
+                cursor.executemany(sql, rows[begin:begin + batch_size])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def rebuild_pivots(orders=PIVOT_ORDERS):
+    """从stock_data全量重建阶段高低点表（全市场、全部窗口一次完成）"""
+    create_pivot_table()
+    panel = load_price_panel(fields=('high_price', 'low_price', 'close_price'))
+    if panel.n_rows == 0:
+        print("数据库中没有数据，无需重建高低点表")
+        return 0
+    pivots = find_pivots(panel, orders)
+    _save_pivots(pivots)
+    print(f"高低点表重建完成，共 {panel.n_stocks} 只股票，{len(pivots)} 个已确认的高低点")
+    return len(pivots)
+
+
+def update_pivots(df, engine=None, orders=PIVOT_ORDERS):
+    """新K线导入后在线确认高低点
+
+    只读取相关股票最近 2*max(orders) 个交易日（加上本次导入的天数）的K线：
+    极值点在之后第 order 根K线到来时确认，判断所需的数据都在这段区间内。
+    左侧窗口被截断（如长期停牌）的点不写入，留待 rebuild_pivots 补齐。
+    """
+    if df is None or len(df) == 0:
+        return 0
+    engine = engine if engine is not None else get_engine()
+    create_pivot_table()
+
+    count = pd.read_sql("SELECT COUNT(*) AS total FROM stock_pivot", engine)['total'].iloc[0]
+    if count == 0:
+        return rebuild_pivots(orders)
+
+    codes = sorted(df['stock_code'].astype(str).unique().tolist())
+    new_days = pd.to_datetime(df['trade_date']).nunique()
+    calendar = pd.read_sql("SELECT DISTINCT trade_date FROM stock_data ORDER BY trade_date DESC LIMIT %s",
+                           engine, params=(int(2 * max(orders) + new_days),))
+    if calendar.empty:
+        return 0
+    start_date = pd.to_datetime(calendar['trade_date']).min().date()
+
+    panel = load_price_panel(fields=('high_price', 'low_price', 'close_price'), start_date=start_date,
+                             stock_codes=codes)
+    if panel.n_rows == 0:
+        return 0
+    # 上市日期不早于区间起点的股票，区间内即是完整历史，左侧按 clip 规则处理也是准确的
+    first_dates = pd.read_sql(
+        "SELECT stock_code, MIN(trade_date) AS first_date FROM stock_data WHERE stock_code IN ({}) GROUP BY stock_code"
+        .format(', '.join(['%s'] * panel.n_stocks)), engine, params=tuple(panel.codes))
+    first_dates = dict(zip(first_dates['stock_code'], pd.to_datetime(first_dates['first_date']).dt.date))
+    exact_from = panel.offsets[:-1].copy()
+    for i, code in enumerate(panel.codes):
+        if first_dates.get(code, start_date) >= start_date:
+            exact_from[i] = -max(orders)
+
+    pivots = find_pivots(panel, orders, exact_from=exact_from)
+    _save_pivots(pivots)
+    print(f"已确认 {len(pivots)} 个阶段高低点（{panel.n_stocks} 只股票）")
+    return len(pivots)
+
+
+def get_confirmed_pivots(pivot_type='low', window_size=30, days=1, as_of=None, engine=None):
+    """查询截至 as_of（默认最新确认日）最近 days 个交易日内刚确认的阶段高点/低点
+
+    如 get_confirmed_pivots('low', 30) 即“今天刚确认30日阶段低点”的股票，附带确认后的涨幅。
+    """
+    if pivot_type not in ('high', 'low'):
+        raise ValueError("pivot_type 只能为 'high' 或 'low': {}".format(pivot_type))
+    engine = engine if engine is not None else get_engine()
+    if as_of is None:
+        latest = pd.read_sql("SELECT MAX(confirm_date) AS latest FROM stock_pivot", engine)['latest'].iloc[0]
+        if latest is None or pd.isna(latest):
+            return pd.DataFrame(columns=PIVOT_COLUMNS)
+        as_of = latest
+    calendar = pd.read_sql("SELECT DISTINCT trade_date FROM stock_data WHERE trade_date <= %s "
+                           "ORDER BY trade_date DESC LIMIT %s", engine, params=(str(as_of), int(days)))
+    start_date = pd.to_datetime(calendar['trade_date']).min().date() if not calendar.empty else as_of
+
+    query = """
+    SELECT p.stock_code, p.stock_name, p.window_size, p.pivot_type, p.trade_date, p.price, p.confirm_date,
+           s.close_price AS confirm_close, (s.close_price / p.close_price - 1) * 100 AS change_since_pivot
+    FROM stock_pivot p
+    LEFT JOIN stock_data s ON s.stock_code = p.stock_code AND s.trade_date = p.confirm_date
+    WHERE p.pivot_type = %s AND p.window_size = %s AND p.confirm_date BETWEEN %s AND %s
+    ORDER BY p.confirm_date DESC, p.stock_code
+    """
+    return pd.read_sql(query, engine, params=(pivot_type, int(window_size), str(start_date), str(as_of)))
+
+
+if __name__ == '__main__':
+    rebuild_pivots()
+    print(get_confirmed_pivots('low', 30).to_string(index=False))
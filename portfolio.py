@@ -0,0 +1,269 @@
+import numpy as np
+import pandas as pd
+import time
+import warnings
+from stock_store import load_price_panel
+from screener import IndicatorCache, compile_conditions, SCREENS
+from metrics import annual_return, sharpe_ratio, max_drawdown, average_turnover
+from backtest import COMMISSION_RATE, MIN_COMMISSION, STAMP_DUTY, blocking_flags, screen_signals, _as_rows
+
+warnings.filterwarnings('ignore')
+
+INITIAL_CASH = 1000000.0
+MAX_POSITIONS = 10
+LOT_SIZE = 100
+
+# 排名键：与 screener.run_screen 的 rank_by 同名的指标
+RANK_KEYS = {
+    'up_streak': lambda cache: cache.up_streak(),
+    'volume_ratio': lambda cache: cache.volume_ratio(),
+    'change_percent': lambda cache: cache.field('change_percent')
+}
+
+TRADE_COLUMNS = ['stock_code', 'stock_name', 'signal_date', 'entry_date', 'entry_price', 'shares', 'exit_date',
+                 'exit_price', 'exit_reason', 'bars_held', 'gross_return', 'net_return', 'pnl']
+
+
+def screen_hit_lists(panel, conditions, rank_by=('up_streak', 'volume_ratio')):
+    """把筛选方案在整个面板上逐日求值，返回 (每根K线收盘是否命中, 排名键列表)，供 run_portfolio 使用"""
+    if isinstance(conditions, str):
+        conditions = SCREENS[conditions]
+    compile_conditions(conditions)
+    unknown = [key for key in rank_by if key not in RANK_KEYS]
+    if unknown:
+        raise ValueError("未知的排名键: {}".format(unknown))
+    cache = IndicatorCache(panel)
+    signals = screen_signals(panel, conditions)
+    return signals, [RANK_KEYS[key](cache) for key in rank_by]
+
+
+def ranked_candidates(panel, signals, rank_keys=None):
+    """全部信号行按 (交易日, 排名键降序, 股票代码) 排好序，返回 (行号, 每个交易日在行号数组中的起止位置)"""
+    rows = np.nonzero(signals)[0]
+    date_index = panel.date_index()[rows]
+    keys = [rows]  # 股票按代码排序存放，行号越小代码越小，作为最后的排序键
+    for values in reversed(list(rank_keys or [])):
+        keys.append(-np.nan_to_num(np.asarray(values, dtype=np.float64)[rows], nan=-np.inf))
+    keys.append(date_index)
+    rows = rows[np.lexsort(keys)]
+    bounds = np.searchsorted(panel.date_index()[rows], np.arange(len(panel.calendar()) + 1))
+    return rows, bounds
+
+
+def run_portfolio(panel, entry_signals, rank_keys=None, exit_signals=None, max_positions=MAX_POSITIONS, weight=None,
+                  holding_days=5, stop_loss=None, initial_cash=INITIAL_CASH, slippage=0.0, commission=COMMISSION_RATE,
+                  min_commission=MIN_COMMISSION, stamp_duty=STAMP_DUTY, lot_size=LOT_SIZE):
+    """资金约束下的组合回测，返回 (交易明细, 日度账户)
+
+    每天收盘的命中列表按 rank_keys 降序排列（同分按股票代码），次一交易日开盘依次买入，直到持仓数达到
+    max_positions 或现金不足；每只股票的目标金额为前一日收盘总资产的 weight（默认 1/max_positions），
+    按 lot_size 整手向下取整，佣金按实际成交金额计算（不低于最低佣金），印花税仅卖出收取。
+    卖出规则与 backtest.run_backtest 相同：持有 holding_days 根K线或收盘出现 exit_signals 后次日开盘卖出，
+    盘中触及止损价成交，T+1，停牌和一字跌停顺延，数据结束（退市）按最后收盘价了结。
+    持仓保存在长度为 max_positions 的槽位数组中，每个交易日只对槽位数组和当日候选做运算。
+    """
+    begin = time.perf_counter()
+    entry_signals = _as_rows(panel, entry_signals)
+    exit_signals = _as_rows(panel, exit_signals) if exit_signals is not None else np.zeros(panel.n_rows, dtype=bool)
+    weight = 1.0 / max_positions if weight is None else weight
+    limit = holding_days if holding_days is not None else np.iinfo(np.int64).max
+    open_price = panel.values('open_price')
+    low = panel.values('low_price')
+    close = panel.values('close_price')
+    buy_blocked, sell_blocked = blocking_flags(panel)
+    stock_ids = panel.stock_ids()
+    calendar = panel.calendar()
+    n_days = len(calendar)
+
+    # row_matrix[s, d] 为第 s 只股票第 d 个交易日的行号（停牌为-1），last_rows 为截至当日最近的行号，用于盯市
+    row_matrix = np.full((panel.n_stocks, n_days), -1, dtype=np.int32 if panel.n_rows < 2 ** 31 else np.int64)
+    row_matrix[stock_ids, panel.date_index()] = np.arange(panel.n_rows)
+    last_rows = np.maximum.accumulate(row_matrix, axis=1)
+    last_day = panel.date_index()[np.maximum(panel.offsets[1:] - 1, 0)]
+    candidate_rows, bounds = ranked_candidates(panel, entry_signals, rank_keys)
+
+    # 持仓槽位
+    slot_stock = np.full(max_positions, -1, dtype=np.int64)
+    slot_shares = np.zeros(max_positions, dtype=np.int64)
+    slot_signal_row = np.zeros(max_positions, dtype=np.int64)
+    slot_entry_day = np.zeros(max_positions, dtype=np.int64)
+    slot_entry_price = np.zeros(max_positions)
+    slot_cost = np.zeros(max_positions)
+    slot_bars = np.zeros(max_positions, dtype=np.int64)
+    slot_pending = np.zeros(max_positions, dtype=bool)
+    slot_reason = np.full(max_positions, '', dtype=object)
+    slot_stop = np.full(max_positions, -np.inf)
+    held = np.zeros(panel.n_stocks, dtype=bool)
+
+    cash = float(initial_cash)
+    equity = float(initial_cash)
+    trades = []
+    daily = np.zeros((n_days, 7))
+
+    def close_slots(slots, days, prices, reasons):
+        """按给定价格卖出若干槽位（价格已计滑点），记录交易并释放槽位；当天卖出的股票当天不再买回"""
+        nonlocal cash
+        proceeds = slot_shares[slots] * prices
+        fees = np.maximum(proceeds * commission, min_commission) + proceeds * stamp_duty
+        cash += float((proceeds - fees).sum())
+        days = np.broadcast_to(days, len(slots))
+        for k, slot in enumerate(slots):
+            trades.append((slot_stock[slot], slot_signal_row[slot], slot_entry_day[slot], slot_entry_price[slot],
+                           slot_shares[slot], days[k], prices[k], reasons[k], slot_bars[slot], slot_cost[slot],
+                           proceeds[k] - fees[k]))
+        released.extend(slot_stock[slots])
+        slot_stock[slots] = -1
+        return float(proceeds.sum())
+
+    for d in range(n_days):
+        prev_equity = equity
+        sell_value = 0.0
+        buy_value = 0.0
+        released = []
+
+        # 开盘卖出：前一日收盘已决定卖出的持仓；盘中止损
+        active = np.nonzero(slot_stock >= 0)[0]
+        if len(active):
+            stocks = slot_stock[active]
+            ended = last_day[stocks] < d
+            if ended.any():
+                # 数据结束（退市或停牌至今）仍未卖出，按最后收盘价了结
+                done = active[ended]
+                sell_value += close_slots(done, last_day[slot_stock[done]], close[last_rows[slot_stock[done], d]],
+                                          ['end'] * len(done))
+                active = active[~ended]
+                stocks = slot_stock[active]
+            rows = row_matrix[stocks, d]
+            tradable = (rows >= 0) & (slot_entry_day[active] < d)
+            tradable[tradable] &= ~sell_blocked[rows[tradable]]
+            sell_open = tradable & slot_pending[active]
+            hit_stop = tradable & ~sell_open & (low[rows] <= slot_stop[active])
+            if sell_open.any():
+                done = active[sell_open]
+                sell_value += close_slots(done, d, open_price[rows[sell_open]] * (1 - slippage),
+                                          list(slot_reason[done]))
+            if hit_stop.any():
+                done = active[hit_stop]
+                prices = np.minimum(open_price[rows[hit_stop]], slot_stop[done]) * (1 - slippage)
+                sell_value += close_slots(done, d, prices, ['stop'] * len(done))
+
+        # 开盘买入：前一交易日收盘的命中列表按排名依次买入
+        free = np.nonzero(slot_stock < 0)[0]
+        if d > 0 and len(free):
+            target = prev_equity * weight
+            k = 0
+            for signal_row in candidate_rows[bounds[d - 1]:bounds[d]]:
+                if k >= len(free) or cash < min_commission:
+                    break
+                stock = stock_ids[signal_row]
+                row = row_matrix[stock, d]
+                if held[stock] or row < 0 or buy_blocked[row]:
+                    continue
+                price = open_price[row] * (1 + slippage)
+                shares = int(min(target, cash) / (price * (1 + commission)) // lot_size) * lot_size
+                amount = shares * price
+                fee = max(amount * commission, min_commission)
+                while shares > 0 and amount + fee > cash:
+                    shares -= lot_size
+                    amount = shares * price
+                    fee = max(amount * commission, min_commission)
+                if shares <= 0:
+                    continue
+                slot = free[k]
+                k += 1
+                cash -= amount + fee
+                buy_value += amount
+                held[stock] = True
+                slot_stock[slot] = stock
+                slot_shares[slot] = shares
+                slot_signal_row[slot] = signal_row
+                slot_entry_day[slot] = d
+                slot_entry_price[slot] = price
+                slot_cost[slot] = amount + fee
+                slot_bars[slot] = 0
+                slot_pending[slot] = False
+                slot_reason[slot] = ''
+                slot_stop[slot] = price * (1 - stop_loss) if stop_loss is not None else -np.inf
+
+        held[released] = False
+
+        # 收盘：持有K线数、卖出决定和盯市
+        active = np.nonzero(slot_stock >= 0)[0]
+        market_value = 0.0
+        if len(active):
+            stocks = slot_stock[active]
+            rows = row_matrix[stocks, d]
+            traded = rows >= 0
+            slot_bars[active[traded]] += 1
+            due = active[traded & (slot_bars[active] >= limit) & ~slot_pending[active]]
+            slot_reason[due] = 'holding'
+            slot_pending[due] = True
+            signalled = active[traded][exit_signals[rows[traded]] & ~slot_pending[active[traded]]]
+            slot_reason[signalled] = 'signal'
+            slot_pending[signalled] = True
+            market_value = float((slot_shares[active] * close[last_rows[stocks, d]]).sum())
+        equity = cash + market_value
+        daily[d] = (cash, market_value, equity, len(active), buy_value, sell_value,
+                    (buy_value + sell_value) / 2 / prev_equity if prev_equity > 0 else 0.0)
+
+    # 回测结束时仍持有的按最后收盘价计（不计卖出成本）
+    for slot in np.nonzero(slot_stock >= 0)[0]:
+        stock = slot_stock[slot]
+        value = slot_shares[slot] * close[last_rows[stock, n_days - 1]]
+        trades.append((stock, slot_signal_row[slot], slot_entry_day[slot], slot_entry_price[slot], slot_shares[slot],
+                       n_days - 1, close[last_rows[stock, n_days - 1]], 'open', slot_bars[slot], slot_cost[slot], value))
+
+    trades = pd.DataFrame(trades, columns=['stock', 'signal_row', 'entry_day', 'entry_price', 'shares', 'exit_day',
+                                           'exit_price', 'exit_reason', 'bars_held', 'cost', 'proceeds'])
+    dates = calendar.astype('datetime64[D]')
+    result = pd.DataFrame({
+        'stock_code': panel.codes[trades['stock'].values.astype(np.int64)],
+        'stock_name': panel.names[trades['stock'].values.astype(np.int64)],
+        'signal_date': panel.day[trades['signal_row'].values.astype(np.int64)].astype('datetime64[D]'),
+        'entry_date': dates[trades['entry_day'].values.astype(np.int64)],
+        'entry_price': trades['entry_price'].values,
+        'shares': trades['shares'].values,
+        'exit_date': dates[trades['exit_day'].values.astype(np.int64)],
+        'exit_price': trades['exit_price'].values,
+        'exit_reason': trades['exit_reason'].values,
+        'bars_held': trades['bars_held'].values,
+        'gross_return': (trades['exit_price'] / trades['entry_price'] - 1).values * 100,
+        'net_return': (trades['proceeds'] / trades['cost'] - 1).values * 100,
+        'pnl': (trades['proceeds'] - trades['cost']).values
+    }, columns=TRADE_COLUMNS).sort_values(['entry_date', 'stock_code']).reset_index(drop=True)
+
+    account = pd.DataFrame(daily, columns=['cash', 'market_value', 'equity', 'positions', 'buy_value', 'sell_value',
+                                           'turnover'])
+    account.insert(0, 'trade_date', dates)
+    account['positions'] = account['positions'].astype(np.int64)
+    account['daily_return'] = account['equity'].pct_change().fillna(account['equity'].iloc[0] / initial_cash - 1)
+    print(f"组合回测完成：{n_days} 个交易日，{len(result)} 笔交易，最终资产 {equity:,.2f}，"
+          f"耗时 {time.perf_counter() - begin:.2f} 秒")
+    return result, account
+
+
+def portfolio_summary(trades, account):
+    """组合层面的汇总：收益、回撤、平均持仓数、资金利用率和换手率"""
+    if len(account) == 0:
+        return {}
+    daily_return = account['daily_return'].values
+    closed = trades[trades['exit_reason'] != 'open']
+    return {
+        '总收益(%)': (np.prod(1 + daily_return) - 1) * 100,
+        '年化收益(%)': annual_return(daily_return) * 100,
+        '夏普比率': sharpe_ratio(daily_return),
+        '最大回撤(%)': max_drawdown(daily_return) * 100,
+        '交易笔数': len(closed),
+        '胜率(%)': (closed['net_return'] > 0).mean() * 100 if len(closed) else np.nan,
+        '平均持仓数': account['positions'].mean(),
+        '资金利用率(%)': (account['market_value'] / account['equity']).mean() * 100,
+        '日均换手率(%)': average_turnover(account['turnover'].values) * 100,
+        '卖出原因': closed['exit_reason'].value_counts().to_dict()
+    }
+
+
+if __name__ == '__main__':
+    panel = load_price_panel()
+    signals, rank_keys = screen_hit_lists(panel, [{'type': 'streak', 'min_days': 7}])
+    trades, account = run_portfolio(panel, signals, rank_keys, max_positions=10, holding_days=5, stop_loss=0.08)
+    print(portfolio_summary(trades, account))
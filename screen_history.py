@@ -0,0 +1,293 @@
+import numpy as np
+import pandas as pd
+import hashlib
+import json
+import os
+import time
+import warnings
+from stock_store import get_connection, get_engine, load_price_panel
+from screener import SCREENS, CONDITIONS, compile_conditions, run_screen
+
+warnings.filterwarnings('ignore')
+
+# 命中明细中单独成列的字段，其余字段序列化后存入 payload
+HISTORY_COLUMNS = ['screen_name', 'params_hash', 'as_of_date', 'stock_code', 'stock_name', 'hit_rank', 'payload']
+# 条件参数中表示回看K线数的字段，数据指纹覆盖 回看天数 + 最长窗口 + SPAN_MARGIN 个交易日
+WINDOW_PARAMS = ('window', 'windows', 'min_days')
+SPAN_MARGIN = 5
+
+RUN_COLUMNS = ['screen_name', 'params_hash', 'as_of_date', 'params', 'data_fingerprint', 'hit_count', 'run_seconds']
+
+
+def params_hash(params):
+    """参数的稳定哈希（键排序后的JSON取SHA1前16位），参数相同则哈希相同"""
+    text = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def screen_params(screen_name, conditions=None, lookback=1):
+    """一次筛选的参数（条件声明和回看天数），作为结果的缓存键"""
+    conditions = SCREENS[screen_name] if conditions is None else conditions
+    return {'conditions': conditions, 'lookback': lookback}
+
+
+def create_history_tables():
+    """创建筛选运行记录表和命中明细表"""
+    create_run_sql = """
+            CREATE TABLE IF NOT EXISTS stock_screen_run (
+                screen_name VARCHAR(64) NOT NULL COMMENT '筛选方案名称',
+                params_hash CHAR(16) NOT NULL COMMENT '参数哈希',
+                as_of_date DATE NOT NULL COMMENT '截至交易日',
+                params TEXT NULL COMMENT '参数(JSON)',
+                data_fingerprint VARCHAR(64) NOT NULL COMMENT '运行时的数据指纹',
+                hit_count INT NOT NULL COMMENT '命中股票数',
+                run_seconds DOUBLE NULL COMMENT '计算耗时(秒)',
+                PRIMARY KEY (screen_name, params_hash, as_of_date)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='筛选运行记录表'
+            """
+    create_history_sql = """
+            CREATE TABLE IF NOT EXISTS stock_screen_history (
+                screen_name VARCHAR(64) NOT NULL COMMENT '筛选方案名称',
+                params_hash CHAR(16) NOT NULL COMMENT '参数哈希',
+                as_of_date DATE NOT NULL COMMENT '截至交易日',
+                stock_code VARCHAR(20) NOT NULL COMMENT '股票代码',
+                stock_name VARCHAR(50) NULL COMMENT '股票名称',
+                hit_rank INT NULL COMMENT '排名',
+                payload TEXT NULL COMMENT '命中明细(JSON)',
+                PRIMARY KEY (screen_name, params_hash, as_of_date, stock_code),
+                INDEX idx_stock_date (stock_code, as_of_date)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='筛选命中历史表'
+            """
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_run_sql)
+            cursor.execute(create_history_sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def resolve_as_of(as_of=None, engine=None):
+    """把 as_of 落到数据库中不晚于它的最近一个交易日（默认最新交易日），没有数据时返回None"""
+    engine = engine if engine is not None else get_engine()
+    if as_of is None:
+        latest = pd.read_sql("SELECT MAX(trade_date) AS latest FROM stock_data", engine)['latest'].iloc[0]
+    else:
+        latest = pd.read_sql("SELECT MAX(trade_date) AS latest FROM stock_data WHERE trade_date <= %s",
+                             engine, params=(str(pd.Timestamp(as_of).date()),))['latest'].iloc[0]
+    return None if latest is None or pd.isna(latest) else pd.Timestamp(latest).date()
+
+
+def condition_span(conditions, lookback=1):
+    """条件计算时读取的交易日数：回看天数加上条件中最长的窗口（均线、连涨天数等），再留 SPAN_MARGIN 天余量"""
+    windows = [1]
+    for condition in conditions:
+        for name in WINDOW_PARAMS:
+            value = condition.get(name)
+            if value is not None:
+                windows.extend(np.atleast_1d(value).astype(int).tolist())
+    return lookback + max(windows) + SPAN_MARGIN
+
+
+def holder_file_mtimes(data_dir="下载数据"):
+    """股东人数文件的修改时间（文件不存在时为None），股东人数条件的结果随文件更新而失效"""
+    paths = [os.path.join(data_dir, name) for name in ('股东人数公告.xlsx', '股东人数统计.xlsx')]
+    return [os.path.getmtime(path) if os.path.exists(path) else None for path in paths]
+
+
+def data_fingerprint(as_of, engine=None, extra=None, span=1):
+    """截至 as_of 的数据指纹：K线条数、最新交易日，以及最近 span 个交易日全部K线的校验和
+
+    校验和对每根K线的代码、日期、名称和OHLCV取CRC32后求和，新导入数据、修正窗口内任一根历史K线或改名戴帽
+    都会改变指纹；extra 可加入其它输入（如股东人数文件的修改时间）。
+    """
+    engine = engine if engine is not None else get_engine()
+    summary = pd.read_sql("SELECT COUNT(*) AS total, MAX(trade_date) AS latest FROM stock_data WHERE trade_date <= %s",
+                          engine, params=(str(as_of),)).iloc[0]
+    start = pd.read_sql("SELECT MIN(trade_date) AS start FROM (SELECT DISTINCT trade_date FROM stock_data "
+                        "WHERE trade_date <= %s ORDER BY trade_date DESC LIMIT %s) t",
+                        engine, params=(str(as_of), int(span))).iloc[0]['start']
+    checksum = pd.read_sql("SELECT COUNT(*) AS rows_in_window, SUM(CRC32(CONCAT_WS(',', stock_code, trade_date, "
+                           "stock_name, open_price, high_price, low_price, close_price, volume))) AS crc_sum "
+                           "FROM stock_data WHERE trade_date BETWEEN %s AND %s",
+                           engine, params=(str(start), str(as_of))).iloc[0]
+    parts = [summary['total'], summary['latest'], span, checksum['rows_in_window'], checksum['crc_sum'], extra]
+    return params_hash([str(part) for part in parts])
+
+
+def _json_default(value):
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (np.floating,)):
+        return None if np.isnan(value) else float(value)
+    if value is pd.NaT:
+        return None
+    return str(value)
+
+
+def save_screen_result(screen_name, params, as_of, hits, fingerprint, run_seconds=None):
+    """保存一次筛选结果（覆盖同一 方案+参数+交易日 的旧结果），hits 至少包含 stock_code 列"""
+    create_history_tables()
+    key = params_hash(params)
+    as_of = str(as_of)
+    hits = hits.reset_index(drop=True)
+    detail_columns = [col for col in hits.columns if col not in ('stock_code', 'stock_name', 'rank')]
+    rows = []
+    for i, record in enumerate(hits.to_dict('records')):
+        payload = json.dumps({col: record[col] for col in detail_columns}, ensure_ascii=False, default=_json_default)
+        rows.append([screen_name, key, as_of, record['stock_code'], record.get('stock_name'),
+                     int(record.get('rank', i + 1)), payload])
+
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM stock_screen_history WHERE screen_name = %s AND params_hash = %s AND as_of_date = %s",
+                           (screen_name, key, as_of))
+            if rows:
+                cursor.executemany("INSERT INTO stock_screen_history ({}) VALUES ({})".format(
+                    ', '.join(HISTORY_COLUMNS), ', '.join(['%s'] * len(HISTORY_COLUMNS))), rows)
+            cursor.execute(
+                "INSERT INTO stock_screen_run ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+                    ', '.join(RUN_COLUMNS), ', '.join(['%s'] * len(RUN_COLUMNS)),
+                    ', '.join('{0} = VALUES({0})'.format(col) for col in RUN_COLUMNS[3:])),
+                (screen_name, key, as_of, json.dumps(params, ensure_ascii=False, default=str), fingerprint,
+                 len(rows), run_seconds))
+        connection.commit()
+    finally:
+        connection.close()
+    return key
+
+
+def load_screen_result(screen_name, params, as_of, engine=None):
+    """读取已保存的筛选结果（payload 展开为列），没有记录时返回None"""
+    engine = engine if engine is not None else get_engine()
+    create_history_tables()
+    key = params_hash(params)
+    run = pd.read_sql("SELECT * FROM stock_screen_run WHERE screen_name = %s AND params_hash = %s AND as_of_date = %s",
+                      engine, params=(screen_name, key, str(as_of)))
+    if run.empty:
+        return None
+    rows = pd.read_sql("SELECT stock_code, stock_name, hit_rank, payload FROM stock_screen_history "
+                       "WHERE screen_name = %s AND params_hash = %s AND as_of_date = %s ORDER BY hit_rank",
+                       engine, params=(screen_name, key, str(as_of)))
+    details = pd.DataFrame([json.loads(payload) if payload else {} for payload in rows['payload']], index=rows.index)
+    result = pd.concat([rows[['hit_rank', 'stock_code', 'stock_name']].rename(columns={'hit_rank': 'rank'}), details], axis=1)
+    result.attrs['data_fingerprint'] = run['data_fingerprint'].iloc[0]
+    return result
+
+
+def run_screen_cached(screen_name, conditions=None, as_of=None, lookback=1, force=False, workers=None,
+                      data_dir="下载数据"):
+    """运行筛选并保存结果；同一 方案+参数+交易日 且数据指纹未变时直接返回保存的结果
+
+    conditions 默认取 SCREENS[screen_name]。as_of 会先落到最近的交易日，
+    重新计算时只加载截至该日的K线，因此对历史日期补跑与当日跑的结果一致。
+    返回 (命中列表DataFrame, 截至交易日)。
+    """
+    params = screen_params(screen_name, conditions, lookback)
+    conditions = params['conditions']
+    compile_conditions(conditions)
+    engine = get_engine()
+    as_of = resolve_as_of(as_of, engine)
+    if as_of is None:
+        print("数据库中没有数据")
+        return pd.DataFrame(), None
+
+    # 指纹覆盖条件读取的全部K线；用到股东人数的条件还要加入股东人数文件的修改时间
+    needs_holder = any(CONDITIONS[condition['type']][1] for condition in conditions)
+    fingerprint = data_fingerprint(as_of, engine, extra=holder_file_mtimes(data_dir) if needs_holder else None,
+                                   span=condition_span(conditions, lookback))
+    if not force:
+        stored = load_screen_result(screen_name, params, as_of, engine)
+        if stored is not None and stored.attrs['data_fingerprint'] == fingerprint:
+            print(f"筛选 {screen_name} 截至 {as_of} 的结果已保存，直接读取（{len(stored)} 只股票）")
+            return stored, as_of
+
+    begin = time.perf_counter()
+    panel = load_price_panel(end_date=as_of)
+    hits, _ = run_screen(conditions, panel=panel, as_of=as_of, lookback=lookback, workers=workers, data_dir=data_dir)
+    seconds = time.perf_counter() - begin
+    save_screen_result(screen_name, params, as_of, hits, fingerprint, seconds)
+    return hits, as_of
+
+
+def screen_dates(screen_name, params, engine=None):
+    """某个方案+参数已保存的全部交易日（升序）"""
+    engine = engine if engine is not None else get_engine()
+    create_history_tables()
+    runs = pd.read_sql("SELECT as_of_date FROM stock_screen_run WHERE screen_name = %s AND params_hash = %s "
+                       "ORDER BY as_of_date", engine, params=(screen_name, params_hash(params)))
+    return [pd.Timestamp(d).date() for d in runs['as_of_date']]
+
+
+def _codes_on(screen_name, key, as_of, engine):
+    rows = pd.read_sql("SELECT stock_code, stock_name FROM stock_screen_history "
+                       "WHERE screen_name = %s AND params_hash = %s AND as_of_date = %s",
+                       engine, params=(screen_name, key, str(as_of)))
+    return rows.set_index('stock_code')['stock_name']
+
+
+def screen_diff(screen_name, params, as_of=None, engine=None):
+    """与上一次保存的交易日相比的新进入和退出股票，返回 {'as_of', 'previous', 'entries', 'exits', 'kept'}"""
+    engine = engine if engine is not None else get_engine()
+    dates = screen_dates(screen_name, params, engine)
+    if as_of is not None:
+        as_of = pd.Timestamp(as_of).date()
+        dates = [d for d in dates if d <= as_of]
+    if not dates:
+        return None
+    key = params_hash(params)
+    current = _codes_on(screen_name, key, dates[-1], engine)
+    previous = _codes_on(screen_name, key, dates[-2], engine) if len(dates) > 1 else pd.Series(dtype=object)
+
+    def frame(codes, names):
+        return pd.DataFrame({'stock_code': sorted(codes), 'stock_name': [names[c] for c in sorted(codes)]})
+
+    return {
+        'as_of': dates[-1],
+        'previous': dates[-2] if len(dates) > 1 else None,
+        'entries': frame(set(current.index) - set(previous.index), current),
+        'exits': frame(set(previous.index) - set(current.index), previous),
+        'kept': frame(set(current.index) & set(previous.index), current)
+    }
+
+
+def persistence_streaks(screen_name, params, as_of=None, engine=None):
+    """截至 as_of 仍命中的股票，连续出现在多少次已保存的运行中，以及首次进入的日期"""
+    engine = engine if engine is not None else get_engine()
+    dates = screen_dates(screen_name, params, engine)
+    if as_of is not None:
+        as_of = pd.Timestamp(as_of).date()
+        dates = [d for d in dates if d <= as_of]
+    if not dates:
+        return pd.DataFrame(columns=['stock_code', 'stock_name', 'streak_runs', 'since'])
+    rows = pd.read_sql("SELECT stock_code, stock_name, as_of_date FROM stock_screen_history "
+                       "WHERE screen_name = %s AND params_hash = %s AND as_of_date <= %s",
+                       engine, params=(screen_name, params_hash(params), str(dates[-1])))
+    rows['as_of_date'] = pd.to_datetime(rows['as_of_date']).dt.date
+
+    # 股票×运行日期的命中矩阵，从最后一列往前数连续命中的列数
+    run_index = {d: i for i, d in enumerate(dates)}
+    codes = sorted(rows['stock_code'].unique())
+    code_index = {c: i for i, c in enumerate(codes)}
+    hits = np.zeros((len(codes), len(dates)), dtype=bool)
+    hits[rows['stock_code'].map(code_index).values, rows['as_of_date'].map(run_index).values] = True
+    misses = ~hits[:, ::-1]
+    streak = np.where(misses.any(axis=1), misses.argmax(axis=1), len(dates))
+
+    names = rows.drop_duplicates('stock_code', keep='last').set_index('stock_code')['stock_name']
+    result = pd.DataFrame({'stock_code': codes, 'stock_name': [names[c] for c in codes], 'streak_runs': streak})
+    result = result[result['streak_runs'] > 0]
+    result['since'] = [dates[len(dates) - s] for s in result['streak_runs']]
+    return result.sort_values(['streak_runs', 'stock_code'], ascending=[False, True]).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    hits, as_of = run_screen_cached('7连阳放量')
+    print(hits.head(50).to_string(index=False))
+    params = screen_params('7连阳放量')
+    diff = screen_diff('7连阳放量', params)
+    if diff is not None:
+        print(f"较 {diff['previous']} 新进入 {len(diff['entries'])} 只，退出 {len(diff['exits'])} 只")
+    print(persistence_streaks('7连阳放量', params).head(50).to_string(index=False))
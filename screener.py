@@ -0,0 +1,227 @@
+import numpy as np
+import pandas as pd
+import time
+import warnings
+from stock_store import load_price_panel
+from streak_engine import run_lengths, increasing_flags
+from indicators import rolling_mean, cross_above, cross_below
+from shard_executor import ShardExecutor
+from holder_engine import attach_holder_counts
+from tradability import SCREEN_EXCLUDE, tradability_flags, allowed
+
+warnings.filterwarnings('ignore')
+
+class IndicatorCache():
+    """面板上的中间指标缓存，多个条件引用同一指标时只计算一次"""
+
+    def __init__(self, panel):
+        self.panel = panel
+        self._values = {}
+
+    def get(self, key, compute):
+        if key not in self._values:
+            self._values[key] = compute()
+        return self._values[key]
+
+    def field(self, name):
+        return self.get(('field', name), lambda: self.panel.values(name))
+
+    def ma(self, window, name='close_price'):
+        return self.get(('ma', name, window), lambda: rolling_mean(self.field(name), window, self.panel.offsets))
+
+    def up_streak(self):
+        """截至每一行的连涨天数"""
+        return self.get('up_streak', lambda: run_lengths(self.field('change_percent') > 0, self.panel.offsets))
+
+    def volume_run(self):
+        """截至每一行、限制在当前连涨区间内的成交量严格递增天数"""
+        def compute():
+            run = run_lengths(increasing_flags(self.panel['volume'], self.panel.offsets), self.panel.offsets) + 1
+            return np.minimum(run, self.up_streak())
+        return self.get('volume_run', compute)
+
+    def volume_ratio(self, window=20):
+        """成交量与其 window 日均量之比"""
+        def compute():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return self.field('volume') / self.ma(window, 'volume')
+        return self.get(('volume_ratio', window), compute)
+
+
+def _streak(cache, min_days=7):
+    return cache.up_streak() >= min_days
+
+
+def _volume_increasing(cache):
+    streak = cache.up_streak()
+    return (cache.volume_run() >= streak) & (streak > 1)
+
+
+def _close_cross_ma(cache, window=60, direction='up'):
+    close = cache.field('close_price')
+    if direction == 'up':
+        return cross_above(close, cache.ma(window), cache.panel.offsets)
+    return cross_below(close, cache.ma(window), cache.panel.offsets)
+
+
+def _close_above_ma(cache, window=60):
+    with np.errstate(invalid='ignore'):
+        return cache.field('close_price') > cache.ma(window)
+
+
+def _ma_bullish(cache, windows=(60, 90, 120)):
+    result = np.ones(cache.panel.n_rows, dtype=bool)
+    with np.errstate(invalid='ignore'):
+        for short, long in zip(windows[:-1], windows[1:]):
+            result &= cache.ma(short) > cache.ma(long)
+    return result
+
+
+def _volume_spike(cache, multiple=3, window=20):
+    with np.errstate(invalid='ignore'):
+        return cache.volume_ratio(window) > multiple
+
+
+def _tradable(cache, exclude=SCREEN_EXCLUDE):
+    """剔除带有 exclude 中任一可交易性标志（默认停牌、ST、新股）的K线"""
+    return allowed(tradability_flags(cache.panel), exclude)
+
+
+def _holder_falling(cache):
+    if 'holder_count' not in cache.panel:
+        raise ValueError("面板中没有股东人数数据，请先调用 attach_holder_counts")
+    with np.errstate(invalid='ignore'):
+        return cache.panel['holder_count'] < cache.panel['holder_count_prev']
+
+
+# 可声明的筛选条件：类型 -> (计算函数, 是否需要股东人数数据)
+CONDITIONS = {
+    'streak': (_streak, False),
+    'volume_increasing': (_volume_increasing, False),
+    'close_cross_ma': (_close_cross_ma, False),
+    'close_above_ma': (_close_above_ma, False),
+    'ma_bullish': (_ma_bullish, False),
+    'volume_spike': (_volume_spike, False),
+    'holder_falling': (_holder_falling, True),
+    'tradable': (_tradable, False)
+}
+
+# 预置的筛选方案，对应原来手写的各个脚本
+SCREENS = {
+    '7连阳': [{'type': 'streak', 'min_days': 7}],
+    '7连阳放量': [{'type': 'streak', 'min_days': 7}, {'type': 'volume_increasing'}],
+    '上穿60日线': [{'type': 'close_cross_ma', 'window': 60}],
+    '均线多头': [{'type': 'ma_bullish', 'windows': (60, 90, 120)}],
+    '3倍放量': [{'type': 'volume_spike', 'multiple': 3, 'window': 20}],
+    '股东人数下降且站上60日线': [{'type': 'holder_falling'}, {'type': 'close_above_ma', 'window': 60}]
+}
+
+
+def condition_label(condition):
+    """条件的可读名称，如 streak(min_days=7)"""
+    params = ', '.join('{}={}'.format(k, v) for k, v in condition.items() if k != 'type')
+    return '{}({})'.format(condition['type'], params)
+
+
+def compile_conditions(conditions):
+    """将条件声明编译为 (名称, 函数, 参数) 列表，未知类型直接报错"""
+    compiled = []
+    for condition in conditions:
+        if condition.get('type') not in CONDITIONS:
+            raise ValueError("未知的筛选条件: {}".format(condition))
+        func = CONDITIONS[condition['type']][0]
+        params = {k: v for k, v in condition.items() if k != 'type'}
+        compiled.append((condition_label(condition), func, params))
+    return compiled
+
+
+def _screen_shard(panel, conditions, start_day, end_day):
+    """在一个股票分片上计算全部条件，返回 (命中明细, 每个条件耗时)"""
+    cache = IndicatorCache(panel)
+    in_window = (panel.day >= start_day) & (panel.day <= end_day)
+    hit = in_window.copy()
+    timings = {}
+    for label, func, params in compile_conditions(conditions):
+        begin = time.perf_counter()
+        hit &= func(cache, **params)
+        timings[label] = time.perf_counter() - begin
+
+    rows = np.nonzero(hit)[0]
+    if len(rows):
+        # 窗口内多次命中时只保留每只股票最近的一次
+        stock_ids = panel.stock_ids()[rows]
+        last = np.concatenate([stock_ids[1:] != stock_ids[:-1], [True]])
+        rows = rows[last]
+    stock_ids = panel.stock_ids()[rows]
+    # 连涨起始日：命中行往前 up_streak-1 根K线（不在连涨中的为空）
+    streak = cache.up_streak()[rows]
+    streak_start = panel.day[rows - np.maximum(streak, 1) + 1].astype('datetime64[D]')
+    streak_start[streak == 0] = np.datetime64('NaT')
+    hits = pd.DataFrame({
+        'stock_code': panel.codes[stock_ids],
+        'stock_name': panel.names[stock_ids],
+        'trade_date': panel.day[rows].astype('datetime64[D]'),
+        'close_price': cache.field('close_price')[rows],
+        'change_percent': cache.field('change_percent')[rows],
+        'up_streak': streak,
+        'streak_start_date': streak_start,
+        'volume_ratio': cache.volume_ratio()[rows]
+    })
+    return hits, timings
+
+
+def run_screen(conditions, panel=None, as_of=None, lookback=1, rank_by=('up_streak', 'volume_ratio'),
+               workers=None, data_dir="下载数据"):
+    """在全市场上运行声明式筛选
+
+    conditions 为条件声明列表（或 SCREENS 中的方案名），各条件取交集。
+    在截至 as_of（默认最新交易日）的最近 lookback 个交易日内满足全部条件的股票计为命中，
+    按 rank_by 降序排名。股票按分片在进程池中并行计算（面板经共享内存传递），workers=1 时在当前进程中执行。
+    返回 (命中列表DataFrame, 各条件耗时DataFrame)。
+    """
+    if isinstance(conditions, str):
+        conditions = SCREENS[conditions]
+    compile_conditions(conditions)
+
+    if panel is None:
+        panel = load_price_panel(fields=('open_price', 'high_price', 'low_price', 'close_price', 'volume', 'change_percent'))
+    if panel.n_rows == 0:
+        print("数据库中没有数据")
+        return pd.DataFrame(), pd.DataFrame()
+    if any(CONDITIONS[c['type']][1] for c in conditions) and 'holder_count' not in panel:
+        attach_holder_counts(panel, data_dir=data_dir)
+
+    calendar = panel.calendar()
+    if as_of is None:
+        end_pos = len(calendar) - 1
+    else:
+        as_of_day = (np.datetime64(pd.Timestamp(as_of).date(), 'D') - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+        end_pos = np.searchsorted(calendar, as_of_day, side='right') - 1
+        if end_pos < 0:
+            print(f"{pd.Timestamp(as_of).date()} 早于数据起始日 {calendar[0].astype('datetime64[D]')}，没有可筛选的交易日")
+            return pd.DataFrame(), pd.DataFrame()
+    start_day = calendar[max(end_pos - lookback + 1, 0)]
+    end_day = calendar[end_pos]
+
+    executor = ShardExecutor(workers=workers)
+    outputs = executor.map(_screen_shard, panel, conditions, start_day, end_day)
+
+    # 按分片顺序合并，排名时以股票代码作为最后的排序键，保证结果确定
+    hits = pd.concat([output[0] for output in outputs], ignore_index=True)
+    rank_by = list(rank_by)
+    hits = hits.sort_values(rank_by + ['stock_code'], ascending=[False] * len(rank_by) + [True]).reset_index(drop=True)
+    hits.insert(0, 'rank', np.arange(1, len(hits) + 1))
+
+    timings = pd.DataFrame([
+        {'条件': label, '耗时(秒)': sum(output[1][label] for output in outputs)}
+        for label, _, _ in compile_conditions(conditions)
+    ])
+    print(f"筛选完成：{executor.summary['shards']} 个分片，命中 {len(hits)} 只股票，"
+          f"总耗时 {executor.summary['wall_seconds']:.2f} 秒，负载不均衡度 {executor.summary['imbalance']:.2f}")
+    return hits, timings
+
+
+if __name__ == '__main__':
+    hits, timings = run_screen('7连阳放量', lookback=1)
+    print(hits.head(50).to_string(index=False))
+    print(timings.to_string(index=False))
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from stock_store import PricePanel
+
+# 子进程中映射好的面板，由进程池的 initializer 设置
+_WORKER_PANEL = None
+_WORKER_BLOCKS = []
+
+
+def _attach_block(name):
+    """在子进程中按名称映射共享内存块，生命周期由创建它的主进程负责"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python 3.13 之前没有 track 参数；子进程与主进程共用同一个资源跟踪器，重复登记不会导致提前释放
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedPanel():
+    """把PricePanel的数值数组放入共享内存
+
+    子进程启动时按名称映射一次，之后每个分片任务只传递股票区间，不再逐任务pickle K线数据。
+    使用完毕需调用 close()（或使用 with 语句）释放共享内存。
+    """
+
+    def __init__(self, panel):
+        self.blocks = []
+        self.arrays = {}
+        arrays = dict(panel.columns)
+        arrays['__offsets__'] = panel.offsets
+        arrays['__day__'] = panel.day
+        for key, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+            self.blocks.append(block)
+            self.arrays[key] = (block.name, arr.dtype.str, arr.shape)
+        self.codes = panel.codes
+        self.names = panel.names
+        self.price_scale = panel.price_scale
+
+    def spec(self):
+        """子进程重建面板所需的信息（共享内存名称、类型、形状及股票代码/名称）"""
+        return {
+            'arrays': self.arrays,
+            'codes': self.codes,
+            'names': self.names,
+            'price_scale': self.price_scale
+        }
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_panel(spec):
+    """按 SharedPanel.spec() 在当前进程中映射出一个PricePanel（数组直接指向共享内存）"""
+    blocks = []
+    arrays = {}
+    for key, (name, dtype, shape) in spec['arrays'].items():
+        block = _attach_block(name)
+        blocks.append(block)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    offsets = arrays.pop('__offsets__')
+    day = arrays.pop('__day__')
+    panel = PricePanel(spec['codes'], spec['names'], offsets, day, arrays, spec['price_scale'])
+    return panel, blocks
+
+
+def _init_worker(spec):
+    global _WORKER_PANEL, _WORKER_BLOCKS
+    _WORKER_PANEL, _WORKER_BLOCKS = attach_panel(spec)
+
+
+def _run_shard(kernel, start, stop, args, kwargs):
+    """在子进程中对第 start 至 stop-1 只股票执行 kernel，返回结果和耗时"""
+    begin = time.perf_counter()
+    result = kernel(_WORKER_PANEL.slice_stocks(start, stop), *args, **kwargs)
+    return result, time.perf_counter() - begin
+
+
+def shard_bounds(panel, n_shards):
+    """按K线行数均衡地把股票切分为连续区间，返回 [(start, stop), ...]"""
+    if panel.n_stocks == 0:
+        return []
+    targets = np.linspace(0, panel.n_rows, n_shards + 1)[1:-1]
+    cuts = np.searchsorted(panel.offsets, targets)
+    cuts = np.unique(np.clip(np.concatenate([[0], cuts, [panel.n_stocks]]), 0, panel.n_stocks))
+    return [(int(start), int(stop)) for start, stop in zip(cuts[:-1], cuts[1:]) if stop > start]
+
+
+class ShardExecutor():
+    """把全市场按股票分片，在进程池中并行执行任意逐股票计算的kernel
+
+    kernel(shard_panel, *args, **kwargs) 需为模块顶层函数，shard_panel 为连续若干只股票的
+    PricePanel 视图。面板只通过共享内存传递一次；结果按分片顺序返回，合并结果确定。
+    每次运行后 report 记录各分片的股票数、K线数、耗时，以及负载不均衡度（最慢/平均）。
+    """
+
+    def __init__(self, workers=None, shards_per_worker=4):
+        self.workers = workers or os.cpu_count() or 1
+        self.shards_per_worker = shards_per_worker
+        self.report = pd.DataFrame()
+        self.summary = {}
+
+    def map(self, kernel, panel, *args, **kwargs):
+        """对每个分片执行kernel，返回按分片顺序排列的结果列表"""
+        bounds = shard_bounds(panel, self.workers * self.shards_per_worker)
+        begin = time.perf_counter()
+        if self.workers == 1 or len(bounds) <= 1:
+            outputs = []
+            for start, stop in bounds:
+                shard_begin = time.perf_counter()
+                outputs.append((kernel(panel.slice_stocks(start, stop), *args, **kwargs),
+                                time.perf_counter() - shard_begin))
+        else:
+            with SharedPanel(panel) as shared:
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(shared.spec(),)) as executor:
+                    futures = [executor.submit(_run_shard, kernel, start, stop, args, kwargs) for start, stop in bounds]
+                    outputs = [future.result() for future in futures]
+        wall_time = time.perf_counter() - begin
+
+        self.report = pd.DataFrame({
+            'shard': np.arange(len(bounds)),
+            'stocks': [stop - start for start, stop in bounds],
+            'rows': [int(panel.offsets[stop] - panel.offsets[start]) for start, stop in bounds],
+            'seconds': [output[1] for output in outputs]
+        })
+        busy_time = float(self.report['seconds'].sum()) if len(bounds) else 0.0
+        mean_time = busy_time / len(bounds) if len(bounds) else 0.0
+        self.summary = {
+            'workers': self.workers,
+            'shards': len(bounds),
+            'wall_seconds': wall_time,
+            'busy_seconds': busy_time,
+            # 各分片耗时之和与墙钟时间之比，接近 workers 说明并行充分
+            'speedup': busy_time / wall_time if wall_time > 0 else 0.0,
+            'imbalance': float(self.report['seconds'].max()) / mean_time if mean_time > 0 else 1.0
+        }
+        return [output[0] for output in outputs]
+
+    def print_report(self):
+        print(self.report.to_string(index=False))
+        print("进程数 {workers}，分片数 {shards}，墙钟耗时 {wall_seconds:.2f} 秒，分片累计耗时 {busy_seconds:.2f} 秒，"
+              "并行加速约 {speedup:.1f} 倍，负载不均衡度 {imbalance:.2f}".format(**self.summary))
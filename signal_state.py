@@ -0,0 +1,237 @@
+import pandas as pd
+import warnings
+from stock_store import get_connection, get_engine, load_price_panel
+from streak_engine import streak_table
+
+warnings.filterwarnings('ignore')
+
+# 连涨股票列表中附带的均线，读取 indicator_store 增量维护的指标表
+MA_COLUMN = 'ma20'
+
+STATE_COLUMNS = ['stock_code', 'stock_name', 'last_trade_date', 'last_close', 'last_volume',
+                 'up_streak', 'streak_start_date', 'volume_up_run', 'bar_count']
+
+# 旧版状态表中的均线滚动和及收盘价/成交量窗口，均线改由指标表提供后删除
+LEGACY_COLUMNS = ['close_sum_5', 'close_sum_10', 'close_sum_20', 'volume_sum_20', 'close_window', 'volume_window']
+
+
+def create_signal_state_table():
+    """创建每只股票的连涨状态表，并删除旧版表中已不再维护的均线列"""
+    create_table_sql = """
+            CREATE TABLE IF NOT EXISTS stock_signal_state (
+                stock_code VARCHAR(20) NOT NULL PRIMARY KEY COMMENT '股票代码',
+                stock_name VARCHAR(50) NOT NULL COMMENT '股票名称',
+                last_trade_date DATE NOT NULL COMMENT '最后交易日期',
+                last_close DECIMAL(10, 4) NOT NULL COMMENT '最新收盘价',
+                last_volume BIGINT NOT NULL COMMENT '最新成交量',
+                up_streak INT NOT NULL DEFAULT 0 COMMENT '当前连涨天数',
+                streak_start_date DATE NULL COMMENT '当前连涨起始日期',
+                volume_up_run INT NOT NULL DEFAULT 0 COMMENT '当前连涨区间内成交量连续递增天数',
+                bar_count INT NOT NULL DEFAULT 0 COMMENT '累计K线条数',
+                INDEX idx_date_streak (last_trade_date, up_streak)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='股票连涨状态表'
+            """
+
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_sql)
+            cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                           "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'stock_signal_state'")
+            existing = {row[0] for row in cursor.fetchall()}
+            legacy = [col for col in LEGACY_COLUMNS if col in existing]
+            if legacy:
+                cursor.execute("ALTER TABLE stock_signal_state {}".format(
+                    ', '.join('DROP COLUMN {}'.format(col) for col in legacy)))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _save_states(states):
+    """将状态写入stock_signal_state（存在则覆盖）"""
+    if not states:
+        return
+    placeholders = ', '.join(['%s'] * len(STATE_COLUMNS))
+    updates = ', '.join('{0} = VALUES({0})'.format(col) for col in STATE_COLUMNS[1:])
+    sql = "INSERT INTO stock_signal_state ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+        ', '.join(STATE_COLUMNS), placeholders, updates)
+
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [[state[col] for col in STATE_COLUMNS] for state in states])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def rebuild_signal_state(stock_codes=None):
+    """从stock_data重建状态表（首次使用或历史数据被修改后调用），stock_codes 指定时只重建这些股票"""
+    create_signal_state_table()
+    panel = load_price_panel(fields=('close_price', 'volume', 'change_percent'), stock_codes=stock_codes)
+    if panel.n_rows == 0:
+        print("数据库中没有数据，无需重建状态表")
+        return 0
+
+    table = streak_table(panel['change_percent'] > 0, panel['volume'], panel.offsets)
+    closes = panel.values('close_price')
+
+    states = []
+    for i in range(panel.n_stocks):
+        start, end = int(panel.offsets[i]), int(panel.offsets[i + 1])
+        if end == start:
+            continue
+        last = end - 1
+        up_streak = int(table['current_days'][i])
+        states.append({
+            'stock_code': panel.codes[i],
+            'stock_name': panel.names[i],
+            'last_trade_date': str(panel.day[last].astype('datetime64[D]')),
+            'last_close': float(closes[last]),
+            'last_volume': int(panel['volume'][last]),
+            'up_streak': up_streak,
+            'streak_start_date': str(panel.day[last - up_streak + 1].astype('datetime64[D]')) if up_streak > 0 else None,
+            'volume_up_run': int(table['current_volume_run'][i]),
+            'bar_count': end - start
+        })
+
+    _save_states(states)
+    print(f"状态表{'重建' if stock_codes is None else '补齐'}完成，共 {len(states)} 只股票")
+    return len(states)
+
+
+def advance_state(state, stock_name, trade_date, close_price, volume, change_percent):
+    """用一根新的日K线更新单只股票的状态，state 为None时视为该股票的第一根K线"""
+    close_price = float(close_price)
+    volume = int(volume)
+    up = float(change_percent) > 0
+
+    if state is None:
+        new_state = {
+            'stock_code': None,
+            'up_streak': 1 if up else 0,
+            'streak_start_date': trade_date if up else None,
+            'volume_up_run': 1 if up else 0,
+            'bar_count': 1
+        }
+    else:
+        prev_streak = int(state['up_streak'])
+        if up:
+            up_streak = prev_streak + 1
+            streak_start_date = state['streak_start_date'] if prev_streak > 0 else trade_date
+            # 连涨区间内成交量递增天数：比前一日放量则延续，否则从当日重新计数
+            volume_up_run = int(state['volume_up_run']) + 1 if prev_streak > 0 and volume > int(state['last_volume']) else 1
+        else:
+            up_streak = 0
+            streak_start_date = None
+            volume_up_run = 0
+        new_state = {
+            'stock_code': state['stock_code'],
+            'up_streak': up_streak,
+            'streak_start_date': streak_start_date,
+            'volume_up_run': volume_up_run,
+            'bar_count': int(state['bar_count']) + 1
+        }
+
+    new_state.update({
+        'stock_name': stock_name,
+        'last_trade_date': trade_date,
+        'last_close': close_price,
+        'last_volume': volume
+    })
+    return new_state
+
+
+def update_signal_state(df, engine=None):
+    """用新导入的日K线增量更新状态表
+
+    df 至少包含 stock_code, stock_name, trade_date, close_price, volume, change_percent 列。
+    已经计入状态的交易日会被跳过；状态表为空时从stock_data全量重建。
+    状态只能逐根K线推进：stock_data 中在状态之后还有本次没有传入的K线时（由其它导入脚本写入，
+    或中间漏导了某天），这些股票从stock_data重建，避免连涨天数和前收盘价错位。
+    """
+    if df is None or len(df) == 0:
+        return 0
+    engine = engine if engine is not None else get_engine()
+    create_signal_state_table()
+
+    codes = df['stock_code'].astype(str).unique().tolist()
+    count = pd.read_sql("SELECT COUNT(*) AS total FROM stock_signal_state", engine)['total'].iloc[0]
+    if count == 0:
+        # 首次使用：stock_data 中已包含本次导入的数据，直接全量重建
+        return rebuild_signal_state()
+
+    placeholders = ', '.join(['%s'] * len(codes))
+    state_df = pd.read_sql(
+        "SELECT * FROM stock_signal_state WHERE stock_code IN ({})".format(placeholders),
+        engine, params=tuple(codes)
+    )
+    states = {row['stock_code']: row for row in state_df.to_dict('records')}
+
+    bars = df.copy()
+    bars['stock_code'] = bars['stock_code'].astype(str)
+    bars['trade_date'] = pd.to_datetime(bars['trade_date']).dt.date
+    bars = bars.sort_values(['stock_code', 'trade_date'])
+
+    # stock_data 中状态之后的K线数多于本次传入的K线数，说明中间有缺口，这些股票改为重建
+    last_dates = {code: pd.to_datetime(state['last_trade_date']).date() for code, state in states.items()}
+    after_state = bars[[code not in last_dates or date > last_dates[code]
+                        for code, date in zip(bars['stock_code'], bars['trade_date'])]]
+    expected = after_state.groupby('stock_code')['trade_date'].nunique()
+    stored = pd.read_sql(
+        "SELECT d.stock_code, COUNT(*) AS total FROM stock_data d "
+        "LEFT JOIN stock_signal_state s ON s.stock_code = d.stock_code "
+        "WHERE d.stock_code IN ({}) AND (s.last_trade_date IS NULL OR d.trade_date > s.last_trade_date) "
+        "GROUP BY d.stock_code".format(placeholders), engine, params=tuple(codes))
+    gaps = sorted(code for code, total in zip(stored['stock_code'].astype(str), stored['total'])
+                  if total > expected.get(code, 0))
+    if gaps:
+        print(f"{len(gaps)} 只股票的状态与stock_data之间有缺口，从stock_data重建: {gaps[:10]}")
+        rebuild_signal_state(gaps)
+
+    updated = {}
+    gap_codes = set(gaps)
+    for row in bars.itertuples(index=False):
+        if row.stock_code in gap_codes:
+            continue
+        state = updated.get(row.stock_code, states.get(row.stock_code))
+        if state is not None and row.trade_date <= pd.to_datetime(state['last_trade_date']).date():
+            continue
+        new_state = advance_state(state, row.stock_name, row.trade_date, row.close_price, row.volume, row.change_percent)
+        new_state['stock_code'] = row.stock_code
+        updated[row.stock_code] = new_state
+
+    _save_states(list(updated.values()))
+    print(f"已更新 {len(updated)} 只股票的连涨状态")
+    return len(updated) + len(gaps)
+
+
+def get_rising_stocks_today(min_days=7, check_volume=False, as_of=None):
+    """从状态表读取截至 as_of（默认最新交易日）仍在延续的连涨股票
+
+    只有 last_trade_date 等于该日期的股票才计入，停牌或已中断的连涨不会被返回。
+    均线取自 indicator_store 维护的指标表（需已运行 update_indicators 或 rebuild_indicators）。
+    """
+    engine = get_engine()
+    if as_of is None:
+        latest = pd.read_sql("SELECT MAX(last_trade_date) AS latest FROM stock_signal_state", engine)['latest'].iloc[0]
+        if latest is None or pd.isna(latest):
+            return pd.DataFrame(columns=STATE_COLUMNS)
+        as_of = latest
+
+    query = """
+    SELECT s.stock_code, s.stock_name, s.last_trade_date, s.last_close, s.up_streak, s.streak_start_date,
+           s.volume_up_run, i.{0}
+    FROM stock_signal_state s
+    LEFT JOIN stock_indicator i ON i.stock_code = s.stock_code AND i.trade_date = s.last_trade_date
+    WHERE s.last_trade_date = %s AND s.up_streak >= %s
+    """.format(MA_COLUMN)
+    if check_volume:
+        query += " AND s.volume_up_run >= s.up_streak"
+    query += " ORDER BY s.up_streak DESC, s.stock_code"
+    return pd.read_sql(query, engine, params=(str(as_of), int(min_days)))
+
+
+if __name__ == '__main__':
+    rebuild_signal_state()
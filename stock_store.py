@@ -0,0 +1,560 @@
+import pymysql
+import pymysql.cursors
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+import hashlib
+import time
+import tracemalloc
+import warnings
+
+warnings.filterwarnings('ignore')
+
+# 数据库连接配置 - 请根据实际情况修改
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'root',
+    'password': 'cxtx1028',  # 请修改为实际密码
+    'database': 'quant',
+    'charset': 'utf8mb4'
+}
+
+# stock_data 中可读取的K线字段及其对应的numpy类型
+BAR_COLUMNS = {
+    'trade_date': 'datetime64[D]',
+    'open_price': np.float64,
+    'close_price': np.float64,
+    'high_price': np.float64,
+    'low_price': np.float64,
+    'volume': np.int64,
+    'turnover': np.float64,
+    'amplitude': np.float64,
+    'change_percent': np.float64,
+    'change_amount': np.float64,
+    'turnover_rate': np.float64
+}
+
+
+def get_connection(streaming=False):
+    """创建数据库连接，streaming=True 时使用无缓冲的服务端游标(SSCursor)"""
+    return pymysql.connect(
+        host=DB_CONFIG['host'],
+        user=DB_CONFIG['user'],
+        password=DB_CONFIG['password'],
+        database=DB_CONFIG['database'],
+        charset=DB_CONFIG['charset'],
+        cursorclass=pymysql.cursors.SSCursor if streaming else pymysql.cursors.Cursor
+    )
+
+
+def get_engine():
+    """创建SQLAlchemy引擎，供 pd.read_sql / to_sql 使用"""
+    return create_engine(f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@{DB_CONFIG['host']}/{DB_CONFIG['database']}?charset={DB_CONFIG['charset']}")
+
+
+def _check_columns(columns):
+    """校验字段名，字段名会直接拼进SQL，只允许 BAR_COLUMNS 中的字段"""
+    unknown = [col for col in columns if col not in BAR_COLUMNS]
+    if unknown:
+        raise ValueError("未知的K线字段: {}".format(unknown))
+
+
+def _build_where(start_date=None, end_date=None, stock_codes=None):
+    """根据日期范围和股票代码生成WHERE子句及参数"""
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append("trade_date >= %s")
+        params.append(str(start_date))
+    if end_date is not None:
+        conditions.append("trade_date <= %s")
+        params.append(str(end_date))
+    if stock_codes is not None:
+        stock_codes = list(stock_codes)
+        if not stock_codes:
+            conditions.append("1 = 0")
+        else:
+            conditions.append("stock_code IN ({})".format(', '.join(['%s'] * len(stock_codes))))
+            params.extend(stock_codes)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return where, params
+
+
+def _rows_to_arrays(rows, columns):
+    """将一只股票的行数据转换为 {列名: numpy数组}"""
+    bars = {}
+    for pos, col in enumerate(columns):
+        # 前两列为 stock_code, stock_name
+        bars[col] = np.array([row[pos + 2] for row in rows], dtype=BAR_COLUMNS[col])
+    return bars
+
+
+def iter_stock_bars(columns=('trade_date', 'change_percent', 'volume'), start_date=None, end_date=None,
+                    stock_codes=None, batch_size=10000):
+    """按股票逐只流式读取stock_data，每次产出一只股票的全部K线
+
+    使用无缓冲的服务端游标(SSCursor)按 stock_code, trade_date 顺序读取，
+    结果不会在客户端整体缓存，内存占用只取决于单只股票的历史长度。
+    产出 (stock_code, stock_name, bars)，bars 为 {列名: numpy数组}，按交易日升序。
+    """
+    columns = list(columns)
+    _check_columns(columns)
+    where, params = _build_where(start_date, end_date, stock_codes)
+    query = """
+    SELECT stock_code, stock_name, {}
+    FROM stock_data
+    {}
+    ORDER BY stock_code, trade_date
+    """.format(', '.join(columns), where)
+
+    connection = get_connection(streaming=True)
+    try:
+        # 不使用 with 管理游标：SSCursor.close() 会读完剩余结果，提前退出时代价很大
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+
+        current_code = None
+        current_rows = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if row[0] != current_code:
+                    if current_rows:
+                        # 股票名称可能变更过（如戴帽摘帽），取最新的名称
+                        yield current_code, current_rows[-1][1], _rows_to_arrays(current_rows, columns)
+                    current_code = row[0]
+                    current_rows = []
+                current_rows.append(row)
+
+        if current_rows:
+            yield current_code, current_rows[-1][1], _rows_to_arrays(current_rows, columns)
+    finally:
+        # 提前结束迭代时直接关闭连接，避免服务端游标把剩余结果全部读完
+        connection.close()
+
+
+# 价格类字段在SQL中转换为DOUBLE（或放大后的整数），避免pymysql生成decimal.Decimal对象
+PRICE_FIELDS = ('open_price', 'close_price', 'high_price', 'low_price', 'amplitude',
+                'change_percent', 'change_amount', 'turnover_rate')
+
+# 价格放大倍数，price_mode='int32' 时价格以 价格*10000 的整数存储（DECIMAL(10,4)无精度损失）
+PRICE_SCALE = 10000
+
+# 1970-01-01 对应的 TO_DAYS 值，用于把日期转换为int32天数
+EPOCH_TO_DAYS = 719528
+
+
+class PricePanel():
+    """全市场K线面板
+
+    所有K线按 (stock_code, trade_date) 排序后首尾相接存放在一维数组中，
+    第 i 只股票的数据位于 offsets[i]:offsets[i+1]。
+    day 为自1970-01-01起的天数(int32)，价格为float32（或放大PRICE_SCALE倍的int32），
+    成交量为int64，成交额为float64。
+    """
+
+    def __init__(self, codes, names, offsets, day, columns, price_scale=None):
+        self.codes = np.asarray(codes)
+        self.names = np.asarray(names)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.day = np.asarray(day, dtype=np.int32)
+        self.columns = columns
+        self.price_scale = price_scale
+        self._cache = {}
+
+    @property
+    def n_stocks(self):
+        return len(self.codes)
+
+    @property
+    def n_rows(self):
+        return len(self.day)
+
+    @property
+    def nbytes(self):
+        """面板数值数组占用的字节数"""
+        return self.offsets.nbytes + self.day.nbytes + sum(arr.nbytes for arr in self.columns.values())
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    def values(self, field, dtype=np.float64):
+        """返回字段的数值数组，放大存储的价格会还原为实际价格"""
+        arr = self.columns[field]
+        if self.price_scale and field in PRICE_FIELDS:
+            return arr.astype(dtype) / self.price_scale
+        return arr.astype(dtype, copy=False)
+
+    def fingerprint(self):
+        """面板内容的指纹：股票代码、日期及全部字段数组的SHA1前16位，数据或范围变化时随之变化"""
+        if 'fingerprint' not in self._cache:
+            digest = hashlib.sha1()
+            digest.update('|'.join(str(code) for code in self.codes).encode('utf-8'))
+            for key in ['offsets', 'day'] + sorted(self.columns):
+                arr = getattr(self, key) if key in ('offsets', 'day') else self.columns[key]
+                digest.update(key.encode('utf-8'))
+                digest.update(np.ascontiguousarray(arr))
+            self._cache['fingerprint'] = digest.hexdigest()[:16]
+        return self._cache['fingerprint']
+
+    def lengths(self):
+        """每只股票的K线条数"""
+        return np.diff(self.offsets)
+
+    def stock_ids(self):
+        """每一行K线所属股票的序号"""
+        if 'stock_ids' not in self._cache:
+            self._cache['stock_ids'] = np.repeat(np.arange(self.n_stocks, dtype=np.int32), self.lengths())
+        return self._cache['stock_ids']
+
+    def calendar(self):
+        """面板中出现过的全部交易日（int32天数，升序）"""
+        if 'calendar' not in self._cache:
+            self._cache['calendar'] = np.unique(self.day)
+        return self._cache['calendar']
+
+    def date_index(self):
+        """每一行K线在交易日历中的列号"""
+        if 'date_index' not in self._cache:
+            self._cache['date_index'] = np.searchsorted(self.calendar(), self.day).astype(np.int32)
+        return self._cache['date_index']
+
+    def dates(self):
+        """每一行K线的日期(datetime64[D])"""
+        return self.day.astype('datetime64[D]')
+
+    def code_index(self, stock_code):
+        """股票代码对应的序号，不存在时返回None"""
+        matches = np.nonzero(self.codes == stock_code)[0]
+        return int(matches[0]) if len(matches) else None
+
+    def stock_slice(self, stock_idx):
+        """第 stock_idx 只股票在扁平数组中的区间"""
+        return slice(int(self.offsets[stock_idx]), int(self.offsets[stock_idx + 1]))
+
+    def matrix(self, field, fill=np.nan, dtype=np.float64):
+        """将字段展开为 股票×交易日 的二维矩阵，缺失的交易日填充 fill"""
+        result = np.full((self.n_stocks, len(self.calendar())), fill, dtype=dtype)
+        result[self.stock_ids(), self.date_index()] = self.values(field, dtype=dtype)
+        return result
+
+    def asof(self, event_codes, event_days, values, fill=np.nan):
+        """将按股票发生的事件值按“截至当日最近一次”对齐到面板的每一行
+
+        event_days 为事件生效日（int32天数），当天及之后的K线才能看到该值，不会用到未来数据。
+        返回与面板行数相同的float64数组，事件之前的行填充 fill。
+        """
+        event_codes = np.asarray(event_codes, dtype=object)
+        event_days = np.asarray(event_days, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float64)
+
+        # 股票代码转换为面板中的序号，面板中不存在的股票丢弃
+        code_lookup = {code: i for i, code in enumerate(self.codes)}
+        event_stocks = np.array([code_lookup.get(code, -1) for code in event_codes], dtype=np.int64)
+        keep = event_stocks >= 0
+        event_stocks, event_days, values = event_stocks[keep], event_days[keep], values[keep]
+
+        # 以 (股票序号, 日期) 组合成单调的键，做一次二分查找完成全部股票的as-of对齐
+        span = np.int64(1) << 32
+        event_keys = event_stocks * span + event_days
+        order = np.argsort(event_keys, kind='stable')
+        event_keys, event_stocks, values = event_keys[order], event_stocks[order], values[order]
+
+        row_keys = self.stock_ids().astype(np.int64) * span + self.day
+        pos = np.searchsorted(event_keys, row_keys, side='right') - 1
+        result = np.full(self.n_rows, fill, dtype=np.float64)
+        matched = pos >= 0
+        matched[matched] = event_stocks[pos[matched]] == self.stock_ids()[matched]
+        result[matched] = values[pos[matched]]
+        return result
+
+    def event_rows(self, event_codes, event_days, before=False):
+        """每个事件生效日当天或之后该股票的第一根K线的行号（before=True 时为当天或之前的最后一根）
+
+        找不到（股票不在面板中或该方向上没有K线）时为-1。
+        """
+        event_codes = np.asarray(event_codes, dtype=object)
+        event_days = np.asarray(event_days, dtype=np.int64)
+        code_lookup = {code: i for i, code in enumerate(self.codes)}
+        event_stocks = np.array([code_lookup.get(code, -1) for code in event_codes], dtype=np.int64)
+
+        span = np.int64(1) << 32
+        row_keys = self.stock_ids().astype(np.int64) * span + self.day
+        event_keys = np.maximum(event_stocks, 0) * span + event_days
+        if before:
+            pos = np.searchsorted(row_keys, event_keys, side='right') - 1
+        else:
+            pos = np.searchsorted(row_keys, event_keys, side='left')
+        valid = (event_stocks >= 0) & (pos >= 0) & (pos < self.n_rows)
+        valid[valid] = self.stock_ids()[pos[valid]] == event_stocks[valid]
+        return np.where(valid, pos, -1)
+
+    def slice_stocks(self, start, stop):
+        """取连续的第 start 至 stop-1 只股票，返回共享底层数组的视图，不复制数据"""
+        row_start, row_stop = int(self.offsets[start]), int(self.offsets[stop])
+        return PricePanel(
+            self.codes[start:stop], self.names[start:stop], self.offsets[start:stop + 1] - row_start,
+            self.day[row_start:row_stop],
+            {field: arr[row_start:row_stop] for field, arr in self.columns.items()}, self.price_scale
+        )
+
+    def select(self, stock_indices):
+        """按股票序号取子面板"""
+        stock_indices = np.asarray(stock_indices, dtype=np.int64)
+        starts = self.offsets[stock_indices]
+        lengths = self.offsets[stock_indices + 1] - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # 每一行在原数组中的位置
+        rows = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return PricePanel(
+            self.codes[stock_indices], self.names[stock_indices], offsets, self.day[rows],
+            {field: arr[rows] for field, arr in self.columns.items()}, self.price_scale
+        )
+
+
+def _select_items(fields, price_mode='float32'):
+    """生成各字段的SELECT表达式及对应的numpy类型，价格在SQL中转换为DOUBLE或放大后的整数"""
+    select_items = []
+    dtypes = {}
+    for field in fields:
+        if field in PRICE_FIELDS:
+            if price_mode == 'int32':
+                select_items.append("CAST(ROUND({} * {}) AS SIGNED)".format(field, PRICE_SCALE))
+                dtypes[field] = np.int32
+            else:
+                # 与浮点字面量相加，结果为DOUBLE类型
+                select_items.append("{} + 0E0".format(field))
+                dtypes[field] = np.float32
+        elif field == 'volume':
+            select_items.append(field)
+            dtypes[field] = np.int64
+        else:
+            select_items.append("{} + 0E0".format(field))
+            dtypes[field] = np.float64
+    return select_items, dtypes
+
+
+def load_price_panel(fields=('open_price', 'high_price', 'low_price', 'close_price', 'volume', 'change_percent'),
+                     start_date=None, end_date=None, stock_codes=None, price_mode='float32', batch_size=100000):
+    """以紧凑类型加载stock_data为PricePanel
+
+    价格在SQL中转换为DOUBLE（price_mode='int32' 时为放大PRICE_SCALE倍的整数），
+    日期转换为int32天数，通过服务端游标分批读取并直接写入numpy数组，
+    不经过DataFrame和decimal.Decimal对象。
+    """
+    fields = [field for field in fields if field != 'trade_date']
+    _check_columns(fields)
+    if price_mode not in ('float32', 'int32'):
+        raise ValueError("price_mode 只能为 'float32' 或 'int32'")
+    select_items, dtypes = _select_items(fields, price_mode)
+
+    where, params = _build_where(start_date, end_date, stock_codes)
+    query = """
+    SELECT stock_code, stock_name, TO_DAYS(trade_date) - {}{}
+    FROM stock_data
+    {}
+    ORDER BY stock_code, trade_date
+    """.format(EPOCH_TO_DAYS, ''.join(', ' + item for item in select_items), where)
+
+    codes = []
+    names = []
+    starts = []
+    day_chunks = []
+    field_chunks = {field: [] for field in fields}
+    n_rows = 0
+
+    connection = get_connection(streaming=True)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            chunk = list(zip(*rows))
+            chunk_codes = np.array(chunk[0])
+
+            # 按股票代码切分本批数据，记录每只股票的起始行号和最新名称
+            changes = np.nonzero(chunk_codes[1:] != chunk_codes[:-1])[0] + 1
+            segment_starts = np.concatenate([[0], changes])
+            segment_ends = np.concatenate([changes, [len(rows)]]) - 1
+            for k, (seg_start, seg_end) in enumerate(zip(segment_starts, segment_ends)):
+                if k == 0 and codes and chunk_codes[0] == codes[-1]:
+                    # 延续上一批最后一只股票
+                    names[-1] = chunk[1][seg_end]
+                    continue
+                codes.append(str(chunk_codes[seg_start]))
+                starts.append(n_rows + int(seg_start))
+                names.append(chunk[1][seg_end])
+
+            day_chunks.append(np.array(chunk[2], dtype=np.int32))
+            for k, field in enumerate(fields):
+                field_chunks[field].append(np.array(chunk[k + 3], dtype=dtypes[field]))
+            n_rows += len(rows)
+    finally:
+        connection.close()
+
+    offsets = np.array(starts + [n_rows], dtype=np.int64)
+    day = np.concatenate(day_chunks) if day_chunks else np.empty(0, dtype=np.int32)
+    columns = {
+        field: np.concatenate(chunks) if chunks else np.empty(0, dtype=dtypes[field])
+        for field, chunks in field_chunks.items()
+    }
+    return PricePanel(np.array(codes, dtype=object), np.array(names, dtype=object), offsets, day, columns,
+                      PRICE_SCALE if price_mode == 'int32' else None)
+
+
+def load_name_days(keyword, start_date=None, end_date=None, stock_codes=None):
+    """名称中含 keyword 的K线（如 'ST' 对应戴帽期间），返回 (股票代码数组, int32天数数组)
+
+    面板只保存每只股票的最新名称，名称变更的历史（戴帽摘帽）需要按行查询。
+    """
+    where, params = _build_where(start_date, end_date, stock_codes)
+    where = (where + " AND " if where else "WHERE ") + "stock_name LIKE %s"
+    params.append('%' + keyword + '%')
+    query = """
+    SELECT stock_code, TO_DAYS(trade_date) - {}
+    FROM stock_data
+    {}
+    """.format(EPOCH_TO_DAYS, where)
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+    finally:
+        connection.close()
+    if not rows:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.int32)
+    codes, days = zip(*rows)
+    return np.array([str(code) for code in codes], dtype=object), np.array(days, dtype=np.int32)
+
+
+def iter_daily_bars(fields=('open_price', 'high_price', 'low_price', 'close_price', 'volume'), start_date=None,
+                    end_date=None, stock_codes=None, batch_size=100000):
+    """按交易日流式读取stock_data，每次产出一个交易日全市场的K线
+
+    使用服务端游标按 trade_date, stock_code 顺序读取（走 idx_trade_date 索引），内存占用只取决于单日股票数。
+    产出 (trade_date, codes, names, bars)：trade_date 为 datetime64[D]，codes/names 为按代码升序的数组，
+    bars 为 {字段: numpy数组}，价格为float64，成交量为int64。
+    """
+    fields = [field for field in fields if field != 'trade_date']
+    _check_columns(fields)
+    select_items, dtypes = _select_items(fields)
+    dtypes = {field: np.int64 if dtype == np.int64 else np.float64 for field, dtype in dtypes.items()}
+    where, params = _build_where(start_date, end_date, stock_codes)
+    query = """
+    SELECT TO_DAYS(trade_date) - {}, stock_code, stock_name{}
+    FROM stock_data
+    {}
+    ORDER BY trade_date, stock_code
+    """.format(EPOCH_TO_DAYS, ''.join(', ' + item for item in select_items), where)
+
+    def day_bars(pieces):
+        # pieces 为同一交易日跨批次的若干段列数据
+        columns = [sum((list(piece[k]) for piece in pieces), []) if len(pieces) > 1 else pieces[0][k]
+                   for k in range(len(fields) + 3)]
+        bars = {field: np.array(columns[k + 3], dtype=dtypes[field]) for k, field in enumerate(fields)}
+        return (np.datetime64(int(columns[0][0]), 'D'), np.array(columns[1], dtype=object),
+                np.array(columns[2], dtype=object), bars)
+
+    connection = get_connection(streaming=True)
+    try:
+        # 不使用 with 管理游标：SSCursor.close() 会读完剩余结果，提前退出时代价很大
+        cursor = connection.cursor()
+        cursor.execute(query, params)
+        pending = []
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            chunk = list(zip(*rows))
+            days = np.array(chunk[0], dtype=np.int64)
+            changes = np.nonzero(days[1:] != days[:-1])[0] + 1
+            bounds = np.concatenate([[0], changes, [len(rows)]])
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                piece = [column[start:end] for column in chunk]
+                if pending and pending[-1][0][0] != piece[0][0]:
+                    yield day_bars(pending)
+                    pending = []
+                pending.append(piece)
+        if pending:
+            yield day_bars(pending)
+    finally:
+        connection.close()
+
+
+def iter_panel_days(panel, fields=None):
+    """按交易日逐日产出已加载面板中的K线，格式与 iter_daily_bars 相同，便于对同一份数据反复回放"""
+    fields = list(panel.columns) if fields is None else list(fields)
+    date_index = panel.date_index()
+    # 稳定排序：同一交易日内保持股票代码顺序
+    order = np.argsort(date_index, kind='stable')
+    bounds = np.searchsorted(date_index[order], np.arange(len(panel.calendar()) + 1))
+    stock_ids = panel.stock_ids()
+    columns = {field: panel.values(field) if field in PRICE_FIELDS else panel.columns[field] for field in fields}
+    for k, day in enumerate(panel.calendar()):
+        rows = order[bounds[k]:bounds[k + 1]]
+        ids = stock_ids[rows]
+        yield (np.datetime64(int(day), 'D'), panel.codes[ids], panel.names[ids],
+               {field: arr[rows] for field, arr in columns.items()})
+
+
+def benchmark_load(start_date=None, end_date=None):
+    """对比 pd.read_sql 与 load_price_panel 的加载耗时和内存占用"""
+    fields = ['open_price', 'high_price', 'low_price', 'close_price', 'volume', 'change_percent']
+    where, params = _build_where(start_date, end_date)
+    query = """
+    SELECT stock_code, stock_name, trade_date, {}
+    FROM stock_data
+    {}
+    ORDER BY stock_code, trade_date
+    """.format(', '.join(fields), where)
+
+    engine = get_engine()
+
+    results = []
+
+    tracemalloc.start()
+    begin = time.perf_counter()
+    df = pd.read_sql(query, engine, params=tuple(params))
+    elapsed = time.perf_counter() - begin
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results.append({
+        '方式': 'pd.read_sql',
+        '行数': len(df),
+        '耗时(秒)': elapsed,
+        '峰值内存(MB)': peak / 1024 ** 2,
+        '结果内存(MB)': df.memory_usage(deep=True).sum() / 1024 ** 2
+    })
+    del df
+
+    for price_mode in ('float32', 'int32'):
+        tracemalloc.start()
+        begin = time.perf_counter()
+        panel = load_price_panel(fields, start_date=start_date, end_date=end_date, price_mode=price_mode)
+        elapsed = time.perf_counter() - begin
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({
+            '方式': 'load_price_panel({})'.format(price_mode),
+            '行数': panel.n_rows,
+            '耗时(秒)': elapsed,
+            '峰值内存(MB)': peak / 1024 ** 2,
+            '结果内存(MB)': (panel.nbytes + sum(len(str(code)) + len(str(name)) for code, name in zip(panel.codes, panel.names))) / 1024 ** 2
+        })
+        del panel
+
+    result_df = pd.DataFrame(results)
+    print(result_df.to_string(index=False))
+    return result_df
+
+
+if __name__ == '__main__':
+    benchmark_load()
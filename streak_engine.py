@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+
+def run_lengths(flags, offsets):
+    """计算以每一行结尾的连续True的长度，在股票边界处重新计数
+
+    flags 为按股票首尾相接的一维布尔数组，offsets 为各股票的起始行号（含末尾总行数）。
+    """
+    flags = np.asarray(flags, dtype=bool)
+    # 行数不超过int32范围时使用int32，减少一半内存带宽
+    idx_dtype = np.int32 if len(flags) < 2 ** 31 - 1 else np.int64
+    idx = np.arange(len(flags), dtype=idx_dtype)
+    # 断点：值为False的行，以及每只股票第一行之前的位置
+    breaks = np.where(flags, -1, idx)
+    starts = np.asarray(offsets[:-1], dtype=np.int64)
+    starts = starts[starts < len(flags)]
+    first_true = starts[flags[starts]]
+    breaks[first_true] = first_true - 1
+    return idx - np.maximum.accumulate(breaks) if len(flags) else idx
+
+
+def increasing_flags(values, offsets):
+    """每一行是否严格大于同一只股票的前一行（每只股票第一行为False）"""
+    values = np.asarray(values)
+    flags = np.zeros(len(values), dtype=bool)
+    flags[1:] = values[1:] > values[:-1]
+    starts = np.asarray(offsets[:-1], dtype=np.int64)
+    flags[starts[starts < len(values)]] = False
+    return flags
+
+
+def segment_max(values, starts, ends):
+    """求每个区间 [start, end] 内的最大值，区间不能为空"""
+    if len(starts) == 0:
+        return np.empty(0, dtype=values.dtype)
+    # 末尾追加一个哨兵，保证 end+1 不越界
+    padded = np.concatenate([values, values[-1:]])
+    indices = np.empty(2 * len(starts), dtype=np.int64)
+    indices[0::2] = starts
+    indices[1::2] = np.asarray(ends) + 1
+    return np.maximum.reduceat(padded, indices)[0::2]
+
+
+def streak_table(up, volume, offsets):
+    """对全市场一次性计算连涨区间统计，返回每只股票一行的字典（numpy数组）
+
+    - longest_days / longest_start / longest_end: 最长连涨天数及其首末行号（并列时取最早一段）
+    - longest_volume_run: 最长连涨区间内成交量严格递增的最长连续天数
+    - current_days / current_volume_run: 截至最后一个交易日仍在延续的连涨天数及其中成交量递增的天数
+    行号为扁平数组中的位置；没有连涨的股票 longest_start/longest_end 为 -1。
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    n_stocks = len(lengths)
+    stock_ids = np.repeat(np.arange(n_stocks, dtype=np.int32), lengths)
+
+    up_run = run_lengths(up, offsets)
+    # 成交量严格递增的连续天数（含第一天），限制在连涨区间内部
+    volume_run = run_lengths(increasing_flags(volume, offsets), offsets) + 1
+    volume_in_streak = np.minimum(volume_run, up_run)
+
+    longest_days = np.zeros(n_stocks, dtype=np.int64)
+    longest_end = np.full(n_stocks, -1, dtype=np.int64)
+    longest_volume_run = np.zeros(n_stocks, dtype=np.int64)
+    current_days = np.zeros(n_stocks, dtype=np.int64)
+    current_volume_run = np.zeros(n_stocks, dtype=np.int64)
+
+    nonempty = lengths > 0
+    if nonempty.any():
+        longest_days[nonempty] = np.maximum.reduceat(up_run, offsets[:-1][nonempty])
+        last_rows = offsets[1:][nonempty] - 1
+        current_days[nonempty] = up_run[last_rows]
+        current_volume_run[nonempty] = volume_in_streak[last_rows]
+
+        # 最长连涨区间的结束行：每只股票第一次达到最大值的位置
+        candidates = np.nonzero((up_run == longest_days[stock_ids]) & (up_run > 0))[0]
+        hit_stocks, first = np.unique(stock_ids[candidates], return_index=True)
+        longest_end[hit_stocks] = candidates[first]
+
+    has_streak = longest_end >= 0
+    longest_start = np.where(has_streak, longest_end - longest_days + 1, -1)
+    longest_volume_run[has_streak] = segment_max(volume_in_streak, longest_start[has_streak], longest_end[has_streak])
+
+    return {
+        'longest_days': longest_days,
+        'longest_start': longest_start,
+        'longest_end': longest_end,
+        'longest_volume_run': longest_volume_run,
+        'current_days': current_days,
+        'current_volume_run': current_volume_run
+    }
+
+
+def rising_streaks(panel, min_days=7, check_volume=False):
+    """在全市场面板上查找最长连涨天数不少于 min_days 的股票
+
+    panel 需包含 change_percent 和 volume 字段。check_volume=True 时要求整个最长连涨区间内
+    成交量逐日严格递增。返回DataFrame，每只命中的股票一行，按最长连涨天数降序排列。
+    """
+    table = streak_table(panel['change_percent'] > 0, panel['volume'], panel.offsets)
+    hit = table['longest_days'] >= min_days
+    volume_increasing = (table['longest_volume_run'] >= table['longest_days']) & (table['longest_days'] > 1)
+    if check_volume:
+        hit &= volume_increasing
+
+    day = panel.day
+    result = pd.DataFrame({
+        'stock_code': panel.codes[hit],
+        'stock_name': panel.names[hit],
+        'consecutive_days': table['longest_days'][hit],
+        'start_date': day[table['longest_start'][hit]].astype('datetime64[D]'),
+        'end_date': day[table['longest_end'][hit]].astype('datetime64[D]'),
+        'start_idx': table['longest_start'][hit] - panel.offsets[:-1][hit],
+        'end_idx': table['longest_end'][hit] - panel.offsets[:-1][hit],
+        'volume_run': table['longest_volume_run'][hit],
+        'volume_increasing': volume_increasing[hit],
+        'current_days': table['current_days'][hit],
+        'current_volume_run': table['current_volume_run'][hit]
+    })
+    return result.sort_values(['consecutive_days', 'stock_code'], ascending=[False, True]).reset_index(drop=True)
@@ -0,0 +1,415 @@
+import numpy as np
+import pandas as pd
+import time
+import warnings
+from stock_store import get_connection, get_engine, load_price_panel, load_name_days, EPOCH_TO_DAYS
+from indicators import tradable_mask
+
+warnings.filterwarnings('ignore')
+
+# 每根K线的可交易性标志，按位存放在一个uint8中，多个条件可直接按位与/或组合
+LIMIT_UP = 1         # 收盘涨停
+LIMIT_DOWN = 2       # 收盘跌停
+OPEN_LIMIT_UP = 4    # 开盘即涨停（买不进）
+ONE_LINE_DOWN = 8    # 一字跌停（卖不出）
+ST = 16              # 名称含ST（风险警示）
+SUSPENDED = 32       # 停牌（无成交或价格无效）
+NEW_LISTING = 64     # 上市后的前 NEW_LISTING_DAYS 根K线
+
+FLAG_NAMES = {
+    LIMIT_UP: '涨停',
+    LIMIT_DOWN: '跌停',
+    OPEN_LIMIT_UP: '开盘涨停',
+    ONE_LINE_DOWN: '一字跌停',
+    ST: 'ST',
+    SUSPENDED: '停牌',
+    NEW_LISTING: '新股'
+}
+
+# 回测中买入、卖出受阻的标志组合
+BUY_BLOCKED = SUSPENDED | OPEN_LIMIT_UP
+SELL_BLOCKED = SUSPENDED | ONE_LINE_DOWN
+# 筛选时默认剔除的标志：停牌、ST、新股
+SCREEN_EXCLUDE = SUSPENDED | ST | NEW_LISTING
+
+# 新股标记的K线数：注册制下新股上市后前5个交易日不设涨跌幅限制，筛选时统一剔除这段时间
+NEW_LISTING_DAYS = 5
+
+# 创业板注册制改革（涨跌幅由10%放宽到20%）生效日，自1970-01-01起的天数
+CHINEXT_REFORM_DAY = int((np.datetime64('2020-08-24', 'D') - np.datetime64('1970-01-01', 'D')).astype(np.int64))
+# 主板全面注册制首批新股上市日，此后上市的主板新股前5个交易日不设涨跌幅限制
+MAIN_BOARD_REFORM_DAY = int((np.datetime64('2023-04-10', 'D') - np.datetime64('1970-01-01', 'D')).astype(np.int64))
+
+TRADABILITY_FIELDS = ('open_price', 'high_price', 'low_price', 'close_price', 'volume', 'change_percent')
+TRADABILITY_COLUMNS = ['stock_code', 'trade_date', 'flags', 'limit_up_price', 'limit_down_price']
+
+
+def st_flags(names):
+    """名称中是否含ST（*ST、SST等同样算作ST）"""
+    return np.char.find(np.char.upper(np.asarray(names, dtype=str)), 'ST') >= 0
+
+
+def board_limit_ratios(codes, names, day, st=None):
+    """按代码、名称和日期（int天数，标量或与codes等长的数组）估算涨跌停幅度
+
+    创业板(300/301)自2020-08-24起、科创板(688/689)为20%，北交所(8/4/92开头)为30%，
+    名称含ST的为5%，其余为10%。st 可直接传入布尔数组（如按历史名称得到的戴帽状态），此时忽略 names。
+    """
+    codes = np.asarray(codes, dtype=str)
+    ratio = np.full(len(codes), 0.10)
+    chinext = np.char.startswith(codes, '300') | np.char.startswith(codes, '301')
+    star = np.char.startswith(codes, '688') | np.char.startswith(codes, '689')
+    bse = np.char.startswith(codes, '8') | np.char.startswith(codes, '4') | np.char.startswith(codes, '92')
+    st = st_flags(names) if st is None else np.broadcast_to(np.asarray(st, dtype=bool), len(codes))
+    ratio[st] = 0.05
+    ratio[star] = 0.20
+    ratio[bse] = 0.30
+    # 创业板注册制改革前涨跌幅为10%（ST为5%），改革后不再区分ST
+    ratio[chinext & (np.asarray(day) >= CHINEXT_REFORM_DAY)] = 0.20
+    return ratio
+
+
+def limit_free_days(codes, list_day):
+    """新股上市后不适用涨跌幅限制的交易日数，list_day 为上市首日（int天数，标量或与codes等长的数组）
+
+    科创板、注册制后的创业板（2020-08-24起上市）和主板（2023-04-10起上市）前5个交易日不设涨跌幅限制；
+    此前的主板、创业板新股以及北交所新股只有上市首日不适用常规涨跌幅（首日另有44%等限制），第二天起按板块幅度涨跌停。
+    """
+    codes = np.asarray(codes, dtype=str)
+    list_day = np.broadcast_to(np.asarray(list_day), len(codes))
+    chinext = np.char.startswith(codes, '300') | np.char.startswith(codes, '301')
+    star = np.char.startswith(codes, '688') | np.char.startswith(codes, '689')
+    bse = np.char.startswith(codes, '8') | np.char.startswith(codes, '4') | np.char.startswith(codes, '92')
+    main = ~(chinext | star | bse)
+    registered = star | (chinext & (list_day >= CHINEXT_REFORM_DAY)) | (main & (list_day >= MAIN_BOARD_REFORM_DAY))
+    return np.where(registered, NEW_LISTING_DAYS, 1)
+
+
+def limit_ratios(panel, st=None):
+    """每根K线的涨跌停幅度
+
+    st 为与面板行对齐的戴帽状态，缺省时按当前名称处理（历史上摘帽/戴帽的情况不区分）。
+    板块规则只与代码有关，先按股票算出 是否ST × 改革前后 四种幅度，再按行选取。
+    """
+    stock_ids = panel.stock_ids()
+    after = panel.day >= CHINEXT_REFORM_DAY
+    if st is None:
+        st = st_flags(panel.names)[stock_ids]
+    ratio = np.empty(panel.n_rows)
+    for st_value in (False, True):
+        for after_value, day in ((False, CHINEXT_REFORM_DAY - 1), (True, CHINEXT_REFORM_DAY)):
+            rows = (st == st_value) & (after == after_value)
+            ratio[rows] = board_limit_ratios(panel.codes, panel.names, day, st=st_value)[stock_ids[rows]]
+    return ratio
+
+
+def previous_close(panel):
+    """每根K线的前收盘价
+
+    股票在面板中的第一根K线没有上一行，用 收盘价/(1+涨跌幅) 还原并四舍五入到分；
+    这样只加载最近几天数据做增量计算时，第一天也能判断涨跌停。
+    """
+    close = panel.values('close_price')
+    prev_close = np.full(panel.n_rows, np.nan)
+    prev_close[1:] = close[:-1]
+    first_rows = panel.offsets[:-1][panel.lengths() > 0]
+    if 'change_percent' in panel:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            prev_close[first_rows] = np.round(close[first_rows] / (1 + panel.values('change_percent')[first_rows] / 100), 2)
+    else:
+        prev_close[first_rows] = np.nan
+    prev_close[~(prev_close > 0)] = np.nan
+    return prev_close
+
+
+def limit_band(prev_close, ratio):
+    """由前收盘价和涨跌幅计算涨停价、跌停价，返回 (涨停价, 跌停价)
+
+    前收盘价先转为float64并四舍五入到分：面板中的float32收盘价有表示误差（如10.15存为10.1499996），
+    直接乘以1.1会把11.165舍成11.16。之后再乘以 1±涨跌幅 并四舍五入到分，前收盘价未知时为NaN。
+    """
+    prev_close = np.round(np.asarray(prev_close, dtype=np.float64), 2)
+    up = np.round(prev_close * (1 + ratio) + 1e-9, 2)
+    down = np.round(prev_close * (1 - ratio) + 1e-9, 2)
+    return up, down
+
+
+def limit_prices(panel, ratio=None):
+    """每根K线的涨停价、跌停价（见 limit_band），前收盘价未知时为NaN"""
+    if ratio is None:
+        ratio = limit_ratios(panel)
+    return limit_band(previous_close(panel), ratio)
+
+
+def compute_flags(panel, st=None, listed=None, new_listing_days=NEW_LISTING_DAYS):
+    """全面板向量化计算每根K线的可交易性标志，返回 (flags, 涨停价, 跌停价)
+
+    st 为与面板行对齐的戴帽状态（缺省按当前名称）；listed 为每只股票在面板中的第一根K线是否为上市首日，
+    缺省时认为晚于面板第一个交易日才出现的股票是新股。新股的前 NEW_LISTING_DAYS 根K线都标记为新股，
+    但只有板块和上市日期规定不设涨跌幅限制的K线（见 limit_free_days）不标记涨跌停。
+    """
+    if panel.n_rows == 0:
+        return np.zeros(0, dtype=np.uint8), np.empty(0), np.empty(0)
+    stock_ids = panel.stock_ids()
+    if st is None:
+        st = st_flags(panel.names)[stock_ids]
+    if listed is None:
+        listed = panel.day[np.minimum(panel.offsets[:-1], panel.n_rows - 1)] > panel.calendar()[0]
+    listed = np.asarray(listed, dtype=bool)
+    bar_number = np.arange(panel.n_rows) - panel.offsets[:-1][stock_ids]
+    new_listing = listed[stock_ids] & (bar_number < new_listing_days)
+    first_days = panel.day[np.minimum(panel.offsets[:-1], panel.n_rows - 1)]
+    limit_free = listed[stock_ids] & (bar_number < limit_free_days(panel.codes, first_days)[stock_ids])
+
+    up, down = limit_prices(panel, limit_ratios(panel, st))
+    close = panel.values('close_price')
+    open_price = panel.values('open_price')
+    high = panel.values('high_price')
+    low = panel.values('low_price')
+    suspended = ~tradable_mask(panel) if 'volume' in panel else ~(np.isfinite(close) & (close > 0))
+    limited = ~suspended & ~limit_free
+
+    flags = np.zeros(panel.n_rows, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        flags[limited & (close >= up - 0.005)] |= LIMIT_UP
+        flags[limited & (close <= down + 0.005)] |= LIMIT_DOWN
+        flags[limited & (open_price >= up - 0.005)] |= OPEN_LIMIT_UP
+        flags[limited & (high - low < 0.005) & (low <= down + 0.005)] |= ONE_LINE_DOWN
+    flags[st] |= ST
+    flags[suspended] |= SUSPENDED
+    flags[new_listing] |= NEW_LISTING
+    return flags, up, down
+
+
+def allowed(flags, exclude=SCREEN_EXCLUDE):
+    """不含 exclude 中任一标志的K线，可直接与筛选条件、买卖信号按位与"""
+    return (np.asarray(flags) & np.uint8(exclude)) == 0
+
+
+def tradability_flags(panel, engine=None):
+    """面板的可交易性标志，在面板上缓存，多次调用只计算一次
+
+    标志表覆盖到面板最后一个交易日时直接读取标志表（ST按每根K线当时的名称判断）；
+    否则按stock_data中的历史名称现算；数据库不可用时才按当前名称判断ST。
+    """
+    if 'tradability' not in panel._cache:
+        panel._cache['tradability'] = _panel_flags(panel, engine)
+    return panel._cache['tradability']
+
+
+def _table_covers(panel, engine):
+    """标志表是否已更新到面板的最后一个交易日"""
+    try:
+        latest = pd.read_sql("SELECT TO_DAYS(MAX(trade_date)) - {} AS latest FROM stock_tradability".format(
+            EPOCH_TO_DAYS), engine)['latest'].iloc[0]
+    except Exception:
+        return False
+    return latest is not None and not pd.isna(latest) and int(latest) >= int(panel.calendar()[-1])
+
+
+def _panel_flags(panel, engine=None):
+    if panel.n_rows == 0:
+        return np.zeros(0, dtype=np.uint8)
+    try:
+        engine = engine if engine is not None else get_engine()
+        if _table_covers(panel, engine):
+            return load_flags(panel, engine)
+        start, end = panel.calendar()[[0, -1]].astype('datetime64[D]')
+        st = st_rows(panel, str(start), str(end))
+    except Exception as e:
+        print(f"无法读取历史名称，按当前名称判断ST: {e}")
+        st = None
+    return compute_flags(panel, st=st)[0]
+
+
+def describe_flags(flags):
+    """把标志值转换为可读的中文说明，如 '涨停|开盘涨停'"""
+    return '|'.join(name for bit, name in FLAG_NAMES.items() if int(flags) & bit)
+
+
+def st_rows(panel, start_date=None, end_date=None, stock_codes=None):
+    """按stock_data中的历史名称得到与面板行对齐的戴帽状态"""
+    codes, days = load_name_days('ST', start_date, end_date, stock_codes)
+    st = np.zeros(panel.n_rows, dtype=bool)
+    if len(codes):
+        rows = panel.event_rows(codes, days)
+        found = rows >= 0
+        found[found] = panel.day[rows[found]] == days[found]
+        st[rows[found]] = True
+    return st
+
+
+def create_tradability_table():
+    """创建可交易性标志表，只保存标志不为0的K线，表中没有记录的K线即为正常交易"""
+    create_table_sql = """
+            CREATE TABLE IF NOT EXISTS stock_tradability (
+                stock_code VARCHAR(20) NOT NULL COMMENT '股票代码',
+                trade_date DATE NOT NULL COMMENT '交易日期',
+                flags TINYINT UNSIGNED NOT NULL COMMENT '按位标志: 1涨停 2跌停 4开盘涨停 8一字跌停 16ST 32停牌 64新股',
+                limit_up_price DOUBLE NULL COMMENT '涨停价',
+                limit_down_price DOUBLE NULL COMMENT '跌停价',
+                PRIMARY KEY (stock_code, trade_date),
+                INDEX idx_trade_date (trade_date, flags)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='可交易性标志表'
+            """
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _flag_frame(panel, flags, up, down, rows=None):
+    """标志不为0的K线明细，rows 为需要输出的行号（默认全部行）"""
+    keep = flags != 0
+    if rows is not None:
+        selected = np.zeros(panel.n_rows, dtype=bool)
+        selected[rows] = True
+        keep &= selected
+    keep_rows = np.nonzero(keep)[0]
+    return pd.DataFrame({
+        'stock_code': panel.codes[panel.stock_ids()[keep_rows]],
+        'trade_date': panel.day[keep_rows].astype('datetime64[D]'),
+        'flags': flags[keep_rows].astype(np.int64),
+        'limit_up_price': up[keep_rows],
+        'limit_down_price': down[keep_rows]
+    })
+
+
+def _save_flags(frame, batch_size=10000):
+    """写入标志记录（主键冲突时覆盖）"""
+    if len(frame) == 0:
+        return
+    sql = "INSERT INTO stock_tradability ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+        ', '.join(TRADABILITY_COLUMNS), ', '.join(['%s'] * len(TRADABILITY_COLUMNS)),
+        ', '.join('{0} = VALUES({0})'.format(col) for col in TRADABILITY_COLUMNS[2:]))
+    frame = frame[TRADABILITY_COLUMNS].copy()
+    frame['trade_date'] = frame['trade_date'].astype(str)
+    rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            for begin in range(0, len(rows), batch_size):
+                cursor.executemany(sql, rows[begin:begin + batch_size])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def rebuild_tradability():
+    """从stock_data全量重建可交易性标志表，ST按每根K线当时的名称判断"""
+    begin = time.perf_counter()
+    create_tradability_table()
+    panel = load_price_panel(fields=TRADABILITY_FIELDS)
+    if panel.n_rows == 0:
+        print("数据库中没有数据，无需重建可交易性标志表")
+        return 0
+    flags, up, down = compute_flags(panel, st=st_rows(panel))
+    frame = _flag_frame(panel, flags, up, down)
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE TABLE stock_tradability")
+        connection.commit()
+    finally:
+        connection.close()
+    _save_flags(frame)
+    print(f"可交易性标志表重建完成，{panel.n_rows} 根K线中 {len(frame)} 根有标志，"
+          f"耗时 {time.perf_counter() - begin:.1f} 秒")
+    return len(frame)
+
+
+def update_tradability(df, engine=None):
+    """新K线导入后计算当日的可交易性标志并写入标志表，标志表为空时全量重建
+
+    只加载相关股票最近 NEW_LISTING_DAYS 个交易日的K线：前收盘价取上一行，
+    新股判断只需知道面板中首次出现的股票是否为上市首日（与它在stock_data中最早的日期比较）。
+    """
+    if df is None or len(df) == 0:
+        return 0
+    engine = engine if engine is not None else get_engine()
+    create_tradability_table()
+
+    count = pd.read_sql("SELECT COUNT(*) AS total FROM stock_tradability", engine)['total'].iloc[0]
+    if count == 0:
+        return rebuild_tradability()
+
+    codes = sorted(df['stock_code'].astype(str).unique().tolist())
+    new_dates = sorted(pd.to_datetime(df['trade_date']).dt.date.unique())
+    calendar = pd.read_sql("SELECT DISTINCT trade_date FROM stock_data WHERE trade_date <= %s "
+                           "ORDER BY trade_date DESC LIMIT %s",
+                           engine, params=(str(new_dates[-1]), int(NEW_LISTING_DAYS + len(new_dates) + 1)))
+    start_date = min(pd.to_datetime(calendar['trade_date']).min().date(), new_dates[0])
+    panel = load_price_panel(fields=TRADABILITY_FIELDS, start_date=start_date, end_date=new_dates[-1], stock_codes=codes)
+    if panel.n_rows == 0:
+        return 0
+
+    # 在窗口内才首次出现的股票，查询其在stock_data中的最早日期，相同即为新上市
+    first_days = panel.day[panel.offsets[:-1]]
+    start_day = (np.datetime64(start_date, 'D') - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+    listed = np.zeros(panel.n_stocks, dtype=bool)
+    candidates = np.nonzero(first_days > start_day)[0]
+    if len(candidates):
+        earliest = pd.read_sql(
+            "SELECT stock_code, TO_DAYS(MIN(trade_date)) - {} AS first_day FROM stock_data "
+            "WHERE stock_code IN ({}) GROUP BY stock_code".format(EPOCH_TO_DAYS, ', '.join(['%s'] * len(candidates))),
+            engine, params=tuple(str(code) for code in panel.codes[candidates]))
+        lookup = dict(zip(earliest['stock_code'].astype(str), earliest['first_day'].astype(np.int64)))
+        listed[candidates] = [lookup.get(str(panel.codes[i])) == int(first_days[i]) for i in candidates]
+
+    new_days = (np.array(new_dates, dtype='datetime64[D]') - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+    rows = np.nonzero(np.isin(panel.day, new_days))[0]
+    flags, up, down = compute_flags(panel, st=st_rows(panel, start_date, new_dates[-1], codes), listed=listed)
+    frame = _flag_frame(panel, flags, up, down, rows=rows)
+    _save_flags(frame)
+    print(f"已更新 {len(new_dates)} 个交易日的可交易性标志，{len(rows)} 根K线中 {len(frame)} 根有标志")
+    return len(frame)
+
+
+def load_flags(panel, engine=None):
+    """从标志表读取与面板行对齐的标志（ST按历史名称判断），表中没有记录的行为0
+
+    只查询面板中的股票，分片筛选时每个分片只读取自己那部分股票的标志。
+    """
+    engine = engine if engine is not None else get_engine()
+    if panel.n_rows == 0:
+        return np.zeros(0, dtype=np.uint8)
+    start, end = panel.calendar()[[0, -1]].astype('datetime64[D]')
+    codes = [str(code) for code in panel.codes]
+    stored = pd.read_sql("SELECT stock_code, TO_DAYS(trade_date) - {} AS day, flags FROM stock_tradability "
+                         "WHERE trade_date BETWEEN %s AND %s AND stock_code IN ({})".format(
+                             EPOCH_TO_DAYS, ', '.join(['%s'] * len(codes))),
+                         engine, params=tuple([str(start), str(end)] + codes))
+    flags = np.zeros(panel.n_rows, dtype=np.uint8)
+    if len(stored):
+        days = stored['day'].values.astype(np.int64)
+        rows = panel.event_rows(stored['stock_code'].astype(str).values, days)
+        found = rows >= 0
+        found[found] = panel.day[rows[found]] == days[found]
+        flags[rows[found]] = stored['flags'].values[found].astype(np.uint8)
+    return flags
+
+
+def get_flagged(trade_date=None, flag=LIMIT_UP, engine=None):
+    """查询某个交易日（默认最新）带有 flag 中任一标志的股票"""
+    engine = engine if engine is not None else get_engine()
+    if trade_date is None:
+        latest = pd.read_sql("SELECT MAX(trade_date) AS latest FROM stock_tradability", engine)['latest'].iloc[0]
+        if latest is None or pd.isna(latest):
+            return pd.DataFrame(columns=TRADABILITY_COLUMNS)
+        trade_date = latest
+    query = """
+    SELECT {} FROM stock_tradability
+    WHERE trade_date = %s AND (flags & %s) <> 0
+    ORDER BY stock_code
+    """.format(', '.join(TRADABILITY_COLUMNS))
+    result = pd.read_sql(query, engine, params=(str(trade_date), int(flag)))
+    result['说明'] = result['flags'].map(describe_flags)
+    return result
+
+
+if __name__ == '__main__':
+    rebuild_tradability()
+    print(get_flagged().head(50).to_string(index=False))
@@ -5,6 +5,11 @@ import pymysql
 from sqlalchemy import create_engine
 import warnings
 from datetime import datetime
+from signal_state import update_signal_state
+from indicator_store import update_indicators
+from pivots import update_pivots
+from volume_spike import update_volume_spikes
+from tradability import update_tradability
 
 warnings.filterwarnings('ignore')
 
@@ -235,6 +240,36 @@ def import_excel_file_to_mysql(file_path):
         if len(df) > 0:
             df.to_sql('stock_data', con=engine, if_exists='append', index=False, method='multi')
             print(f"成功导入文件 {file_path} 到数据库，共导入 {len(df)} 条记录")
+            
+            # 用本次导入的K线增量更新连涨状态表
+            try:
+                update_signal_state(df, engine)
+            except Exception as e:
+                print(f"更新连涨状态表时出错: {e}")
+            
+            # 增量更新均线、EMA、均量等技术指标
+            try:
+                update_indicators(df, engine)
+            except Exception as e:
+                print(f"更新技术指标时出错: {e}")
+            
+            # 用刚更新的均量扫描当日放量
+            try:
+                update_volume_spikes(df, engine)
+            except Exception as e:
+                print(f"扫描放量时出错: {e}")
+            
+            # 在线确认新的阶段高低点
+            try:
+                update_pivots(df, engine)
+            except Exception as e:
+                print(f"更新阶段高低点时出错: {e}")
+            
+            # 标记涨跌停、ST、停牌和新股
+            try:
+                update_tradability(df, engine)
+            except Exception as e:
+                print(f"更新可交易性标志时出错: {e}")
         else:
             print("没有新数据需要导入")
         return True
@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+import warnings
+from stock_store import get_connection, get_engine, load_price_panel
+from indicators import rolling_mean
+from indicator_store import VOLUME_MA_WINDOWS
+
+warnings.filterwarnings('ignore')
+
+# 放量口径：口径名 -> stock_data 中的字段，均与自身 SPIKE_WINDOW 日均值（含当日）相比
+SPIKE_VARIANTS = {
+    'volume': 'volume',
+    'turnover_rate': 'turnover_rate',
+    'amplitude': 'amplitude'
+}
+SPIKE_WINDOW = 20
+# 默认报警倍数，与 average_line_cross 图上标注的 “成交量 > 3 * 20日均量” 一致
+SPIKE_MULTIPLE = 3.0
+# 入库门槛：倍数不低于该值的记录都写入表中，查询时可再按任意不低于它的倍数过滤
+STORE_MULTIPLE = 2.0
+
+SPIKE_FIELDS = ('close_price', 'volume', 'change_percent', 'turnover_rate', 'amplitude')
+SPIKE_COLUMNS = ['trade_date', 'variant', 'stock_code', 'stock_name', 'value', 'ma_value', 'ratio',
+                 'close_price', 'change_percent']
+
+
+def spike_ratios(panel, variant='volume', window=SPIKE_WINDOW, ma=None):
+    """面板每一行的放量倍数（当日值 / window 日均值），历史不足 window 根或均值为0时为NaN
+
+    ma 可传入已维护好的均值数组（如指标表中的 vol_ma20），否则在面板上计算。
+    返回 (当日值, 均值, 倍数)。
+    """
+    if variant not in SPIKE_VARIANTS:
+        raise ValueError("未知的放量口径: {}".format(variant))
+    values = panel.values(SPIKE_VARIANTS[variant])
+    if ma is None:
+        ma = rolling_mean(values, window, panel.offsets)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = values / ma
+    ratio[~np.isfinite(ratio)] = np.nan
+    return values, ma, ratio
+
+
+def scan_spikes(panel, variants=tuple(SPIKE_VARIANTS), multiple=STORE_MULTIPLE, window=SPIKE_WINDOW,
+                rows=None, ma_overrides=None):
+    """全市场向量化扫描放量，返回倍数超过 multiple 的明细
+
+    rows 为需要输出的行号（如只输出新导入的交易日），默认全部行；
+    ma_overrides 为 {口径: 均值数组}，用于直接使用增量维护的均值。
+    """
+    ma_overrides = ma_overrides or {}
+    stock_ids = panel.stock_ids()
+    frames = []
+    for variant in variants:
+        values, ma, ratio = spike_ratios(panel, variant, window, ma_overrides.get(variant))
+        with np.errstate(invalid='ignore'):
+            hit = ratio >= multiple
+        if rows is not None:
+            selected = np.zeros(panel.n_rows, dtype=bool)
+            selected[rows] = True
+            hit &= selected
+        hit_rows = np.nonzero(hit)[0]
+        ids = stock_ids[hit_rows]
+        frames.append(pd.DataFrame({
+            'trade_date': panel.day[hit_rows].astype('datetime64[D]'),
+            'variant': variant,
+            'stock_code': panel.codes[ids],
+            'stock_name': panel.names[ids],
+            'value': values[hit_rows],
+            'ma_value': ma[hit_rows],
+            'ratio': ratio[hit_rows],
+            'close_price': panel.values('close_price')[hit_rows] if 'close_price' in panel else np.nan,
+            'change_percent': panel.values('change_percent')[hit_rows] if 'change_percent' in panel else np.nan
+        }))
+    if not frames:
+        return pd.DataFrame(columns=SPIKE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def create_spike_table():
+    """创建放量记录表，按 交易日+口径 为主键前缀，查询某日放量股票只需一次索引查找"""
+    create_table_sql = """
+            CREATE TABLE IF NOT EXISTS stock_volume_spike (
+                trade_date DATE NOT NULL COMMENT '交易日期',
+                variant VARCHAR(16) NOT NULL COMMENT '口径: volume/turnover_rate/amplitude',
+                stock_code VARCHAR(20) NOT NULL COMMENT '股票代码',
+                stock_name VARCHAR(50) NULL COMMENT '股票名称',
+                value DOUBLE NULL COMMENT '当日值',
+                ma_value DOUBLE NULL COMMENT '{0}日均值(含当日)',
+                ratio DOUBLE NOT NULL COMMENT '放量倍数',
+                close_price DOUBLE NULL COMMENT '收盘价',
+                change_percent DOUBLE NULL COMMENT '涨跌幅',
+                PRIMARY KEY (trade_date, variant, stock_code),
+                INDEX idx_stock (stock_code, trade_date)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='放量记录表'
+            """.format(SPIKE_WINDOW)
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(create_table_sql)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def _save_spikes(spikes, batch_size=10000):
+    """写入放量记录（主键冲突时覆盖）"""
+    if len(spikes) == 0:
+        return
+    sql = "INSERT INTO stock_volume_spike ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}".format(
+        ', '.join(SPIKE_COLUMNS), ', '.join(['%s'] * len(SPIKE_COLUMNS)),
+        ', '.join('{0} = VALUES({0})'.format(col) for col in SPIKE_COLUMNS[3:]))
+    frame = spikes[SPIKE_COLUMNS].copy()
+    frame['trade_date'] = frame['trade_date'].astype(str)
+    rows = frame.astype(object).where(frame.notna(), None).values.tolist()
+    connection = get_connection()
+    try:
+        with connection.cursor() as cursor:
+            for begin in range(0, len(rows), batch_size):
+                cursor.executemany(sql, rows[begin:begin + batch_size])
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def rebuild_volume_spikes():
+    """从stock_data全量重建放量记录表"""
+    create_spike_table()
+    panel = load_price_panel(fields=SPIKE_FIELDS)
+    if panel.n_rows == 0:
+        print("数据库中没有数据，无需重建放量记录表")
+        return 0
+    spikes = scan_spikes(panel)
+    _save_spikes(spikes)
+    print(f"放量记录表重建完成，共 {len(spikes)} 条记录")
+    return len(spikes)
+
+
+def update_volume_spikes(df, engine=None):
+    """新K线导入后扫描当日放量并写入记录表
+
+    成交量口径直接使用指标表中增量维护的均量（需在 update_indicators 之后调用），
+    换手率、振幅口径在相关股票最近一段K线上计算均值。记录表为空时全量重建。
+    """
+    if df is None or len(df) == 0:
+        return 0
+    engine = engine if engine is not None else get_engine()
+    create_spike_table()
+
+    count = pd.read_sql("SELECT COUNT(*) AS total FROM stock_volume_spike", engine)['total'].iloc[0]
+    if count == 0:
+        return rebuild_volume_spikes()
+
+    codes = sorted(df['stock_code'].astype(str).unique().tolist())
+    new_dates = sorted(pd.to_datetime(df['trade_date']).dt.date.unique())
+    # 多取一个窗口的交易日，停牌过的股票也大多能凑满均值所需的K线
+    calendar = pd.read_sql("SELECT DISTINCT trade_date FROM stock_data WHERE trade_date <= %s "
+                           "ORDER BY trade_date DESC LIMIT %s",
+                           engine, params=(str(new_dates[-1]), int(2 * SPIKE_WINDOW + len(new_dates))))
+    start_date = min(pd.to_datetime(calendar['trade_date']).min().date(), new_dates[0])
+    panel = load_price_panel(fields=SPIKE_FIELDS, start_date=start_date, end_date=new_dates[-1], stock_codes=codes)
+    if panel.n_rows == 0:
+        return 0
+    new_days = (np.array(new_dates, dtype='datetime64[D]') - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+    rows = np.nonzero(np.isin(panel.day, new_days))[0]
+
+    ma_overrides = {}
+    if SPIKE_WINDOW in VOLUME_MA_WINDOWS:
+        column = 'vol_ma{}'.format(SPIKE_WINDOW)
+        stored = pd.read_sql(
+            "SELECT stock_code, trade_date, {} FROM stock_indicator WHERE trade_date IN ({})".format(
+                column, ', '.join(['%s'] * len(new_dates))),
+            engine, params=tuple(str(d) for d in new_dates))
+        if len(stored):
+            stored_days = (pd.to_datetime(stored['trade_date']).values.astype('datetime64[D]') -
+                           np.datetime64('1970-01-01', 'D')).astype(np.int64)
+            keys = pd.MultiIndex.from_arrays([stored['stock_code'].astype(str), stored_days])
+            lookup = pd.Series(stored[column].values, index=keys)
+            ma = rolling_mean(panel.values('volume'), SPIKE_WINDOW, panel.offsets)
+            row_keys = pd.MultiIndex.from_arrays([panel.codes[panel.stock_ids()[rows]], panel.day[rows].astype(np.int64)])
+            found = lookup.reindex(row_keys).values
+            # 指标表中已有的均量优先，缺失的（如指标表尚未建立）仍用面板上计算的值
+            ma[rows] = np.where(np.isnan(found), ma[rows], found)
+            ma_overrides['volume'] = ma
+
+    spikes = scan_spikes(panel, rows=rows, ma_overrides=ma_overrides)
+    _save_spikes(spikes)
+    print(f"已扫描 {len(new_dates)} 个交易日的放量，写入 {len(spikes)} 条记录")
+    return len(spikes)
+
+
+def _latest_spike_date(engine):
+    latest = pd.read_sql("SELECT MAX(trade_date) AS latest FROM stock_volume_spike", engine)['latest'].iloc[0]
+    return None if latest is None or pd.isna(latest) else latest
+
+
+def get_spikes(trade_date=None, variant='volume', multiple=SPIKE_MULTIPLE, engine=None):
+    """查询某个交易日（默认最新）放量倍数不低于 multiple 的股票，按倍数降序"""
+    if multiple < STORE_MULTIPLE:
+        raise ValueError("倍数不能低于入库门槛 {}".format(STORE_MULTIPLE))
+    engine = engine if engine is not None else get_engine()
+    trade_date = trade_date if trade_date is not None else _latest_spike_date(engine)
+    if trade_date is None:
+        return pd.DataFrame(columns=SPIKE_COLUMNS)
+    query = """
+    SELECT {} FROM stock_volume_spike
+    WHERE trade_date = %s AND variant = %s AND ratio >= %s
+    ORDER BY ratio DESC, stock_code
+    """.format(', '.join(SPIKE_COLUMNS))
+    return pd.read_sql(query, engine, params=(str(trade_date), variant, float(multiple)))
+
+
+def get_spike_clusters(days=5, min_spikes=3, variant='volume', multiple=SPIKE_MULTIPLE, as_of=None, engine=None):
+    """查询截至 as_of 最近 days 个交易日内放量次数不少于 min_spikes 的股票（连续/密集放量）"""
+    if multiple < STORE_MULTIPLE:
+        raise ValueError("倍数不能低于入库门槛 {}".format(STORE_MULTIPLE))
+    engine = engine if engine is not None else get_engine()
+    as_of = as_of if as_of is not None else _latest_spike_date(engine)
+    if as_of is None:
+        return pd.DataFrame()
+    calendar = pd.read_sql("SELECT DISTINCT trade_date FROM stock_data WHERE trade_date <= %s "
+                           "ORDER BY trade_date DESC LIMIT %s", engine, params=(str(as_of), int(days)))
+    start_date = pd.to_datetime(calendar['trade_date']).min().date() if not calendar.empty else as_of
+    query = """
+    SELECT stock_code, MAX(stock_name) AS stock_name, COUNT(*) AS spike_days, MAX(ratio) AS max_ratio,
+           MIN(trade_date) AS first_date, MAX(trade_date) AS last_date
+    FROM stock_volume_spike
+    WHERE trade_date BETWEEN %s AND %s AND variant = %s AND ratio >= %s
+    GROUP BY stock_code
+    HAVING COUNT(*) >= %s
+    ORDER BY spike_days DESC, max_ratio DESC, stock_code
+    """
+    return pd.read_sql(query, engine, params=(str(start_date), str(as_of), variant, float(multiple), int(min_spikes)))
+
+
+if __name__ == '__main__':
+    rebuild_volume_spikes()
+    print(get_spikes().head(50).to_string(index=False))
+    print(get_spike_clusters().head(50).to_string(index=False))
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+import json
+import time
+import warnings
+from stock_store import load_price_panel
+from screener import IndicatorCache
+from metrics import sharpe_ratio, max_drawdown
+from param_sweep import SWEEP_SPACES, param_grid, valid_params, signal_key, build_signals, backtest_params
+
+warnings.filterwarnings('ignore')
+
+# 默认窗口长度（交易日）：训练约2年，测试约半年，测试窗口首尾相接
+TRAIN_DAYS = 500
+TEST_DAYS = 120
+
+# 训练窗口中交易笔数不足时不参与选优
+MIN_TRADES = 30
+
+WINDOW_METRICS = ['交易笔数', '胜率(%)', '平均收益(%)', '收益t值', '窗口收益(%)', '夏普比率', '最大回撤(%)']
+
+
+def walk_forward_folds(n_days, train_days=TRAIN_DAYS, test_days=TEST_DAYS, step=None, expanding=False):
+    """按交易日序号切分训练/测试窗口，返回 [(train_start, train_end, test_start, test_end), ...]（闭区间）
+
+    rolling 时训练窗口长度固定为 train_days；expanding=True 时训练窗口始终从第0天开始。
+    step 为相邻两折的间隔，默认等于 test_days（测试窗口首尾相接），最后一折的测试窗口可以不满。
+    """
+    if train_days <= 0 or test_days <= 0:
+        raise ValueError("train_days 和 test_days 必须为正数")
+    step = step or test_days
+    folds = []
+    test_start = train_days
+    while test_start < n_days:
+        train_start = 0 if expanding else test_start - train_days
+        folds.append((train_start, test_start - 1, test_start, min(test_start + test_days, n_days) - 1))
+        test_start += step
+    return folds
+
+
+class TradeLedger():
+    """一组参数在全部历史上只回测一次的结果，按日期序号建立前缀和，任意窗口的统计只需两次二分查找
+
+    交易按卖出日和信号日各排序一次：训练窗口只统计窗口内已卖出的交易（不使用窗口之后的价格），
+    测试窗口统计窗口内发出信号的交易（即样本外实际会开的仓）。日度净值收益取对数后累加，
+    窗口收益由两个前缀和之差得到。
+    """
+    __slots__ = ('signal_index', 'signal_prefix', 'exit_index', 'exit_prefix', 'daily_log', 'log_prefix')
+
+    def __init__(self, panel, trades, equity):
+        date_index = panel.date_index()
+        net_return = trades['net_return'].values.astype(np.float64)
+        # 信号在买入K线的前一根
+        signal_index = date_index[trades['entry_row'].values - 1] if len(trades) else np.empty(0, dtype=np.int32)
+        exit_index = date_index[trades['exit_row'].values] if len(trades) else np.empty(0, dtype=np.int32)
+        self.signal_index, self.signal_prefix = self._prefix(signal_index, net_return)
+        self.exit_index, self.exit_prefix = self._prefix(exit_index, net_return)
+        self.daily_log = np.log1p(equity['daily_return'].values)
+        self.log_prefix = np.concatenate([[0.0], np.cumsum(self.daily_log)])
+
+    @staticmethod
+    def _prefix(index, values):
+        order = np.argsort(index, kind='stable')
+        stats = np.column_stack([np.ones(len(values)), values, values ** 2, values > 0])[order]
+        return index[order], np.vstack([np.zeros((1, 4)), np.cumsum(stats, axis=0)])
+
+    def window(self, start, end, by='signal'):
+        """第 start 至 end 个交易日（闭区间）的窗口指标，by='signal' 按信号日、by='exit' 按卖出日归属交易"""
+        index, prefix = (self.signal_index, self.signal_prefix) if by == 'signal' else (self.exit_index, self.exit_prefix)
+        lo = np.searchsorted(index, start, side='left')
+        hi = np.searchsorted(index, end, side='right')
+        count, total, squares, wins = prefix[hi] - prefix[lo]
+        result = dict.fromkeys(WINDOW_METRICS, np.nan)
+        result['交易笔数'] = int(round(count))
+        if count > 0:
+            mean = total / count
+            result['胜率(%)'] = wins / count * 100
+            result['平均收益(%)'] = mean
+            if count > 1:
+                std = np.sqrt(max(squares - total * mean, 0.0) / (count - 1))
+                result['收益t值'] = mean / std * np.sqrt(count) if std > 0 else np.nan
+        result['窗口收益(%)'] = (np.exp(self.log_prefix[end + 1] - self.log_prefix[start]) - 1) * 100
+        # 夏普比率和回撤不能由前缀和得到，只在窗口内的日收益片段上计算
+        if end >= start:
+            daily_return = np.expm1(self.daily_log[start:end + 1])
+            result['夏普比率'] = sharpe_ratio(daily_return)
+            result['最大回撤(%)'] = max_drawdown(daily_return) * 100
+        return result
+
+
+def build_ledgers(panel, strategy, points, cache=None):
+    """每个参数点在整个面板上回测一次并建立前缀和
+
+    指标和信号都是因果的（只用当日及以前的数据），在全历史上算一次后，每个窗口的信号与单独在该窗口
+    计算完全相同（窗口开头的指标预热期除外），所以各窗口之间无需重算；cache 在参数点之间共享均线、连涨天数等中间结果。
+    """
+    cache = cache if cache is not None else IndicatorCache(panel)
+    ledgers = []
+    last_key, signals = None, None
+    for params in sorted(points, key=lambda params: str(signal_key(strategy, params))):
+        key = signal_key(strategy, params)
+        if key != last_key:
+            last_key, signals = key, build_signals(panel, strategy, params, cache)
+        trades, equity = backtest_params(panel, strategy, params, signals=signals)
+        ledgers.append((params, TradeLedger(panel, trades, equity)))
+    return ledgers
+
+
+def _rank_ic(train_values, test_values):
+    """训练期与测试期指标的秩相关（Spearman），衡量参数排名在样本外是否保持"""
+    data = pd.DataFrame({'train': train_values, 'test': test_values}).dropna()
+    if len(data) < 3:
+        return np.nan
+    return data['train'].rank().corr(data['test'].rank())
+
+
+def run_walk_forward(strategy, points=None, panel=None, train_days=TRAIN_DAYS, test_days=TEST_DAYS, step=None,
+                     expanding=False, objective='平均收益(%)', min_trades=MIN_TRADES):
+    """滚动/扩展窗口的样本外验证，返回 (各折明细, 稳定性报告)
+
+    每个训练窗口按 objective 选出最优参数（交易笔数不少于 min_trades），记录其在紧随的测试窗口中的表现，
+    并计算全部参数训练期与测试期 objective 的秩相关。每个参数点只回测一次，
+    每一折只做前缀和查询，耗时随折数线性增长，而不是 折数×历史长度。
+    """
+    if objective not in WINDOW_METRICS:
+        raise ValueError("objective 只能为 {} 之一".format(WINDOW_METRICS))
+    begin = time.perf_counter()
+    points = param_grid(SWEEP_SPACES[strategy]) if points is None else points
+    points = [params for params in points if valid_params(strategy, params)]
+    if panel is None:
+        panel = load_price_panel()
+    calendar = panel.calendar()
+    folds = walk_forward_folds(len(calendar), train_days, test_days, step, expanding)
+    if not folds:
+        print(f"交易日数 {len(calendar)} 不足一个训练窗口")
+        return pd.DataFrame(), {}
+
+    ledgers = build_ledgers(panel, strategy, points)
+    backtest_seconds = time.perf_counter() - begin
+
+    rows = []
+    for k, (train_start, train_end, test_start, test_end) in enumerate(folds):
+        train = [ledger.window(train_start, train_end, by='exit') for _, ledger in ledgers]
+        test = [ledger.window(test_start, test_end, by='signal') for _, ledger in ledgers]
+        scores = np.array([metrics[objective] if metrics['交易笔数'] >= min_trades else np.nan for metrics in train],
+                          dtype=np.float64)
+        row = {
+            'fold': k,
+            'train_start': calendar[train_start].astype('datetime64[D]'),
+            'train_end': calendar[train_end].astype('datetime64[D]'),
+            'test_start': calendar[test_start].astype('datetime64[D]'),
+            'test_end': calendar[test_end].astype('datetime64[D]'),
+            'rank_ic': _rank_ic(scores, [metrics[objective] for metrics in test])
+        }
+        if np.isfinite(scores).any():
+            best = int(np.nanargmax(scores))
+            row['params'] = json.dumps(ledgers[best][0], ensure_ascii=False, default=str)
+            row['train_' + objective] = scores[best]
+            for col in WINDOW_METRICS:
+                row['test_' + col] = test[best][col]
+        else:
+            row['params'] = None
+        rows.append(row)
+
+    folds = pd.DataFrame(rows)
+    report = stability_report(folds, objective)
+    report['回测耗时(秒)'] = backtest_seconds
+    report['总耗时(秒)'] = time.perf_counter() - begin
+    print(f"{strategy} 前推验证：{len(points)} 个参数点，{len(folds)} 折，回测 {backtest_seconds:.1f} 秒，"
+          f"合计 {report['总耗时(秒)']:.1f} 秒")
+    return folds, report
+
+
+def stability_report(folds, objective='平均收益(%)'):
+    """汇总各折样本外表现和参数稳定性：样本外均值/标准差、为正的折数占比、训练到测试的衰减、
+    秩相关均值，以及被选中次数最多的参数及相邻两折参数切换的次数"""
+    chosen = folds.dropna(subset=['params']) if 'params' in folds else folds.iloc[0:0]
+    if chosen.empty:
+        return {'折数': len(folds), '有效折数': 0}
+    test_values = chosen['test_' + objective]
+    window_returns = chosen['test_窗口收益(%)'].fillna(0) / 100
+    counts = chosen['params'].value_counts()
+    return {
+        '折数': len(folds),
+        '有效折数': len(chosen),
+        '样本外' + objective + '均值': test_values.mean(),
+        '样本外' + objective + '标准差': test_values.std(),
+        '样本外为正的折数占比(%)': (test_values > 0).mean() * 100,
+        '训练期' + objective + '均值': chosen['train_' + objective].mean(),
+        # 训练期最优值到样本外的平均衰减，越接近0说明选优越不依赖过拟合
+        '样本外衰减': test_values.mean() - chosen['train_' + objective].mean(),
+        '样本外累计收益(%)': (np.prod(1 + window_returns) - 1) * 100,
+        '秩相关均值': folds['rank_ic'].mean(),
+        '最常选中参数': counts.index[0],
+        '最常选中占比(%)': counts.iloc[0] / len(chosen) * 100,
+        '参数切换次数': int((chosen['params'] != chosen['params'].shift()).sum() - 1)
+    }
+
+
+if __name__ == '__main__':
+    panel = load_price_panel()
+    folds, report = run_walk_forward('streak', panel=panel)
+    print(folds.to_string(index=False))
+    for name, value in report.items():
+        print(f"{name}: {value}")